@@ -1,231 +1,203 @@
 import streamlit as st
+import hashlib
 import os
-import tempfile
-import pyodbc
-import sqlite3
-import zipfile
-import numpy as np
 import pandas as pd
-from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime
+from importlib.machinery import ModuleSpec
+
+from conexoes import conexao_sqlite, contadores_execucao, contadores_totais, zerar_contadores_execucao
+from excel_io import gerar_excel_download, ler_referencia
+from perfil import encerrar_perfil, gravar_metricas, iniciar_perfil, medir_etapa, novo_registro
+from historico import (
+    contas_vendedor_ao_longo_do_tempo, criar_tabela_historico, importar_planilha_contas_rotacionadas,
+    ler_contas_rotacionadas, marca_dagua_historico, opcoes_filtro_historico, pagina_historico, resumo_rotacoes_mes
+)
+from pipeline import (
+    CAMINHO_VENDEDORES, GRUPOS, buscar_dados_erp as buscar_dados_erp_pipeline,
+    calcular_data_limite, carregar_vendedores_grupo, criar_tabela_vendedores, particionar_por_grupo,
+    preparar_base
+)
+from simulacao import SIMULACOES_PADRAO, simular_rotacoes
+from tarefas import (
+    CONCLUIDA, ESTADOS_ATIVOS, enviar_tarefa, limpar_tarefas, listar_tarefas, marcar_interrompidas, obter_tarefa,
+    tarefa_ativa, tarefa_relatorios, tarefa_rotacao
+)
+from cache_snapshot import garantir_snapshot, invalidar_snapshot, obter_snapshot, ler_manifesto, valores_distintos_snapshot
 
 import warnings
 warnings.filterwarnings('ignore')
 
-def connect_db():
-    conn = sqlite3.connect("vendedores.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS vendedores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL UNIQUE,
-            tipo TEXT NOT NULL CHECK(tipo IN ('Distribuição', 'Corporativo'))
-        )
-    """)
-    conn.commit()
-    return conn
+# Os processos dos relatórios e da simulação (forkserver/spawn) reimportariam este script pelo caminho e
+# rodariam a página inteira dentro deles. Com um __spec__ de nome '__main__' o multiprocessing não reimporta
+# o script; as funções dos processos ficam em relatorios.py e simulacao.py.
+__spec__ = ModuleSpec('__main__', None)
+
+# Esquema dos bancos locais criado uma única vez por processo, não a cada rerun
+@st.cache_resource
+def iniciar_bancos():
+    criar_tabela_vendedores()
+    criar_tabela_historico()
+    importar_planilha_contas_rotacionadas()
+    # Tarefas cujo processo parou não vão terminar; as terminadas há muito tempo saem com as suas saídas
+    marcar_interrompidas()
+    limpar_tarefas()
+    return True
 
 def carregar_vendedores():
-    conn = sqlite3.connect("vendedores.db")
-    df = pd.read_sql("SELECT nome, tipo FROM vendedores", conn)
-    return df
-
-def criar_tabela_historico():
-        conn = sqlite3.connect('historico_rotacao.db')
-        c = conn.cursor()
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS historico_rotacao (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_vendedor TEXT,
-            conta_id INTEGER,
-            tipo_rotacao TEXT,
-            data_rotacao TEXT
-        )
-        ''')
-        conn.commit()
-        conn.close()
+    with conexao_sqlite(CAMINHO_VENDEDORES) as conn:
+        return pd.read_sql("SELECT nome, tipo FROM vendedores", conn)
 
-criar_tabela_historico()
+def alterar_vendedores(sql, parametros):
+    with conexao_sqlite(CAMINHO_VENDEDORES) as conn:
+        with conn:
+            conn.execute(sql, parametros)
 
 # ---------- CONFIGURAÇÕES INICIAIS ----------
 st.set_page_config(page_title="Rotação de Carteiras", layout="wide")
 st.title("🔁 Sistema de Rotação de Carteiras")
 
-# ---------- CONEXÃO COM BANCO DE DADOS ----------
-@st.cache_data
-def carregar_dados_sql():
-    server = st.secrets["DB_SERVER"]
-    database = st.secrets["DB_NAME"]
-    username = st.secrets["DB_USER"]
-    password = st.secrets["DB_PASSWORD"]
-
-    connection_string = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={server};DATABASE={database};UID={username};PWD={password}"
+zerar_contadores_execucao()
+iniciar_bancos()
+
+# Tempo, linhas e pico de memória por etapa desta execução (painel no fim da página e metricas_execucao.csv).
+# Com ?perfil=1 na URL a execução inteira também passa pelo cProfile.
+registro_etapas = novo_registro('app')
+perfilador = iniciar_perfil() if st.query_params.get("perfil") == "1" else None
+
+# ---------- TAREFAS EM SEGUNDO PLANO ----------
+# Rotação e relatórios rodam numa thread do servidor; o id fica na sessão e na URL (?rotacao=, ?relatorios=),
+# então recarregar a página ou reconectar retoma a mesma tarefa
+def tarefa_da_sessao(chave):
+    tarefa_id = st.session_state.get(chave) or st.query_params.get(chave)
+    try:
+        tarefa_id = int(tarefa_id)
+    except (TypeError, ValueError):
+        # URL editada à mão (?rotacao=abc, ?relatorios=): descarta o parâmetro em vez de quebrar a página
+        st.session_state.pop(chave, None)
+        st.query_params.pop(chave, None)
+        return None
+    return obter_tarefa(tarefa_id)
+
+def acompanhar_tarefa(chave, tarefa_id):
+    st.session_state[chave] = tarefa_id
+    st.query_params[chave] = str(tarefa_id)
+
+@st.fragment(run_every=1)
+def progresso_tarefa(tarefa_id):
+    # Só este trecho roda a cada segundo; quando a tarefa termina, a página inteira roda de novo
+    tarefa = obter_tarefa(tarefa_id)
+    if tarefa['estado'] not in ESTADOS_ATIVOS:
+        st.rerun()
+    total = tarefa['total'] or 0
+    st.progress(
+        min(tarefa['progresso'] / total, 1.0) if total else 0.0,
+        text=f"Tarefa {tarefa_id} ({tarefa['tipo']}, {tarefa['estado']}): {tarefa['mensagem'] or 'aguardando'}"
     )
 
-    conn = pyodbc.connect(connection_string)
-
-    query = """-- CTEs para pré-processamento
-WITH Faturamento AS (
-    SELECT pessoa_id, SUM(valor_total) AS valor_total
-    FROM dbo.rel_faturamento
-    WHERE data_emissao >= DATEADD(MONTH, -6, GETDATE())
-    GROUP BY pessoa_id
-),
-Followups AS (
-    SELECT pessoa_id, COUNT(*) AS total_followups, MAX(data_cadastro) AS data_ultimo_followup
-    FROM dbo.pessoas_followup_anexos
-    GROUP BY pessoa_id
-),
-Contatos AS (
-    SELECT pessoa_id, COUNT(*) AS total_contatos, MAX(data_cadastro) AS data_ultimo_contato
-    FROM dbo.contatos
-    GROUP BY pessoa_id
-),
-Oportunidades AS (
-    SELECT 
-        conta_id AS pessoa_id, 
-        COUNT(*) AS total_oportunidades, 
-        MAX(data_cadastro) AS data_ultima_oportunidade
-    FROM dbo.crm_oportunidades
-    GROUP BY conta_id
-),
-UltimaVendaPorRaizCNPJ AS (
-    SELECT LEFT(cpf_cnpj, 8) AS Raiz_CNPJ, MAX(data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ
-    FROM dbo.pessoas
-    WHERE data_ultima_venda IS NOT NULL
-    GROUP BY LEFT(cpf_cnpj, 8)
-),
-Pedidos AS (
-    SELECT 
-        pessoa_id,
-        COUNT(*) AS total_pedidos
-    FROM dbo.rel_faturamento
-    WHERE data_emissao >= DATEADD(MONTH, -6, GETDATE())
-    GROUP BY pessoa_id
-),
-Orcamentos AS (
-    SELECT 
-        pessoa_cliente_id,
-        COUNT(*) AS total_orcamentos,
-        MAX(data_emissao) AS data_ultimo_orcamento
-    FROM dbo.rel_crm_orcamentos
-    GROUP BY pessoa_cliente_id
-)
+def mostrar_falha(tarefa):
+    st.error(f"Tarefa {tarefa['id']} ({tarefa['tipo']}) terminou como '{tarefa['estado']}'. Nada dela foi gravado no histórico.")
+    if tarefa['erro']:
+        with st.expander("Detalhes do erro"):
+            st.code(tarefa['erro'])
+
+# ---------- CONEXÃO COM BANCO DE DADOS ----------
+# Carga incremental: só a janela recente do ERP é relida para os agregados locais
+def buscar_dados_erp(forcar_completa=False):
+    return buscar_dados_erp_pipeline(st.secrets, forcar_completa=forcar_completa)
+
+# Snapshot em disco (Arrow) compartilhado entre reinícios e processos, válido por TTL_SNAPSHOT_HORAS
+PASTA_SNAPSHOT = 'snapshot_erp'
+TTL_SNAPSHOT_HORAS = float(st.secrets.get("SNAPSHOT_TTL_HORAS", 12))
 
--- Query principal
-SELECT 
-    a.id AS Conta_ID,
-    a.tipo_conta,
-    b.razao_social AS Razao_Social_Pessoas,
-    b.cpf_cnpj AS CNPJ,
-    LEFT(b.cpf_cnpj, 8) AS Raiz_CNPJ,
-    c.grupo_id AS Grupo_Econômico_ID,
-    c.grupo_nome AS Grupo_Econômico_Nome,
-    v.razao_social AS Nome_Vendedor,
-    b.data_ultima_venda AS Data_Ultima_Venda_Individual,
-    COALESCE(f.valor_total, 0) AS Faturamento_6_Meses,
-    a.data_cadastro AS Data_Abertura_Conta,
-    COALESCE(p.total_pedidos, 0) AS Total_Pedidos,
-    COALESCE(g.Data_Ultima_Venda_Grupo_CNPJ, b.data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ,
-    COALESCE(fu.total_followups, 0) AS Total_Followups,
-    fu.data_ultimo_followup AS Data_Ultimo_Followup,
-    COALESCE(ct.total_contatos, 0) AS Total_Contatos,
-    ct.data_ultimo_contato AS Data_Ultimo_Contato,
-    COALESCE(o.total_oportunidades, 0) AS Total_Oportunidades,
-    o.data_ultima_oportunidade AS Data_Ultima_Oportunidade,
-    a.classificacao_id AS Classificacao_Conta,
-    b.classificacao_id AS Classificacao_Pessoa,
-    a.porte_id AS Porte_Empresa,
-
-    -- Total e último orçamento por cliente
-    (
-        SELECT COUNT(*) 
-        FROM dbo.rel_crm_orcamentos d
-        WHERE d.pessoa_cliente_id = b.id
-    ) AS Total_Orcamentos,
-
-    (
-        SELECT MAX(data_emissao)
-        FROM dbo.rel_crm_orcamentos d
-        WHERE d.pessoa_cliente_id = b.id
-    ) AS Data_Ultimo_Orcamento
-
-FROM
-    grupofort.dbo.crm_contas a
-    INNER JOIN dbo.pessoas b ON a.cliente_id = b.id
-    INNER JOIN dbo.rel_pessoas c ON b.id = c.id
-    INNER JOIN dbo.pessoas v ON a.vendedor_id = v.id
-    LEFT JOIN Faturamento f ON a.cliente_id = f.pessoa_id
-    LEFT JOIN Followups fu ON b.id = fu.pessoa_id
-    LEFT JOIN Contatos ct ON b.id = ct.pessoa_id
-    LEFT JOIN Oportunidades o ON a.id = o.pessoa_id
-    LEFT JOIN UltimaVendaPorRaizCNPJ g ON LEFT(b.cpf_cnpj, 8) = g.Raiz_CNPJ
-    LEFT JOIN Pedidos p ON a.cliente_id = p.pessoa_id
-
-WHERE
-    a.tipo_conta = 2
-    AND a.excluido = 0
-    AND a.status_conta = 0
-    AND b.classificacao_id <> 1
-    AND a.classificacao_id <> 1;
-"""
-    df = pd.read_sql(query, conn)
-    conn.close()
+# 'pandas' ou 'duckdb' (pacote opcional): motor da derivação da base e da classificação dos relatórios
+MOTOR_CONSULTAS = st.secrets.get("MOTOR_CONSULTAS", "pandas")
+
+# Só o manifesto (versão e linhas): reruns não leem nem copiam a base de contas
+def garantir_dados_sql():
+    return garantir_snapshot(buscar_dados_erp, PASTA_SNAPSHOT, ttl_horas=TTL_SNAPSHOT_HORAS)
+
+# Base inteira: lida só quando preparar_base_memorizada precisa recalcular
+def carregar_dados_sql():
+    df, _ = obter_snapshot(buscar_dados_erp, PASTA_SNAPSHOT, ttl_horas=TTL_SNAPSHOT_HORAS)
     return df
 
-# ---------- SELEÇÃO DE GRUPO DE VENDEDORES ----------
+manifesto_snapshot = ler_manifesto(PASTA_SNAPSHOT)
+col_snapshot, col_atualizar = st.columns([8, 2])
+with col_snapshot:
+    if manifesto_snapshot and not manifesto_snapshot.get('invalidado'):
+        st.caption(f"🗄️ Base do ERP carregada em {manifesto_snapshot['criado_em'].replace('T', ' ')} ({manifesto_snapshot['linhas']} contas)")
+    else:
+        st.caption("🗄️ Base do ERP será carregada no próximo uso.")
+with col_atualizar:
+    if st.button("🔄 Atualizar base agora", help="Ressincroniza do zero com o ERP, inclusive linhas antigas alteradas ou excluídas"):
+        # Invalida antes de ressincronizar: se o ERP falhar, nenhuma sessão (nem rodar_rotacao.py) segue com a base antiga
+        invalidar_snapshot(PASTA_SNAPSHOT)
+        with st.spinner("Ressincronizando a base do ERP..."):
+            garantir_snapshot(lambda: buscar_dados_erp(forcar_completa=True), PASTA_SNAPSHOT)
+        st.rerun()
 
-conn = connect_db()
-cursor = conn.cursor()
-df_vendedores = carregar_vendedores()
+# ---------- SELEÇÃO DE GRUPO DE VENDEDORES ----------
 
-st.markdown("#### 🛠️ **Gerencie o cadastro de seus vendedores ⬇️**")
-with st.expander("Clique aqui para expandir"):
+# Nomes de vendedores do ERP para a caixa de cadastro: só a coluna Nome_Vendedor do snapshot,
+# memorizada pela versão do snapshot (não copia a base de contas a cada clique)
+@st.cache_data(show_spinner=False)
+def nomes_vendedores_empresa(versao_snapshot):
+    manifesto = garantir_dados_sql()
+    return valores_distintos_snapshot(PASTA_SNAPSHOT, 'Nome_Vendedor', manifesto)
+
+VENDEDORES_POR_PAGINA = 15
+OPCAO_OUTRO_VENDEDOR = "Outro (digitar manualmente)"
+
+# Cadastro isolado num fragmento: cadastrar, remover, buscar e paginar só reexecutam este trecho.
+# O restante da página passa a usar o cadastro novo na próxima execução completa.
+@st.fragment
+def gerenciar_vendedores():
+    df_vendedores = carregar_vendedores()
+    # Avisos gravados pelos callbacks (que rodam antes do fragmento) aparecem aqui
+    if "aviso_vendedores" in st.session_state:
+        texto, icone = st.session_state.pop("aviso_vendedores")
+        st.toast(texto, icon=icone)
     col1, col2 = st.columns(2)
 
+    def cadastrar_vendedor():
+        nome = st.session_state.novo_vendedor
+        if nome == OPCAO_OUTRO_VENDEDOR:
+            nome = st.session_state.get("novo_vendedor_manual", "")
+        nome = nome.strip()
+        if nome == "":
+            st.session_state.aviso_vendedores = ("Digite um nome válido.", "⚠️")
+        elif nome in df_vendedores["nome"].values:
+            st.session_state.aviso_vendedores = ("Esse nome já está cadastrado.", "⚠️")
+        else:
+            alterar_vendedores("INSERT INTO vendedores (nome, tipo) VALUES (?, ?)", (nome, st.session_state.novo_vendedor_tipo))
+            st.session_state.aviso_vendedores = (f"{nome} adicionado com sucesso!", "✅")
+
     with col1:
         st.markdown("### ➕ Cadastrar vendedor")
-        df_dados_empresa = carregar_dados_sql()
-        nomes_vendedores_empresa = sorted(df_dados_empresa['Nome_Vendedor'].dropna().unique().tolist())
-
         # Adiciona opções extras
-        opcoes = [""] + nomes_vendedores_empresa + ["Outro (digitar manualmente)"]
+        opcoes = [""] + nomes_vendedores_empresa((manifesto_snapshot or {}).get('versao')) + [OPCAO_OUTRO_VENDEDOR]
 
         nome = st.selectbox(
             "Digite ou selecione o nome do vendedor",
             options=opcoes,
             index=0,  # começa vazio
-            placeholder="Busque ou digite o nome..."
+            placeholder="Busque ou digite o nome...",
+            key="novo_vendedor"
         )
 
         # Se escolher "Outro", mostrar campo manual
-        if nome == "Outro (digitar manualmente)":
-            nome = st.text_input("Digite o nome manualmente")
-        tipo = st.selectbox("Tipo", ["Distribuição", "Corporativo"])
-        if st.button("Cadastrar vendedor"):
-            if nome.strip() == "":
-                st.warning("Digite um nome válido.")
-            elif nome in df_vendedores["nome"].values:
-                st.warning("Esse nome já está cadastrado.")
-            else:
-                cursor.execute("INSERT INTO vendedores (nome, tipo) VALUES (?, ?)", (nome.strip(), tipo))
-                conn.commit()
-                st.success(f"{nome} adicionado com sucesso!")
-                st.rerun()
+        if nome == OPCAO_OUTRO_VENDEDOR:
+            st.text_input("Digite o nome manualmente", key="novo_vendedor_manual")
+        st.selectbox("Tipo", ["Distribuição", "Corporativo"], key="novo_vendedor_tipo")
+        st.button("Cadastrar vendedor", on_click=cadastrar_vendedor)
 
     with col2:
         st.markdown("### Lista de vendedores")
 
-        distribuidores = df_vendedores[df_vendedores["tipo"] == "Distribuição"]["nome"].tolist()
-        corporativos = df_vendedores[df_vendedores["tipo"] == "Corporativo"]["nome"].tolist()
-
         def remover_vendedor(nome):
-            cursor.execute("DELETE FROM vendedores WHERE nome = ?", (nome,))
-            conn.commit()
-            st.success(f"Vendedor '{nome}' removido com sucesso.")
-            st.rerun()
+            alterar_vendedores("DELETE FROM vendedores WHERE nome = ?", (nome,))
+            st.session_state.confirma_remocao = None
+            st.session_state.aviso_vendedores = (f"Vendedor '{nome}' removido com sucesso.", "🗑️")
 
         # Inicializa a variável de confirmação no estado da sessão, se não existir
         if "confirma_remocao" not in st.session_state:
@@ -237,53 +209,45 @@ with st.expander("Clique aqui para expandir"):
         def cancelar_remocao():
             st.session_state.confirma_remocao = None
 
-        st.markdown("#### Distribuição")
-        if distribuidores:
-            for nome in distribuidores:
-                if st.session_state.confirma_remocao == nome:
-                    st.warning(f"Tem certeza que deseja remover **{nome}**?")
-                    col_a, col_b = st.columns(2)
-                    with col_a:
-                        if st.button("✅ Confirmar remoção", key=f"confirmar_{nome}"):
-                            remover_vendedor(nome)
-                    with col_b:
-                        if st.button("❌ Cancelar", key=f"cancelar_{nome}"):
-                            cancelar_remocao()
-                else:
-                    col1, col2 = st.columns([8,1])
-                    with col1:
-                        st.write(nome)
-                    with col2:
-                        st.button(f"❌", key=f"remover_dist_{nome}", on_click=pedir_confirmacao, args=(nome,))
-        else:
-            st.write("_Nenhum vendedor cadastrado._")
+        col_busca, col_tipo = st.columns([3, 2])
+        with col_busca:
+            busca = st.text_input("Buscar vendedor", placeholder="Parte do nome...")
+        with col_tipo:
+            filtro_tipo = st.selectbox("Grupo", ["Todos", "Distribuição", "Corporativo"])
 
-        st.markdown("#### Corporativo")
-        if corporativos:
-            for nome in corporativos:
-                if st.session_state.confirma_remocao == nome:
-                    st.warning(f"Tem certeza que deseja remover **{nome}**?")
-                    col_a, col_b = st.columns(2)
-                    with col_a:
-                        if st.button("✅ Confirmar remoção", key=f"confirmar_{nome}"):
-                            remover_vendedor(nome)
-                    with col_b:
-                        if st.button("❌ Cancelar", key=f"cancelar_{nome}"):
-                            cancelar_remocao()
-                else:
-                    col1, col2 = st.columns([8,1])
-                    with col1:
-                        st.write(nome)
-                    with col2:
-                        st.button(f"❌", key=f"remover_dist_{nome}", on_click=pedir_confirmacao, args=(nome,))
-        else:
+        lista = df_vendedores.sort_values(["tipo", "nome"], key=lambda coluna: coluna.str.lower())
+        if busca:
+            lista = lista[lista["nome"].str.contains(busca.strip(), case=False, regex=False)]
+        if filtro_tipo != "Todos":
+            lista = lista[lista["tipo"] == filtro_tipo]
+
+        total_paginas = max(1, -(-len(lista) // VENDEDORES_POR_PAGINA))
+        pagina = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas, value=1) if total_paginas > 1 else 1
+        inicio = (pagina - 1) * VENDEDORES_POR_PAGINA
+        st.caption(f"{len(lista)} vendedor(es) encontrados")
+
+        if lista.empty:
             st.write("_Nenhum vendedor cadastrado._")
+        for nome, tipo_vendedor in lista.iloc[inicio:inicio + VENDEDORES_POR_PAGINA][["nome", "tipo"]].itertuples(index=False):
+            if st.session_state.confirma_remocao == nome:
+                st.warning(f"Tem certeza que deseja remover **{nome}**?")
+                col_a, col_b = st.columns(2)
+                with col_a:
+                    st.button("✅ Confirmar remoção", key=f"confirmar_{nome}", on_click=remover_vendedor, args=(nome,))
+                with col_b:
+                    st.button("❌ Cancelar", key=f"cancelar_{nome}", on_click=cancelar_remocao)
+            else:
+                col_nome, col_remover = st.columns([8, 1])
+                with col_nome:
+                    st.write(f"{nome} · _{tipo_vendedor}_")
+                with col_remover:
+                    st.button("❌", key=f"remover_{nome}", on_click=pedir_confirmacao, args=(nome,))
+
+st.markdown("#### 🛠️ **Gerencie o cadastro de seus vendedores ⬇️**")
+with st.expander("Clique aqui para expandir"):
+    gerenciar_vendedores()
 
-query = "SELECT nome FROM vendedores WHERE tipo = ?"
-cursor.execute(query, ('Distribuição',))
-vendedores_ativos_helder = [
-    row[0] for row in cursor.fetchall()
-]
+vendedores_ativos_helder = carregar_vendedores_grupo('distribuicao')
 
 # 'Bryan Casarotto',
 # 'Daniele Schmitz',
@@ -297,11 +261,7 @@ vendedores_ativos_helder = [
 # 'TALIA LINS RAMOS',
 # 'Willian Luiz Pereira'
 
-query = "SELECT nome FROM vendedores WHERE tipo = ?"
-cursor.execute(query, ('Corporativo',))
-vendedores_ativos_karen = [
-    row[0] for row in cursor.fetchall()
-]
+vendedores_ativos_karen = carregar_vendedores_grupo('corporativo')
 
 # 'Amanda Dias do Amaral',
 # 'CRISTIAN RHEINHEIMER',
@@ -319,235 +279,220 @@ vendedores_ativos_karen = [
 # 'Sidinei Da Silva Dias',
 # 'TIAGO PEDROSO DA SILVA'
 
-opcao = st.selectbox("Escolha o grupo de vendedores:", ["Distribuição (Helder)", "Corporativo (Karen)"])
-vendedores_ativos = vendedores_ativos_helder if "Helder" in opcao else vendedores_ativos_karen
-pasta_relatorios = 'Relatorio_Vendedores_Helder' if "Helder" in opcao else 'Relatorio_Vendedores_Karen'
+# "Ambos" rotaciona os dois grupos na mesma passada: uma derivação, uma partição e os sorteios em paralelo
+OPCOES_GRUPO = {
+    "Distribuição (Helder)": ['distribuicao'],
+    "Corporativo (Karen)": ['corporativo'],
+    "Ambos os grupos (Helder e Karen)": ['distribuicao', 'corporativo'],
+}
+opcao = st.selectbox("Escolha o grupo de vendedores:", list(OPCOES_GRUPO))
+vendedores_por_grupo = {
+    grupo: {'distribuicao': vendedores_ativos_helder, 'corporativo': vendedores_ativos_karen}[grupo]
+    for grupo in OPCOES_GRUPO[opcao]
+}
 
 st.markdown('------')
 # ---------- LEITURA DA REFERÊNCIA ----------
 st.markdown('#### 1-Faça o upload do arquivo: historico de rotação com a data mais recente ☁️')
-arquivo_referencia = st.file_uploader("📤 Clique em 'Drag and Drop' ou 'Browse files', selecione o arquivo com a data mais recente e envie o arquivo (histórico de rotação de carteiras):", type=["xlsx"])
+arquivo_referencia = st.file_uploader("📤 Clique em 'Drag and Drop' ou 'Browse files', selecione o arquivo com a data mais recente e envie o arquivo (histórico de rotação de carteiras):", type=["xlsx", "csv", "parquet"])
 
-if arquivo_referencia:
-    df = carregar_dados_sql()
-    df = df.drop_duplicates(subset='Raiz_CNPJ')
-    referencia = pd.read_excel(arquivo_referencia, sheet_name='Planilha1')
-
-    # --- Carregar data de rotação por conta_id ---
-    conn = sqlite3.connect('historico_rotacao.db')
-    df_rotacao = pd.read_sql_query('''
-        SELECT conta_id, MAX(data_rotacao) as data_ultima_rotacao 
-        FROM historico_rotacao 
-        GROUP BY conta_id
-    ''', conn)
-    conn.close()
-
-    df_rotacao['data_ultima_rotacao'] = pd.to_datetime(df_rotacao['data_ultima_rotacao'])
-
-    df_rotacao['conta_id'] = df_rotacao['conta_id'].apply(
-    lambda x: int.from_bytes(x, byteorder='little') if isinstance(x, bytes) else int(x)
-    )
-
-
-    df['Raiz_CNPJ'] = df['Raiz_CNPJ'].astype(str).str.strip().str.zfill(14)
-    referencia['Raiz_CNPJ'] = referencia['Raiz_CNPJ'].astype(str).str.strip().str.zfill(14)
-    dict_transferencia = dict(zip(referencia['Raiz_CNPJ'], referencia['Nome_Vendedor']))
-
-    # Adiciona a coluna 'data_ultima_rotacao' com base no Conta_ID
-    df = df.merge(df_rotacao, how='left', left_on='Conta_ID', right_on='conta_id')
-
-    # Atualiza o Nome_Vendedor do df conforme a referência
-    df['Nome_Vendedor'] = df.apply(
-        lambda row: dict_transferencia[row['Raiz_CNPJ']] if row['Raiz_CNPJ'] in dict_transferencia else row['Nome_Vendedor'],
-        axis=1
-    )
+# Base derivada do upload, memorizada entre reruns. A chave é o conteúdo do arquivo enviado, a versão
+# do snapshot do ERP, a marca d'água do histórico, o cadastro de vendedores e o dia (data_limite).
+# Os DataFrames devolvidos são compartilhados entre reruns: ninguém os altera no lugar.
+@st.cache_resource(max_entries=4, show_spinner="Processando a base enviada...")
+def preparar_base_memorizada(hash_referencia, nome_arquivo, versao_snapshot, marca_historico, vendedores_ativos, data_limite, motor, _arquivo):
+    referencia = ler_referencia(_arquivo)
+    return preparar_base(carregar_dados_sql(), referencia, list(vendedores_ativos), data_limite, motor)
 
-
-    # Agora você pode adicionar a data de entrada
-    df['Data_Entrou_Carteira'] = np.where(
-        df['Raiz_CNPJ'].isin(referencia['Raiz_CNPJ']),
-        pd.Timestamp('2025-03-20'),
-        pd.NaT
-    )
-
-    # Lógica de status
-    data_limite = datetime.today() - timedelta(days=6*30)
-
-    df['Faturamento_6_Meses'] = pd.to_numeric(df['Faturamento_6_Meses'], errors='coerce').fillna(0)
-
-    df['Status_Cliente'] = df['Data_Ultima_Venda_Grupo_CNPJ'].apply(
-        lambda x: 'Nao Compra' if pd.isna(x) or x < data_limite else 'Compra'
-    )
-
-    # --- Garantir tipos corretos ---
-    df['Data_Ultimo_Contato'] = pd.to_datetime(df['Data_Ultimo_Contato'], errors='coerce')
-    df['Data_Ultimo_Followup'] = pd.to_datetime(df['Data_Ultimo_Followup'], errors='coerce')
-    df['Data_Entrou_Carteira'] = pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce')
-    df['Data_Ultimo_Orcamento'] = pd.to_datetime(df['Data_Ultimo_Orcamento'], errors='coerce')
-
-    # --- Contatos e Follow-ups após rotação ---
-    df['Total_Contatos_Rotacao'] = df.apply(
-        lambda row: row['Total_Contatos'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                            pd.notna(row['Data_Ultimo_Contato']) and
-                                            pd.notna(row['data_ultima_rotacao']) and
-                                            row['Data_Ultimo_Contato'] >= row['Data_Entrou_Carteira']
-                    else 0,
-        axis=1
-    )
-
-    df['Total_Followups_Rotacao'] = df.apply(
-        lambda row: row['Total_Followups'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                            pd.notna(row['Data_Ultimo_Followup']) and
-                                            pd.notna(row['data_ultima_rotacao']) and
-                                            row['Data_Ultimo_Followup'] >= row['Data_Entrou_Carteira']
-                    else 0,
-        axis=1
-    )
-
-    df['Total_Orcamentos_Rotacao'] = df.apply(
-    lambda row: row['Total_Orcamentos'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                              pd.notna(row['Data_Ultimo_Orcamento']) and
-                                              pd.notna(row['data_ultima_rotacao']) and
-                                              row['Data_Ultimo_Orcamento'] >= row['Data_Entrou_Carteira']
-                else 0,
-    axis=1
-    )
-
-    df['Total_Oportunidades_Rotacao'] = df.apply(
-        lambda row: row['Total_Oportunidades'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                                pd.notna(row['Data_Ultima_Oportunidade']) and
-                                                pd.notna(row['data_ultima_rotacao']) and
-                                                row['Data_Ultima_Oportunidade'] >= row['Data_Entrou_Carteira']
-                    else 0,
-        axis=1
-    )
-
-
-    df_historico = df[['Raiz_CNPJ', 'Nome_Vendedor']].dropna().drop_duplicates().reset_index(drop=True)
-
-    df_filtrado = df[df['Nome_Vendedor'].isin(vendedores_ativos_helder + vendedores_ativos_karen)].reset_index(drop=True)
-
-    contas_vao_rotacionar = df[
-        (df['Status_Cliente'] == 'Nao Compra') &
-        (df['Data_Abertura_Conta'] < data_limite) &
-        ((df['Data_Entrou_Carteira'] < data_limite) | (df['Data_Entrou_Carteira'].isnull())) &
-        ((df['Grupo_Econômico_ID'].isnull()) | (df['Grupo_Econômico_ID'] == ''))
-    ]
-
-    if "Helder" in opcao:
-        contas_filtradas = contas_vao_rotacionar[contas_vao_rotacionar['Classificacao_Conta'].isin([5, 7])]
-    else:
-        contas_filtradas = contas_vao_rotacionar[~contas_vao_rotacionar['Classificacao_Conta'].isin([5, 7])]
-
-    def registrar_historico_rotacao(nome_vendedor, conta_id, tipo_rotacao, data_rotacao):
-        conn = sqlite3.connect('historico_rotacao.db')
-        c = conn.cursor()
-        c.execute('''
-        INSERT INTO historico_rotacao (nome_vendedor, conta_id, tipo_rotacao, data_rotacao)
-        VALUES (?, ?, ?, ?)
-        ''', (nome_vendedor, conta_id, tipo_rotacao, data_rotacao))
-        conn.commit()
-        conn.close()
-
-    # ---------- FUNÇÃO DE ROTAÇÃO ----------
-    def rotacionar_contas(df_contas, lista_vendedores, df_historico, limite_por_vendedor=50):
-        contagem_vendedores = {v: 0 for v in lista_vendedores}
-        novos_nomes = []
-        indices_sobras = []
-
-        for idx, row in df_contas.iterrows():
-            cnpj = row['Raiz_CNPJ']
-            vendedores_antigos = df_historico[df_historico['Raiz_CNPJ'] == cnpj]['Nome_Vendedor'].tolist()
-            candidatos = [v for v in lista_vendedores if v not in vendedores_antigos and contagem_vendedores[v] < limite_por_vendedor]
-            if candidatos:
-                escolhido = np.random.choice(candidatos)
-                contagem_vendedores[escolhido] += 1
-                novos_nomes.append((idx, escolhido))
-            else:
-                indices_sobras.append(idx)
-
-        df_resultado = df_contas.copy()
-        data_hoje = pd.Timestamp.today().normalize()
-
-        for idx, novo_vendedor in novos_nomes:
-            df_resultado.at[idx, 'Nome_Vendedor'] = novo_vendedor
-            df_resultado.at[idx, 'Data_Entrou_Carteira'] = data_hoje
-
-            # Registrar histórico no banco
-        for idx, novo_vendedor in novos_nomes:
-            conta_id = df_contas.at[idx, 'Conta_ID']
-            registrar_historico_rotacao(
-                nome_vendedor=novo_vendedor,
-                conta_id=conta_id,
-                tipo_rotacao='Automática',
-                data_rotacao=data_hoje.strftime('%Y-%m-%d')
-            )
-
-        df_rotacionadas = df_resultado.loc[[idx for idx, _ in novos_nomes]].reset_index(drop=True)
-        df_sobras = df_resultado.loc[indices_sobras].reset_index(drop=True)
-
-        return df_rotacionadas, df_sobras
-    
-    def registrar_historico_rotacao(nome_vendedor, conta_id, tipo_rotacao, data_rotacao):
-        conn = sqlite3.connect('historico_rotacao.db')
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO historico_rotacao (nome_vendedor, conta_id, tipo_rotacao, data_rotacao)
-            VALUES (?, ?, ?, ?)
-        ''', (nome_vendedor, conta_id, tipo_rotacao, data_rotacao))
-        conn.commit()
-        conn.close()
+if arquivo_referencia:
+    with medir_etapa(registro_etapas, 'snapshot do ERP') as medida:
+        # garante o snapshot (e o manifesto) atualizado antes de ler a versão
+        manifesto_atual = garantir_dados_sql()
+        linhas_base = manifesto_atual['linhas']
+        medida['linhas_saida'] = linhas_base
+
+    # Lógica de status (fixada no início do dia para a chave do cache não mudar a cada rerun)
+    data_limite = calcular_data_limite().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Referência + histórico + colunas derivadas -> base filtrada e contas elegíveis
+    with medir_etapa(registro_etapas, 'upload: referência + derivação', linhas_base) as medida:
+        df, df_historico, df_filtrado, contas_vao_rotacionar = preparar_base_memorizada(
+            hashlib.sha256(arquivo_referencia.getvalue()).hexdigest(),
+            arquivo_referencia.name,
+            manifesto_atual.get('versao'),
+            marca_dagua_historico(),
+            tuple(vendedores_ativos_helder + vendedores_ativos_karen),
+            data_limite,
+            MOTOR_CONSULTAS,
+            arquivo_referencia
+        )
+        medida['linhas_saida'] = len(contas_vao_rotacionar)
+    contas_por_grupo = particionar_por_grupo(contas_vao_rotacionar, list(vendedores_por_grupo))
 
 
     # Botão de rotação
 st.markdown('#### 2-Clique no botão para rotacionar.')
-if st.button("🔁 Rodar contas agora"):
-    contas_rotacionadas, contas_sobras = rotacionar_contas(contas_filtradas, vendedores_ativos, df_historico)
-
-    st.success(f"Foram encontradas {len(contas_filtradas)} clientes disponiveis para rotação e {len(contas_rotacionadas)} foram rotacionados com sucesso.")
-    st.write("Contas rotacionadas:")
-    st.dataframe(contas_rotacionadas)
-    st.session_state["contas_rotacionadas"] = contas_rotacionadas
-    st.session_state["contas_sobras"] = contas_sobras
-
-    # Histórico
-    historico_path = "historico_rotacoes_completo.xlsx"
-    if os.path.exists(historico_path):
-        historico_existente = pd.read_excel(historico_path)
-        df_novos_historicos = pd.concat([historico_existente, contas_rotacionadas], ignore_index=True)
+modo_rotacao = st.selectbox(
+    "Modo de rotação:",
+    ["Aleatório", "Ótimo (máximo de contas)", "Ótimo priorizando faturamento"]
+)
+parametros_rotacao = {
+    'modo': 'aleatorio' if modo_rotacao == "Aleatório" else 'otimo',
+    'prioridade': 'faturamento' if "faturamento" in modo_rotacao else None,
+    'balancear': 'contas' if modo_rotacao != "Aleatório" else None,
+}
+
+# Simulação: sorteia várias sementes por grupo sem gravar nada; as escolhidas são usadas no botão de rotação
+sementes_rotacao = {}
+if arquivo_referencia:
+    with st.expander("🎲 Simular antes de rotacionar"):
+        n_simulacoes = st.number_input("Quantidade de simulações", min_value=10, max_value=2000, value=SIMULACOES_PADRAO, step=10)
+        chave_simulacao = (opcao, modo_rotacao, tuple(len(contas) for contas in contas_por_grupo.values()), marca_dagua_historico())
+        if st.button("Simular"):
+            rankings = {}
+            for grupo, contas in contas_por_grupo.items():
+                with medir_etapa(registro_etapas, f'simulação {grupo}', len(contas)) as medida:
+                    rankings[grupo] = simular_rotacoes(
+                        contas, vendedores_por_grupo[grupo], df_historico, int(n_simulacoes), **parametros_rotacao
+                    )
+                    medida['linhas_saida'] = len(rankings[grupo])
+            st.session_state["simulacao"] = {'chave': chave_simulacao, 'rankings': rankings}
+
+        simulacao = st.session_state.get("simulacao")
+        # Simulação feita com outro grupo, modo ou histórico não vale para a rotação atual
+        if simulacao and simulacao['chave'] == chave_simulacao:
+            st.caption("Ordenado por contas colocadas e, depois, pelo equilíbrio de faturamento e de classificação entre os vendedores.")
+            for grupo, ranking in simulacao['rankings'].items():
+                if ranking.empty:
+                    continue
+                st.markdown(f"**{GRUPOS[grupo]['tipo']}**")
+                st.dataframe(ranking.head(20), hide_index=True)
+                sementes_rotacao[grupo] = st.selectbox(
+                    f"Semente usada na rotação ({GRUPOS[grupo]['tipo']}):", ranking['semente'].tolist(), key=f"semente_{grupo}"
+                )
+
+# Uma rotação por vez (em qualquer sessão ou processo): duas sorteariam as mesmas contas elegíveis
+rotacao_em_andamento = tarefa_ativa('rotação')
+if rotacao_em_andamento is not None:
+    st.caption(f"⏳ A rotação da tarefa {rotacao_em_andamento} ainda está na fila ou rodando; o botão volta quando ela terminar.")
+if st.button("🔁 Rodar contas agora", disabled=rotacao_em_andamento is not None):
+    # Sorteio, histórico e estado da tarefa são gravados juntos no fim: se a tarefa falhar, nada entra no histórico
+    tarefa_id = enviar_tarefa(
+        'rotação', tarefa_rotacao, contas_por_grupo, vendedores_por_grupo, df_historico, parametros_rotacao, sementes_rotacao,
+        exclusiva=True
+    )
+    if tarefa_id is None:
+        st.warning("Outra rotação começou agora há pouco; aguarde ela terminar.")
     else:
-        df_novos_historicos = contas_rotacionadas.copy()
-
-    df_novos_historicos = df_novos_historicos.drop_duplicates(subset=["Raiz_CNPJ", "Data_Entrou_Carteira"], keep="last")
-    df_novos_historicos.to_excel(historico_path, index=False)
-
+        acompanhar_tarefa("rotacao", tarefa_id)
+
+tarefa_rotacao_atual = tarefa_da_sessao("rotacao")
+if tarefa_rotacao_atual is not None and tarefa_rotacao_atual['estado'] in ESTADOS_ATIVOS:
+    progresso_tarefa(tarefa_rotacao_atual['id'])
+elif tarefa_rotacao_atual is not None and tarefa_rotacao_atual['estado'] == CONCLUIDA:
+    resultado = tarefa_rotacao_atual['resultado']
+    # Saídas lidas do disco uma vez por tarefa (também depois de reconectar)
+    if st.session_state.get("rotacao_carregada") != tarefa_rotacao_atual['id']:
+        st.session_state["contas_rotacionadas"] = pd.read_parquet(resultado['rotacionadas'])
+        st.session_state["contas_sobras"] = pd.read_parquet(resultado['sobras'])
+        st.session_state["rotacao_carregada"] = tarefa_rotacao_atual['id']
+
+    st.success(f"Foram encontradas {resultado['elegiveis']} clientes disponiveis para rotação e {resultado['quantidade_rotacionadas']} foram rotacionados com sucesso.")
+    st.write("Contas rotacionadas:")
+    st.dataframe(st.session_state["contas_rotacionadas"])
     st.write("Contas sem rotação (sem vendedor disponível):")
-    st.dataframe(contas_sobras)
-
-# # VERIFICAÇÃO DE HISTORICO
-# st.subheader("📚 Histórico de Rotações Registradas")
-
-# if st.checkbox("🔍 Mostrar histórico de rotações"):
-#     conn = sqlite3.connect('historico_rotacao.db')
-#     df_historico = pd.read_sql_query("SELECT * FROM historico_rotacao ORDER BY data_rotacao DESC", conn)
-#     conn.close()
-#     st.dataframe(df_historico)
+    st.dataframe(st.session_state["contas_sobras"])
+elif tarefa_rotacao_atual is not None:
+    mostrar_falha(tarefa_rotacao_atual)
+
+# VERIFICAÇÃO DE HISTORICO
+# Uma página por vez (paginação por chave): a pilha guarda a chave de início de cada página já vista,
+# então 'Anterior' volta sem recontar nada. Mudar um filtro recomeça da página mais recente.
+@st.fragment
+def explorar_historico():
+    vendedores, tipos = opcoes_filtro_historico()
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        vendedor = st.selectbox("Vendedor", ["Todos"] + vendedores, key="historico_vendedor")
+    with col2:
+        tipo = st.selectbox("Tipo de rotação", ["Todos"] + tipos, key="historico_tipo")
+    with col3:
+        conta = st.text_input("Conta_ID", key="historico_conta").strip()
+    with col4:
+        datas = st.date_input("Período", value=(), format="DD/MM/YYYY", key="historico_datas")
+
+    if conta and not conta.isdigit():
+        st.warning("Conta_ID deve ser um número.")
+        conta = ""
+    filtros = {
+        'vendedor': None if vendedor == "Todos" else vendedor,
+        'tipo_rotacao': None if tipo == "Todos" else tipo,
+        'conta_id': conta or None,
+        'data_inicio': datas[0] if len(datas) > 0 else None,
+        'data_fim': datas[1] if len(datas) > 1 else None,
+    }
+    if st.session_state.get("historico_filtros") != filtros:
+        st.session_state.historico_filtros = filtros
+        st.session_state.historico_chaves = [None]
+    chaves = st.session_state.historico_chaves
+
+    aba_paginas, aba_rotacoes, aba_contas = st.tabs(["Rotações", "Rotações por mês", "Contas por vendedor"])
+    with aba_paginas:
+        df_pagina, proxima = pagina_historico(chaves[-1], **filtros)
+        col_anterior, col_pagina, col_proxima = st.columns([1, 2, 1])
+        with col_anterior:
+            st.button("⬅️ Anterior", disabled=len(chaves) == 1, on_click=chaves.pop, key="historico_anterior")
+        with col_pagina:
+            st.caption(f"Página {len(chaves)} · {len(df_pagina)} rotações")
+        with col_proxima:
+            st.button("Próxima ➡️", disabled=proxima is None, on_click=chaves.append, args=(proxima,), key="historico_proxima")
+        st.dataframe(df_pagina, hide_index=True)
+
+    with aba_rotacoes:
+        resumo = resumo_rotacoes_mes(filtros['vendedor'], filtros['tipo_rotacao'])
+        if resumo.empty:
+            st.write("_Nenhuma rotação registrada._")
+        else:
+            st.dataframe(resumo.pivot_table(index="mes", columns="nome_vendedor", values="rotacoes", fill_value=0)
+                         .sort_index(ascending=False))
 
+    with aba_contas:
+        carteira = contas_vendedor_ao_longo_do_tempo(filtros['vendedor'])
+        if carteira.empty:
+            st.write("_Nenhuma rotação registrada._")
+        else:
+            # Meses sem movimento repetem a carteira do último mês com movimento
+            st.line_chart(carteira.pivot(index="mes", columns="nome_vendedor", values="contas").ffill())
+            st.dataframe(carteira.sort_values(["mes", "nome_vendedor"], ascending=[False, True]), hide_index=True)
+
+st.subheader("📚 Histórico de Rotações Registradas")
+with st.expander("🔍 Mostrar histórico de rotações"):
+    explorar_historico()
+
+# Todas as contas já rotacionadas, com as colunas do momento da rotação (antiga historico_rotacoes_completo.xlsx).
+# Só é montada quando alguém pede: lê todos os arquivos de historico_rotacoes/.
+with st.expander("📦 Contas rotacionadas em todas as rotações"):
+    if st.button("Montar planilha", key="montar_contas_rotacionadas"):
+        with medir_etapa(registro_etapas, 'xlsx todas as contas rotacionadas') as medida:
+            todas_rotacionadas = ler_contas_rotacionadas()
+            medida['linhas_saida'] = len(todas_rotacionadas)
+            st.session_state["planilha_todas_rotacionadas"] = gerar_excel_download(todas_rotacionadas)
+    if "planilha_todas_rotacionadas" in st.session_state:
+        st.download_button(
+            "📥 Baixar todas as contas rotacionadas",
+            data=st.session_state["planilha_todas_rotacionadas"],
+            file_name=f"historico_rotacoes_completo_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
+        )
 
-# Gerar downloads fora do if
-def gerar_excel_download(df):
-    from io import BytesIO
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Planilha1')
-    return output.getvalue()
 
 if "contas_rotacionadas" in st.session_state:
     st.markdown('#### 3-Faça o Download das contas rotacionadas e armazene no servidor')
     st.markdown('👇 Clique no botão abaixo para fazer o download do historico de rotação.')
+    with medir_etapa(registro_etapas, 'xlsx contas rotacionadas', len(st.session_state["contas_rotacionadas"])):
+        planilha_rotacionadas = gerar_excel_download(st.session_state["contas_rotacionadas"])
     st.download_button(
         "📥 Baixar contas rotacionadas",
-        data=gerar_excel_download(st.session_state["contas_rotacionadas"]),
+        data=planilha_rotacionadas,
         file_name=f"historico_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
     )
 
@@ -566,138 +511,79 @@ st.markdown("---")
 
 st.subheader("📊 Gerar Relatórios por Vendedor")
 
+# Processos usados para montar e gravar os relatórios por vendedor (1 = sequencial)
+PROCESSOS_RELATORIO = int(st.secrets.get("PROCESSOS_RELATORIO", os.cpu_count() or 1))
+
 st.markdown('👇 Clique no botão abaixo para fazer o download dos relatórios de rotação.')
+salvar_no_servidor = st.checkbox(
+    f"Salvar também uma cópia em Relatorio_Rotação/ e em {', '.join(GRUPOS[grupo]['pasta'] + '/' for grupo in vendedores_por_grupo)} no servidor",
+    value=True
+)
 
 if st.button("📄 Gerar Relatório Completo e por Vendedor"):
 
     # Define df_atual com base na existência de rotação
     if "contas_rotacionadas" in st.session_state:
-        df_atual = st.session_state["contas_rotacionadas"].copy()
+        df_atual = st.session_state["contas_rotacionadas"]
         st.success("✅ Usando contas rotacionadas para o relatório.")
     else:
-        df_atual = df_filtrado.copy()
+        df_atual = df_filtrado
         st.warning("⚠️ Nenhuma rotação foi realizada. Usando base atual para gerar relatório.")
 
-    def gerar_relatorios(df_atual, df_anterior, data_limite, data_rotacao, pasta_destino='Relatorio_Rotação'):
-        os.makedirs(pasta_destino, exist_ok=True)
-
-        data_rotacao = pd.to_datetime(data_rotacao).normalize()
-        data_limite = pd.to_datetime(data_limite).normalize()
-
-        for df in [df_atual, df_anterior]:
-            df['Data_Entrou_Carteira'] = pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce')
-            df['Data_Ultima_Venda_Grupo_CNPJ'] = pd.to_datetime(df['Data_Ultima_Venda_Grupo_CNPJ'], errors='coerce')
-
-        vendedores = df_atual['Nome_Vendedor'].dropna().unique()
-        arquivos_por_vendedor = {}
-
-        writer = pd.ExcelWriter(f'{pasta_destino}/relatorio_mensal_completo.xlsx', engine='xlsxwriter')
-
-        for vendedor in vendedores:
-            atual_vend = df_atual[df_atual['Nome_Vendedor'] == vendedor].copy()
-            anterior_vend = df_anterior[df_anterior['Nome_Vendedor'] == vendedor].copy()
-
-            def montar_bloco(df, status):
-                bloco = df[[
-                    'Nome_Vendedor',
-                    'Razao_Social_Pessoas',
-                    'Raiz_CNPJ',
-                    'Faturamento_6_Meses',
-                    'Total_Pedidos',
-                    'Data_Ultima_Venda_Grupo_CNPJ',
-                    'Data_Entrou_Carteira',
-                    'data_ultima_rotacao',
-                    'Total_Contatos_Rotacao',
-                    'Data_Ultimo_Contato',
-                    'Total_Followups_Rotacao',
-                    'Data_Ultimo_Followup',
-                    'Total_Orcamentos_Rotacao',
-                    'Data_Ultimo_Orcamento'
-                ]].copy()
-                bloco.insert(0, 'Status', status)
-                return bloco
-
-            usados = set()
-            blocos = []
-
-            ativas = anterior_vend[
-                (
-                    (anterior_vend['Data_Ultima_Venda_Grupo_CNPJ'] >= data_limite) |
-                    (anterior_vend['Grupo_Econômico_ID'].notnull())
-                ) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(ativas['Raiz_CNPJ'])
-            blocos.append(montar_bloco(ativas, 'Ativa'))
-
-            seis_meses_atras = data_rotacao - pd.DateOffset(months=6)
-            recentes = anterior_vend[
-                (anterior_vend['Data_Entrou_Carteira'] >= seis_meses_atras) &
-                (anterior_vend['Data_Entrou_Carteira'] != data_rotacao) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(recentes['Raiz_CNPJ'])
-            blocos.append(montar_bloco(recentes, 'Entraram Recentemente'))
-
-            novas = atual_vend[
-                (atual_vend['Data_Entrou_Carteira'] == data_rotacao) &
-                (~atual_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(novas['Raiz_CNPJ'])
-            blocos.append(montar_bloco(novas, 'Novas Recebidas'))
-
-            cadastradas_recente = anterior_vend[
-                (anterior_vend['Data_Abertura_Conta'] >= seis_meses_atras) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(cadastradas_recente['Raiz_CNPJ'])
-            blocos.append(montar_bloco(cadastradas_recente, 'Cadastrado Recentemente'))
-
-            retiradas = anterior_vend[
-                (~anterior_vend['Raiz_CNPJ'].isin(atual_vend['Raiz_CNPJ'])) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(retiradas['Raiz_CNPJ'])
-            blocos.append(montar_bloco(retiradas, 'Retiradas'))
-
-            df_relatorio = pd.concat(blocos, ignore_index=True)
-            df_relatorio = df_relatorio.drop_duplicates(subset='Raiz_CNPJ', keep='first')
-            df_relatorio = df_relatorio.sort_values(['Status', 'Razao_Social_Pessoas']).reset_index(drop=True)
-
-            if not df_relatorio.empty:
-                nome_arquivo_vendedor = f"{pasta_destino}/relatorio_{vendedor.replace(' ', '_')}_{data_rotacao.strftime('%Y-%m-%d')}.xlsx"
-                df_relatorio.to_excel(nome_arquivo_vendedor, index=False)
-                arquivos_por_vendedor[vendedor] = nome_arquivo_vendedor
-
-                aba = vendedor[:31]
-                df_relatorio.to_excel(writer, sheet_name=aba, index=False)
-
-        writer.close()
-        return arquivos_por_vendedor
-
-
-    arquivos_gerados = gerar_relatorios(
-        df_atual=df_atual,
-        df_anterior=df_filtrado,
-        data_limite=data_limite,
-        data_rotacao=pd.Timestamp.today().normalize(),
-        pasta_destino='Relatorio_Rotação'
-    )
-
-    st.success("✅ Relatórios gerados com sucesso!")
-
-    zip_file_path = os.path.join(tempfile.gettempdir(), "relatorios_rotacao.zip")
-    with zipfile.ZipFile(zip_file_path, 'w') as zipf:
-        zipf.write('Relatorio_Rotação/relatorio_mensal_completo.xlsx', 'relatorio_mensal_completo.xlsx')
-        for vendedor, arquivo in arquivos_gerados.items():
-            zipf.write(arquivo, arquivo.split('/')[-1])
-
-    with open(zip_file_path, 'rb') as f:
+    # Cada planilha entra no ZIP assim que fica pronta; o ZIP fica em tarefas/<id>/ até ser baixado
+    acompanhar_tarefa("relatorios", enviar_tarefa(
+        'relatórios', tarefa_relatorios, df_atual, df_filtrado, data_limite, pd.Timestamp.today().normalize(),
+        PROCESSOS_RELATORIO, 'Relatorio_Rotação' if salvar_no_servidor else None,
+        vendedores_por_grupo if salvar_no_servidor else None, MOTOR_CONSULTAS
+    ))
+
+tarefa_relatorios_atual = tarefa_da_sessao("relatorios")
+if tarefa_relatorios_atual is not None and tarefa_relatorios_atual['estado'] in ESTADOS_ATIVOS:
+    progresso_tarefa(tarefa_relatorios_atual['id'])
+elif tarefa_relatorios_atual is not None and tarefa_relatorios_atual['estado'] == CONCLUIDA:
+    st.success(f"✅ Relatórios gerados com sucesso! ({tarefa_relatorios_atual['resultado']['vendedores']} vendedores)")
+    with open(tarefa_relatorios_atual['resultado']['zip'], 'rb') as arquivo_zip:
         st.download_button(
             label="📥 Baixar Todos os Relatórios",
-            data=f,
+            data=arquivo_zip,
             file_name="relatorios_rotacao.zip",
             mime="application/zip"
         )
+elif tarefa_relatorios_atual is not None:
+    mostrar_falha(tarefa_relatorios_atual)
+
+with st.expander("🗂️ Tarefas recentes"):
+    st.dataframe(listar_tarefas(), hide_index=True)
+    retomar = st.number_input("Retomar tarefa pelo id", min_value=0, step=1, value=0)
+    if retomar and st.button("Retomar"):
+        tarefa = obter_tarefa(int(retomar))
+        if tarefa is None:
+            st.warning(f"Tarefa {retomar} não encontrada.")
+        else:
+            acompanhar_tarefa("rotacao" if tarefa['tipo'] == 'rotação' else "relatorios", tarefa['id'])
+            st.rerun()
 
-
+# ---------- MÉTRICAS DA EXECUÇÃO ----------
+gravar_metricas(registro_etapas)
+with st.expander("⏱️ Tempo por etapa nesta execução"):
+    if registro_etapas['etapas']:
+        st.dataframe(pd.DataFrame(registro_etapas['etapas']), hide_index=True)
+    else:
+        st.caption("Nenhuma etapa medida nesta execução.")
+    if perfilador is not None:
+        caminho_perfil, resumo_perfil = encerrar_perfil(perfilador, registro_etapas)
+        st.caption(f"cProfile gravado em {caminho_perfil} (abra com snakeviz para ver o flame graph).")
+        st.code(resumo_perfil)
+
+# ---------- DEPURAÇÃO ----------
+# Abra a página com ?debug=1 para ver as conexões abertas/fechadas/reutilizadas nesta execução
+if st.query_params.get("debug") == "1":
+    with st.expander("🐞 Conexões com bancos de dados"):
+        execucao, totais = contadores_execucao(), contadores_totais()
+        st.dataframe(pd.DataFrame(
+            [
+                {'banco': banco, 'evento': evento, 'nesta execução': execucao.get((banco, evento), 0), 'desde o início': total}
+                for (banco, evento), total in sorted(totais.items())
+            ],
+            columns=['banco', 'evento', 'nesta execução', 'desde o início']
+        ), hide_index=True)
@@ -0,0 +1,636 @@
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from cache_snapshot import carregar_snapshot, salvar_snapshot, tipar_snapshot, valores_distintos_snapshot
+from conexoes import fechar_todas
+from dados_sinteticos import (CONTAS_SQLITE, alterar_eventos_na_janela, conectar_erp_sqlite, datas_modificacao,
+                              derivar_colunas_legado, gerar_base_derivacao, gerar_base_erp, gerar_base_relatorio,
+                              gerar_cenario_rotacao, gerar_erp_sqlite, gerar_fixtures, gerar_referencia, gerar_rotacoes_mes,
+                              inserir_eventos_novos, na_pasta, rotacionar_grupo_a_grupo, simular_rotacoes_ingenuo,
+                              ultimas_rotacoes_sinteticas)
+from esquema import compactar_contas, raiz_para_chave
+from excel_io import escrever_xlsx, ler_referencia
+from historico import (conectar_historico, contas_vendedor_ao_longo_do_tempo, criar_tabela_historico,
+                       pagina_historico, recalcular_resumos, registrar_rotacoes, resumo_rotacoes_mes)
+from extracao import carregar_base_completa, carregar_candidatos, corte_faturamento, montar_consulta_completa
+from leitura_erp import ler_em_lotes
+from metricas import calcular_status_cliente, derivar_colunas
+from motor_duckdb import conectar_duckdb, derivar_base_duckdb, montar_relatorios_duckdb
+from pipeline import (GRUPOS, calcular_data_limite, carregar_vendedores_grupo, cronometrar, derivar_base,
+                      executar_rotacao_mensal, filtrar_contas_grupo, preparar_base, registrar_resultado,
+                      rotacionar_e_registrar)
+from relatorios import (NOME_CONSOLIDADO, exportar_zip_relatorios, gerar_relatorios, iterar_relatorios,
+                        montar_relatorio_vendedor, separar_por_vendedor)
+from rotacao import rotacionar_contas_vetorizado
+from simulacao import simular_rotacoes
+from sincronizacao import carregar_dados_incremental
+
+
+# ---------- BENCHMARKS ----------
+def benchmark_rotacao(n_contas=50000, n_vendedores=50, limite_por_vendedor=None, semente=0):
+    df_contas, vendedores, df_historico = gerar_cenario_rotacao(n_contas, n_vendedores, semente=semente)
+    if limite_por_vendedor is None:
+        limite_por_vendedor = n_contas // n_vendedores
+
+    resultados = []
+    for modo, prioridade in [('aleatorio', None), ('otimo', None), ('otimo', 'faturamento')]:
+        inicio = time.perf_counter()
+        df_rotacionadas, df_sobras = rotacionar_contas_vetorizado(
+            df_contas, vendedores, df_historico, limite_por_vendedor,
+            rng=np.random.default_rng(semente), modo=modo, prioridade=prioridade
+        )
+        resultados.append({
+            'modo': modo if prioridade is None else f'{modo} ({prioridade})',
+            'colocadas': len(df_rotacionadas),
+            'sobras': len(df_sobras),
+            'faturamento_colocado': round(df_rotacionadas['Faturamento_6_Meses'].sum(), 2),
+            'segundos': round(time.perf_counter() - inicio, 3),
+        })
+
+    return pd.DataFrame(resultados)
+
+
+def benchmark_sincronizacao(n_contas=20000, eventos_por_conta=20):
+    # Carga completa x carga incremental, também depois de linhas atrasadas, retroativas, editadas e excluídas
+    # (a equivalência das duas cargas fica em test_paridade.py)
+    agora = pd.Timestamp.today().normalize()
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_erp = os.path.join(pasta, 'erp.db')
+        caminho_local = os.path.join(pasta, 'sincronizacao_erp.db')
+        gerar_erp_sqlite(caminho_erp, n_contas, eventos_por_conta, agora=agora)
+
+        resultados = []
+        conn = conectar_erp_sqlite(caminho_erp)
+        for etapa, forcar in [('carga completa', True), ('incremental sem novidades', False)]:
+            inicio = time.perf_counter()
+            carregar_dados_incremental(conn, caminho_local, agora=agora, forcar_completa=forcar, tabela_contas=CONTAS_SQLITE)
+            resultados.append({'etapa': etapa, 'segundos': round(time.perf_counter() - inicio, 3)})
+
+        inserir_eventos_novos(caminho_erp, agora=agora)
+        inicio = time.perf_counter()
+        carregar_dados_incremental(conn, caminho_local, agora=agora, tabela_contas=CONTAS_SQLITE)
+        resultados.append({'etapa': 'incremental com novidades', 'segundos': round(time.perf_counter() - inicio, 3)})
+
+        # Dia seguinte: a janela avança (consolida o que saiu dela) e relê as correções
+        alterar_eventos_na_janela(caminho_erp, agora=agora)
+        inicio = time.perf_counter()
+        carregar_dados_incremental(conn, caminho_local, agora=agora + pd.Timedelta(days=1), tabela_contas=CONTAS_SQLITE)
+        resultados.append({'etapa': 'incremental com correções na janela', 'segundos': round(time.perf_counter() - inicio, 3)})
+        conn.close()
+    return pd.DataFrame(resultados)
+
+
+def benchmark_metricas(n_linhas=200000):
+    # Colunas derivadas: df.apply original x passo vetorizado
+    df, referencia = gerar_base_derivacao(n_linhas)
+    data_limite = datetime.today() - timedelta(days=6*30)
+
+    inicio = time.perf_counter()
+    derivar_colunas_legado(df, referencia, data_limite)
+    tempo_legado = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    derivar_colunas(df, referencia, data_limite)
+    tempo_vetorizado = time.perf_counter() - inicio
+    return pd.DataFrame([
+        {'implementacao': 'df.apply (original)', 'linhas': n_linhas, 'segundos': round(tempo_legado, 3)},
+        {'implementacao': 'vetorizada', 'linhas': n_linhas, 'segundos': round(tempo_vetorizado, 3)},
+    ])
+
+
+def benchmark_relatorios(n_linhas=60000, n_vendedores=30):
+    # Escalonamento da geração de relatórios com o número de processos
+    df_atual, df_anterior, data_limite, hoje = gerar_base_relatorio(n_linhas, n_vendedores)
+    processos = sorted({1, 2, 4, os.cpu_count() or 1})
+
+    resultados = []
+    for n_processos in processos:
+        # Pasta nova a cada rodada: com o manifesto, uma pasta já preenchida reaproveitaria as planilhas
+        with tempfile.TemporaryDirectory() as pasta:
+            inicio = time.perf_counter()
+            arquivos = gerar_relatorios(df_atual.copy(), df_anterior.copy(), data_limite, hoje, pasta, n_processos=n_processos)
+            resultados.append({
+                'processos': n_processos,
+                'vendedores': len(arquivos),
+                'segundos': round(time.perf_counter() - inicio, 3),
+            })
+    return pd.DataFrame(resultados)
+
+
+def exportar_zip_via_disco(df_atual, df_anterior, data_limite, data_rotacao, pasta):
+    # Caminho anterior: grava tudo em disco, relê para um ZIP em disco e relê o ZIP para o download
+    arquivos = gerar_relatorios(df_atual, df_anterior, data_limite, data_rotacao, pasta, n_processos=1)
+    caminho_zip = os.path.join(pasta, 'relatorios_rotacao.zip')
+    with zipfile.ZipFile(caminho_zip, 'w') as zipf:
+        zipf.write(f'{pasta}/relatorio_mensal_completo.xlsx', 'relatorio_mensal_completo.xlsx')
+        for arquivo in arquivos.values():
+            zipf.write(arquivo, arquivo.split('/')[-1])
+    with open(caminho_zip, 'rb') as f:
+        return f.read()
+
+
+def benchmark_exportacao_zip(n_linhas=20000, n_vendedores=50):
+    # Pico de memória (tracemalloc, processo principal) e tempo de uma exportação com 50 vendedores
+    df_atual, df_anterior, data_limite, hoje = gerar_base_relatorio(n_linhas, n_vendedores)
+
+    def via_memoria(pasta):
+        arquivo_zip, _ = exportar_zip_relatorios(
+            iterar_relatorios(df_atual.copy(), df_anterior.copy(), data_limite, hoje, n_processos=1)
+        )
+        return arquivo_zip.read()
+
+    def via_disco(pasta):
+        return exportar_zip_via_disco(df_atual.copy(), df_anterior.copy(), data_limite, hoje, pasta)
+
+    resultados = []
+    for nome, exportar in [('disco (anterior)', via_disco), ('ZIP em memória', via_memoria)]:
+        with tempfile.TemporaryDirectory() as pasta:
+            tracemalloc.start()
+            inicio = time.perf_counter()
+            conteudo = exportar(pasta)
+            segundos = time.perf_counter() - inicio
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        resultados.append({
+            'caminho': nome,
+            'tamanho_zip_mb': round(len(conteudo) / 2**20, 1),
+            'pico_memoria_mb': round(pico / 2**20, 1),
+            'segundos': round(segundos, 3),
+        })
+    return pd.DataFrame(resultados)
+
+
+def benchmark_excel_io(tamanhos=(10000, 100000, 500000)):
+    # Escrita (pandas padrão x xlsxwriter constant_memory) e leitura da referência
+    # (pd.read_excel completo x só Raiz_CNPJ/Nome_Vendedor em fluxo, e CSV/Parquet)
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta:
+        for n_linhas in tamanhos:
+            df, _ = gerar_base_derivacao(n_linhas)
+            caminho_pandas = os.path.join(pasta, f'pandas_{n_linhas}.xlsx')
+            caminho_rapido = os.path.join(pasta, f'rapido_{n_linhas}.xlsx')
+            caminho_csv = os.path.join(pasta, f'referencia_{n_linhas}.csv')
+            caminho_parquet = os.path.join(pasta, f'referencia_{n_linhas}.parquet')
+
+            def medir(operacao, funcao):
+                inicio = time.perf_counter()
+                funcao()
+                resultados.append({'linhas': n_linhas, 'operacao': operacao, 'segundos': round(time.perf_counter() - inicio, 3)})
+
+            medir('escrita pandas to_excel', lambda: df.to_excel(caminho_pandas, index=False, sheet_name='Planilha1', engine='xlsxwriter'))
+            medir('escrita constant_memory', lambda: escrever_xlsx(caminho_rapido, [('Planilha1', df)]))
+            df.to_csv(caminho_csv, index=False, sep=';')
+            df.to_parquet(caminho_parquet, index=False)
+
+            medir('leitura pd.read_excel', lambda: pd.read_excel(caminho_rapido, sheet_name='Planilha1'))
+            medir('leitura referencia xlsx', lambda: ler_referencia(caminho_rapido))
+            medir('leitura referencia csv', lambda: ler_referencia(caminho_csv))
+            medir('leitura referencia parquet', lambda: ler_referencia(caminho_parquet))
+    return pd.DataFrame(resultados)
+
+
+def benchmark_extracao(n_contas=50000, eventos_por_conta=20):
+    # Base inteira + filtros no pandas x candidatos filtrados no servidor
+    agora = pd.Timestamp.today().normalize()
+    data_limite = agora - timedelta(days=6*30)
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_erp = os.path.join(pasta, 'erp.db')
+        gerar_erp_sqlite(caminho_erp, n_contas, eventos_por_conta, agora=agora)
+        conn = conectar_erp_sqlite(caminho_erp)
+
+        inicio = time.perf_counter()
+        completa = carregar_base_completa(conn, agora=agora, tabela_contas=CONTAS_SQLITE)
+        df = tipar_snapshot(completa).sort_values('Conta_ID').drop_duplicates(subset='Raiz_CNPJ')
+        grupo = df['Grupo_Econômico_ID']
+        esperado = df[
+            (calcular_status_cliente(df['Data_Ultima_Venda_Grupo_CNPJ'], data_limite) == 'Nao Compra') &
+            (df['Data_Abertura_Conta'] < data_limite) &
+            (grupo.isnull() | (grupo == ''))
+        ]
+        segundos_completa = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        candidatos = tipar_snapshot(carregar_candidatos(conn, data_limite, agora=agora, tabela_contas=CONTAS_SQLITE))
+        segundos_candidatos = time.perf_counter() - inicio
+        conn.close()
+
+    return pd.DataFrame([
+        {'extracao': 'base inteira + pandas', 'linhas_transferidas': len(completa), 'candidatas': len(esperado),
+         'segundos': round(segundos_completa, 3)},
+        {'extracao': 'candidatos no servidor', 'linhas_transferidas': len(candidatos), 'candidatas': len(candidatos),
+         'segundos': round(segundos_candidatos, 3)},
+    ])
+
+
+def medir_leitura(caminho_erp, caminho, tamanho_lote, agora):
+    # Roda num processo novo: o pico de RSS (ru_maxrss) reflete só esta leitura
+    conn = conectar_erp_sqlite(caminho_erp)
+    parametros = (corte_faturamento(agora),)
+    inicio = time.perf_counter()
+    if caminho == 'lotes':
+        df = ler_em_lotes(conn, montar_consulta_completa(CONTAS_SQLITE), parametros, tamanho_lote)
+    else:
+        df = tipar_snapshot(pd.read_sql(montar_consulta_completa(CONTAS_SQLITE), conn, params=parametros))
+    segundos = time.perf_counter() - inicio
+    conn.close()
+    pico_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return df, segundos, pico_kb / 1024
+
+
+def benchmark_leitura_erp(n_contas=200000, eventos_por_conta=4, tamanho_lote=50000):
+    # pd.read_sql + reparse (tipar_snapshot) x fetchmany tipado por lote, cada um em processo separado
+    agora = pd.Timestamp.today().normalize()
+    contexto = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho_erp = os.path.join(pasta, 'erp.db')
+        gerar_erp_sqlite(caminho_erp, n_contas, eventos_por_conta, agora=agora)
+
+        resultados = []
+        for caminho in ['read_sql', 'lotes']:
+            with contexto.Pool(1) as pool:
+                df, segundos, pico_mb = pool.apply(medir_leitura, (caminho_erp, caminho, tamanho_lote, agora))
+            resultados.append({
+                'caminho': caminho, 'linhas': len(df), 'pico_rss_mb': round(pico_mb, 1),
+                'memoria_df_mb': round(df.memory_usage(deep=True).sum() / 1024**2, 1),
+                'segundos': round(segundos, 3), 'linhas_por_segundo': int(len(df) / segundos),
+            })
+    return pd.DataFrame(resultados)
+
+
+def benchmark_esquema(n_linhas=500000):
+    # Base no formato antigo (raiz em texto, nomes object, contagens int64) x compactar_contas
+    df, referencia = gerar_base_derivacao(n_linhas)
+    rng = np.random.default_rng(1)
+    df['Razao_Social_Pessoas'] = 'Empresa ' + df['Conta_ID'].astype(str)
+    df['Grupo_Econômico_Nome'] = pd.Series(rng.choice([f'Grupo {i}' for i in range(300)] + [None], n_linhas), dtype=object)
+    df['Nome_Vendedor'] = df['Nome_Vendedor'].astype(object)
+    compacto = compactar_contas(df)
+    referencia_compacta = referencia.assign(Raiz_CNPJ=raiz_para_chave(referencia['Raiz_CNPJ']))
+    vendedores_ativos = sorted(df['Nome_Vendedor'].unique())[:20]
+
+    def operacoes(base, ref):
+        amostra = set(base['Raiz_CNPJ'].iloc[::10])
+        return {
+            'isin vendedores': lambda: base[base['Nome_Vendedor'].isin(vendedores_ativos)],
+            'isin raízes': lambda: base[~base['Raiz_CNPJ'].isin(amostra)],
+            'busca na referência': lambda: pd.Index(ref['Raiz_CNPJ'].drop_duplicates()).get_indexer(base['Raiz_CNPJ']),
+            'drop_duplicates raiz': lambda: base.drop_duplicates(subset='Raiz_CNPJ'),
+            'groupby vendedor': lambda: dict(tuple(base.groupby('Nome_Vendedor', sort=False, observed=True))),
+            'copy': lambda: base.copy(),
+        }
+
+    resultados = []
+    for formato, base, ref in [('texto/object (anterior)', df, referencia), ('compacto', compacto, referencia_compacta)]:
+        linha = {'formato': formato, 'memoria_mb': round(base.memory_usage(deep=True).sum() / 1024**2, 1)}
+        for nome, operacao in operacoes(base, ref).items():
+            inicio = time.perf_counter()
+            operacao()
+            linha[nome] = round(time.perf_counter() - inicio, 3)
+        resultados.append(linha)
+    return pd.DataFrame(resultados).set_index('formato').T.reset_index(names='medida')
+
+# ---------- SIMULAÇÃO ----------
+def benchmark_simulacao(n_contas=20000, n_vendedores=30, limite_por_vendedor=50, n_simulacoes=200, semente=0):
+    df_contas, vendedores, df_historico = gerar_cenario_rotacao(n_contas, n_vendedores, semente=semente)
+    df_contas = df_contas.assign(Classificacao_Conta=np.random.default_rng(semente).choice([2, 3, 4, 6, 8], n_contas))
+    sementes = range(n_simulacoes)
+    n_processos = max(2, os.cpu_count() or 1)
+
+    variantes = {
+        'uma rotação por semente': lambda: simular_rotacoes_ingenuo(
+            df_contas, vendedores, df_historico, sementes, limite_por_vendedor),
+        'simular_rotacoes (1 processo)': lambda: simular_rotacoes(
+            df_contas, vendedores, df_historico, n_simulacoes, limite_por_vendedor=limite_por_vendedor, n_processos=1),
+        f'simular_rotacoes ({n_processos} processos, memória compartilhada)': lambda: simular_rotacoes(
+            df_contas, vendedores, df_historico, n_simulacoes, limite_por_vendedor=limite_por_vendedor,
+            n_processos=n_processos),
+    }
+    resultados = []
+    for nome, variante in variantes.items():
+        inicio = time.perf_counter()
+        variante()
+        resultados.append({'variante': nome, 'simulacoes': n_simulacoes, 'segundos': round(time.perf_counter() - inicio, 3)})
+    return pd.DataFrame(resultados)
+
+# ---------- CADASTRO DE VENDEDORES ----------
+def benchmark_nomes_vendedores(n_contas=500000, repeticoes=5):
+    # Lista de nomes do cadastro: base inteira do snapshot (e a cópia do st.cache_data) x só a coluna
+    df = gerar_base_erp(n_contas)
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta:
+        salvar_snapshot(df, pasta)
+        variantes = {
+            'snapshot inteiro + cópia (cache_data) + unique': lambda: sorted(
+                pickle.loads(pickle.dumps(carregar_snapshot(pasta)))['Nome_Vendedor'].dropna().unique().tolist()
+            ),
+            'só a coluna Nome_Vendedor': lambda: valores_distintos_snapshot(pasta, 'Nome_Vendedor'),
+        }
+        for nome, variante in variantes.items():
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                variante()
+            resultados.append({'variante': nome, 'contas': n_contas, 'segundos_por_chamada': round((time.perf_counter() - inicio) / repeticoes, 4)})
+    return pd.DataFrame(resultados)
+
+# ---------- DOIS GRUPOS ----------
+def benchmark_grupos(n_contas=100000, semente=0):
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta, na_pasta(pasta):
+        caminhos = gerar_fixtures('.', n_contas, semente)
+        df_erp = pd.read_parquet(caminhos['base'])
+        referencia = ler_referencia(caminhos['referencia'])
+        vendedores_por_grupo = {grupo: carregar_vendedores_grupo(grupo) for grupo in GRUPOS}
+        data_limite = calcular_data_limite()
+
+        inicio = time.perf_counter()
+        rotacionar_grupo_a_grupo(df_erp, referencia, vendedores_por_grupo, data_limite, semente)
+        resultados.append({'variante': 'um grupo por vez (derivação 2x)', 'segundos': round(time.perf_counter() - inicio, 3)})
+
+        tempos = {}
+        inicio = time.perf_counter()
+        executar_rotacao_mensal(
+            df_erp, referencia, vendedores_por_grupo, list(GRUPOS), rng=np.random.default_rng(semente),
+            registrar=False, tempos=tempos, data_limite=data_limite
+        )
+        resultados.append({
+            'variante': 'os dois grupos numa passada', 'segundos': round(time.perf_counter() - inicio, 3),
+            **{etapa: round(segundos, 3) for etapa, segundos in tempos.items()},
+        })
+    return pd.DataFrame(resultados)
+
+
+# ---------- RELATÓRIOS INCREMENTAIS ----------
+def benchmark_relatorios_incrementais(n_linhas=60000, n_vendedores=30, vendedores_corrigidos=2, n_processos=1):
+    # Geração completa, nova execução sem mudança e nova execução após corrigir alguns vendedores
+    df_atual, df_anterior, data_limite, hoje = gerar_base_relatorio(n_linhas, n_vendedores)
+    corrigidos = sorted(df_atual['Nome_Vendedor'].unique())[:vendedores_corrigidos]
+    df_atual_corrigido, df_anterior_corrigido = [
+        df.assign(Total_Pedidos=df['Total_Pedidos'] + df['Nome_Vendedor'].isin(corrigidos))
+        for df in [df_atual, df_anterior]
+    ]
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta:
+        for execucao, atual, anterior in [
+            ('completa', df_atual, df_anterior),
+            ('sem alteração', df_atual, df_anterior),
+            (f'{vendedores_corrigidos} vendedores corrigidos', df_atual_corrigido, df_anterior_corrigido),
+        ]:
+            antes = datas_modificacao(pasta)
+            inicio = time.perf_counter()
+            gerar_relatorios(atual, anterior, data_limite, hoje, pasta, n_processos=n_processos)
+            segundos = time.perf_counter() - inicio
+            depois = datas_modificacao(pasta)
+            regravadas = [nome for nome, data in depois.items() if antes.get(nome) != data]
+            resultados.append({
+                'execucao': execucao,
+                'planilhas': len(depois),
+                'regravadas': len(regravadas),
+                'consolidado_regravado': NOME_CONSOLIDADO in regravadas,
+                'segundos': round(segundos, 3),
+            })
+    return pd.DataFrame(resultados)
+
+
+# ---------- MOTOR DUCKDB ----------
+def benchmark_motor_duckdb(tamanhos=(100000, 500000), n_vendedores=30, semente=0):
+    # Derivação da base (merge, transferências, filtros) e classificação dos relatórios nos dois motores
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta, \
+            conectar_duckdb(pasta_temporaria=os.path.join(pasta, 'duckdb_temp')) as conn:
+        for n_contas in tamanhos:
+            df_erp = gerar_base_erp(n_contas, semente=semente)
+            referencia = gerar_referencia(df_erp, semente=semente)
+            df_rotacao = ultimas_rotacoes_sinteticas(df_erp, semente)
+            vendedores = sorted(df_erp['Nome_Vendedor'].dropna().unique())[0::2]
+            data_limite = calcular_data_limite()
+            df_atual, df_anterior, limite_relatorio, hoje = gerar_base_relatorio(n_contas, n_vendedores, semente)
+            df_atual, df_anterior = [
+                df.assign(Data_Entrou_Carteira=pd.to_datetime(df['Data_Entrou_Carteira']))
+                for df in [df_atual, df_anterior]
+            ]
+            limite_relatorio = pd.to_datetime(limite_relatorio).normalize()
+
+            etapas = {
+                'derivação da base': {
+                    'pandas': lambda: derivar_base(df_erp, referencia, df_rotacao, vendedores, data_limite),
+                    'duckdb': lambda: derivar_base_duckdb(df_erp, referencia, df_rotacao, vendedores, data_limite, conn=conn),
+                },
+                'classificação dos relatórios': {
+                    'pandas': lambda: [
+                        montar_relatorio_vendedor(atual_vend, anterior_vend, limite_relatorio, hoje)
+                        for _, atual_vend, anterior_vend in separar_por_vendedor(df_atual, df_anterior)
+                    ],
+                    'duckdb': lambda: [
+                        df_relatorio
+                        for _, df_relatorio in montar_relatorios_duckdb(df_atual, df_anterior, limite_relatorio, hoje, conn)
+                    ],
+                },
+            }
+            for etapa, motores in etapas.items():
+                for motor, executar in motores.items():
+                    inicio = time.perf_counter()
+                    executar()
+                    resultados.append({
+                        'contas': n_contas,
+                        'etapa': etapa,
+                        'motor': motor,
+                        'segundos': round(time.perf_counter() - inicio, 3),
+                    })
+    return pd.DataFrame(resultados)
+
+
+# ---------- HISTÓRICO PAGINADO ----------
+def benchmark_historico_paginado(anos=5, linhas_por_mes=20000, n_contas=200000, n_vendedores=60, paginas=20, semente=0):
+    # Anos de histórico gravados mês a mês (resumos mantidos a cada inserção). Mede o SELECT * antigo, páginas
+    # com cada filtro (média por página, seguindo a chave), os resumos e o recálculo completo dos resumos.
+    rng = np.random.default_rng(semente)
+    vendedores = np.asarray([f'Vendedor {i:03d}' for i in range(n_vendedores)], dtype=object)
+    meses = pd.period_range(end=pd.Timestamp.today(), periods=anos * 12, freq='M').strftime('%Y-%m')
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'historico_rotacao.db')
+        criar_tabela_historico(caminho)
+        for mes in meses[:-1]:
+            registrar_rotacoes(gerar_rotacoes_mes(rng, mes, linhas_por_mes, n_contas, vendedores), caminho)
+
+        # Última rotação: inserção com resumos incrementais contra o recálculo completo
+        inicio = time.perf_counter()
+        registrar_rotacoes(gerar_rotacoes_mes(rng, meses[-1], linhas_por_mes, n_contas, vendedores), caminho)
+        resultados.append({'consulta': 'gravar um mês (resumos incrementais)', 'linhas': linhas_por_mes,
+                           'ms': round((time.perf_counter() - inicio) * 1000, 1)})
+        with conectar_historico(caminho) as conn:
+            inicio = time.perf_counter()
+            with conn:
+                recalcular_resumos(conn)
+            resultados.append({'consulta': 'recalcular resumos do zero', 'linhas': None,
+                               'ms': round((time.perf_counter() - inicio) * 1000, 1)})
+
+            inicio = time.perf_counter()
+            tudo = pd.read_sql_query('SELECT * FROM historico_rotacao ORDER BY data_rotacao DESC', conn)
+            resultados.append({'consulta': 'SELECT * (visualizador antigo)', 'linhas': len(tudo),
+                               'ms': round((time.perf_counter() - inicio) * 1000, 1)})
+        # Conta sorteada entre as gravadas: o filtro por conta_id sempre encontra linhas
+        conta_id = int(rng.choice(tudo['conta_id'].to_numpy()))
+        del tudo
+
+        vendedor = vendedores[0]
+        # Ano de dois anos atrás, ou o começo do histórico quando ele tem menos de dois anos
+        ano = {'data_inicio': f'{meses[max(-24, -len(meses))]}-01', 'data_fim': f'{meses[max(-13, -len(meses))]}-28'}
+        filtros = {
+            'sem filtro': {},
+            'vendedor': {'vendedor': vendedor},
+            'conta_id': {'conta_id': conta_id},
+            'intervalo de um ano': ano,
+            'tipo Manual': {'tipo_rotacao': 'Manual'},
+            'vendedor + tipo + ano': {'vendedor': vendedor, 'tipo_rotacao': 'Manual', **ano},
+        }
+        for nome, filtro in filtros.items():
+            apos, tempos, linhas = None, [], 0
+            for _ in range(paginas):
+                inicio = time.perf_counter()
+                pagina, apos = pagina_historico(apos, caminho=caminho, **filtro)
+                tempos.append(time.perf_counter() - inicio)
+                linhas += len(pagina)
+                if apos is None:
+                    break
+            resultados.append({'consulta': f'página: {nome} (média de {len(tempos)}, máx {max(tempos) * 1000:.1f} ms)',
+                               'linhas': linhas, 'ms': round(np.mean(tempos) * 1000, 1)})
+
+        for nome, consultar in [('resumo rotações por mês', lambda: resumo_rotacoes_mes(caminho=caminho)),
+                                ('carteira ao longo do tempo', lambda: contas_vendedor_ao_longo_do_tempo(caminho=caminho))]:
+            inicio = time.perf_counter()
+            resumo = consultar()
+            resultados.append({'consulta': nome, 'linhas': len(resumo), 'ms': round((time.perf_counter() - inicio) * 1000, 1)})
+        fechar_todas()
+    return pd.DataFrame(resultados)
+
+
+# ---------- PONTA A PONTA ----------
+TAMANHOS_PONTA_A_PONTA = (10000, 100000, 1000000)
+CAMINHO_REFERENCIA_BENCHMARK = 'benchmarks_referencia.json'
+PISO_RUIDO_SEGUNDOS = 0.1
+
+
+def executar_ponta_a_ponta(n_contas, semente=0, grupo='distribuicao'):
+    # Mesmo encadeamento do app sobre os dados fictícios; devolve {etapa: segundos}
+    # A geração dos dados fica fora da medição: só o código da rotação entra na comparação
+    caminhos = gerar_fixtures('.', n_contas, semente)
+    df_erp = pd.read_parquet(caminhos['base'])
+    tempos = {}
+
+    data_limite = calcular_data_limite()
+    vendedores = carregar_vendedores_grupo(grupo)
+
+    with cronometrar(tempos, 'leitura da referência'):
+        referencia = ler_referencia(caminhos['referencia'])
+    with cronometrar(tempos, 'derivação'):
+        _, df_historico, df_filtrado, contas_vao_rotacionar = preparar_base(df_erp, referencia, vendedores, data_limite)
+    with cronometrar(tempos, 'rotação'):
+        df_rotacionadas, _ = rotacionar_e_registrar(
+            filtrar_contas_grupo(contas_vao_rotacionar, grupo), vendedores, df_historico,
+            rng=np.random.default_rng(semente), registrar=False
+        )
+    with cronometrar(tempos, 'registro do histórico'):
+        registrar_resultado(df_rotacionadas)
+    with cronometrar(tempos, 'relatórios'):
+        df_atual = df_rotacionadas if not df_rotacionadas.empty else df_filtrado
+        gerar_relatorios(df_atual, df_filtrado, data_limite, pd.Timestamp.today().normalize(), GRUPOS[grupo]['pasta'])
+    return tempos
+
+
+def benchmark_ponta_a_ponta(tamanhos=TAMANHOS_PONTA_A_PONTA, semente=0):
+    resultados = []
+    for n_contas in tamanhos:
+        with tempfile.TemporaryDirectory() as pasta, na_pasta(pasta):
+            tempos = executar_ponta_a_ponta(n_contas, semente)
+        resultados.extend(
+            {'contas': n_contas, 'etapa': etapa, 'segundos': round(segundos, 3)} for etapa, segundos in tempos.items()
+        )
+    return pd.DataFrame(resultados)
+
+
+def gravar_referencia(resultado, caminho=CAMINHO_REFERENCIA_BENCHMARK):
+    # A referência depende da máquina: é gerada localmente e não vai para o repositório
+    referencia = {f'{linha.contas}|{linha.etapa}': linha.segundos for linha in resultado.itertuples()}
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(referencia, f, ensure_ascii=False, indent=2)
+
+
+def comparar_com_referencia(resultado, caminho=CAMINHO_REFERENCIA_BENCHMARK, tolerancia=0.25):
+    # Regressão: etapa mais lenta que a referência além da tolerância e acima do piso de ruído
+    with open(caminho, encoding='utf-8') as f:
+        referencia = json.load(f)
+    resultado = resultado.assign(
+        referencia=[referencia.get(f'{linha.contas}|{linha.etapa}') for linha in resultado.itertuples()]
+    )
+    limite = resultado['referencia'] * (1 + tolerancia)
+    resultado['regressao'] = (
+        resultado['referencia'].notna() &
+        (resultado['segundos'] > limite) &
+        (resultado['segundos'] - resultado['referencia'] > PISO_RUIDO_SEGUNDOS)
+    )
+    return resultado
+
+
+BENCHMARKS = {
+    'rotacao': benchmark_rotacao,
+    'sincronizacao': benchmark_sincronizacao,
+    'metricas': benchmark_metricas,
+    'relatorios': benchmark_relatorios,
+    'relatorios_incrementais': benchmark_relatorios_incrementais,
+    'exportacao_zip': benchmark_exportacao_zip,
+    'excel_io': benchmark_excel_io,
+    'esquema': benchmark_esquema,
+    'extracao': benchmark_extracao,
+    'leitura_erp': benchmark_leitura_erp,
+    'simulacao': benchmark_simulacao,
+    'nomes_vendedores': benchmark_nomes_vendedores,
+    'grupos': benchmark_grupos,
+    'motor_duckdb': benchmark_motor_duckdb,
+    'historico_paginado': benchmark_historico_paginado,
+    'ponta_a_ponta': benchmark_ponta_a_ponta,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks da rotação de carteiras')
+    parser.add_argument('nome', choices=sorted(BENCHMARKS), nargs='?', default='rotacao')
+    parser.add_argument('--tamanhos', help='ponta_a_ponta: contas por rodada, separadas por vírgula (ex.: 10000,100000)')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='ponta_a_ponta: folga sobre a referência (0.25 = 25%%)')
+    parser.add_argument('--gravar-referencia', action='store_true', help=f'ponta_a_ponta: grava {CAMINHO_REFERENCIA_BENCHMARK}')
+    args = parser.parse_args()
+
+    if args.nome != 'ponta_a_ponta':
+        print(BENCHMARKS[args.nome]().to_string(index=False))
+        sys.exit(0)
+
+    tamanhos = tuple(int(n) for n in args.tamanhos.split(',')) if args.tamanhos else TAMANHOS_PONTA_A_PONTA
+    resultado = benchmark_ponta_a_ponta(tamanhos)
+    if args.gravar_referencia:
+        gravar_referencia(resultado)
+        print(resultado.to_string(index=False))
+        print(f'Referência gravada em {CAMINHO_REFERENCIA_BENCHMARK}')
+    elif not os.path.exists(CAMINHO_REFERENCIA_BENCHMARK):
+        print(resultado.to_string(index=False))
+        print(f'Sem {CAMINHO_REFERENCIA_BENCHMARK}: rode com --gravar-referencia para criar a referência desta máquina')
+    else:
+        resultado = comparar_com_referencia(resultado, tolerancia=args.tolerancia)
+        print(resultado.to_string(index=False))
+        if resultado['regressao'].any():
+            print(f"Regressão em {resultado['regressao'].sum()} etapa(s) acima de {args.tolerancia:.0%} da referência")
+            sys.exit(1)
@@ -0,0 +1,124 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.ipc
+
+from esquema import VERSAO_ESQUEMA, compactar_contas
+
+
+NOME_MANIFESTO = 'manifesto.json'
+
+# ---------- TIPAGEM ----------
+def tipar_snapshot(df):
+    # Converte uma única vez na gravação; a leitura devolve os tipos prontos, sem reparse
+    return compactar_contas(df)
+
+
+# ---------- MANIFESTO ----------
+def ler_manifesto(pasta):
+    caminho = os.path.join(pasta, NOME_MANIFESTO)
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def gravar_manifesto(pasta, manifesto):
+    caminho = os.path.join(pasta, NOME_MANIFESTO)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+
+def snapshot_valido(manifesto, ttl_horas, agora=None):
+    if not manifesto or manifesto.get('invalidado'):
+        return False
+    # Snapshot gravado com outro esquema (ex.: Raiz_CNPJ ainda em texto) é refeito
+    if manifesto.get('esquema') != VERSAO_ESQUEMA:
+        return False
+    agora = agora or datetime.now()
+    criado_em = datetime.fromisoformat(manifesto['criado_em'])
+    return agora - criado_em < timedelta(hours=ttl_horas)
+
+
+# ---------- GRAVAÇÃO E LEITURA ----------
+def salvar_snapshot(df, pasta):
+    os.makedirs(pasta, exist_ok=True)
+    agora = datetime.now()
+    nome_arquivo = f"snapshot_{agora.strftime('%Y%m%d_%H%M%S')}.arrow"
+    caminho = os.path.join(pasta, nome_arquivo)
+
+    tabela = pa.Table.from_pandas(tipar_snapshot(df), preserve_index=False)
+    # Arrow IPC sem compressão: permite abrir o arquivo mapeado em memória
+    with pa.OSFile(caminho + '.tmp', 'wb') as destino:
+        with pa.ipc.new_file(destino, tabela.schema) as writer:
+            writer.write_table(tabela)
+    os.replace(caminho + '.tmp', caminho)
+
+    anterior = ler_manifesto(pasta)
+    manifesto = {
+        'arquivo': nome_arquivo,
+        'criado_em': agora.isoformat(timespec='seconds'),
+        'versao': agora.strftime('%Y%m%d%H%M%S'),
+        'esquema': VERSAO_ESQUEMA,
+        'linhas': tabela.num_rows,
+        'colunas': {campo.name: str(campo.type) for campo in tabela.schema},
+    }
+    gravar_manifesto(pasta, manifesto)
+
+    if anterior and anterior.get('arquivo') != nome_arquivo:
+        caminho_antigo = os.path.join(pasta, anterior['arquivo'])
+        try:
+            os.remove(caminho_antigo)
+        except OSError:
+            # outro processo ainda pode estar com o arquivo antigo aberto
+            pass
+    return manifesto
+
+
+def carregar_snapshot(pasta, manifesto=None):
+    manifesto = manifesto or ler_manifesto(pasta)
+    caminho = os.path.join(pasta, manifesto['arquivo'])
+    with pa.memory_map(caminho, 'r') as origem:
+        tabela = pa.ipc.open_file(origem).read_all()
+    return tabela.to_pandas()
+
+
+def valores_distintos_snapshot(pasta, coluna, manifesto=None):
+    # Lê só uma coluna do arquivo mapeado (as demais nem são convertidas); usado no cadastro de vendedores
+    manifesto = manifesto or ler_manifesto(pasta)
+    caminho = os.path.join(pasta, manifesto['arquivo'])
+    with pa.memory_map(caminho, 'r') as origem:
+        valores = pa.ipc.open_file(origem).read_all().column(coluna).unique().to_pylist()
+    return sorted(valor for valor in valores if valor is not None)
+
+
+def invalidar_snapshot(pasta):
+    manifesto = ler_manifesto(pasta)
+    if manifesto:
+        manifesto['invalidado'] = True
+        gravar_manifesto(pasta, manifesto)
+
+
+def garantir_snapshot(carregar, pasta, ttl_horas=12, forcar=False):
+    # Mesma regra de obter_snapshot, mas só devolve o manifesto: com o snapshot válido nada é lido do disco
+    manifesto = ler_manifesto(pasta)
+    if not forcar and snapshot_valido(manifesto, ttl_horas) and os.path.exists(os.path.join(pasta, manifesto['arquivo'])):
+        return manifesto
+    return salvar_snapshot(carregar(), pasta)
+
+
+def obter_snapshot(carregar, pasta, ttl_horas=12, forcar=False):
+    # Usa o arquivo local enquanto estiver dentro do TTL; senão chama 'carregar' (ERP) e regrava
+    manifesto = ler_manifesto(pasta)
+    if not forcar and snapshot_valido(manifesto, ttl_horas):
+        try:
+            return carregar_snapshot(pasta, manifesto), manifesto
+        except (OSError, pa.ArrowInvalid):
+            pass
+
+    manifesto = salvar_snapshot(carregar(), pasta)
+    return carregar_snapshot(pasta, manifesto), manifesto
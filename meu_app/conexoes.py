@@ -0,0 +1,121 @@
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+# Conexões ociosas guardadas por banco. Cada conexão é emprestada a uma thread por vez
+# (sessões do Streamlit rodam em threads diferentes), então check_same_thread pode ser desligado.
+# O pool fica em variáveis do módulo, e não em st.cache_resource, porque rodar_rotacao.py, os
+# benchmarks e as threads de tarefa em segundo plano usam as mesmas conexões fora de um script do
+# Streamlit; dentro do app o efeito é o mesmo (o módulo é importado uma vez por processo).
+MAXIMO_OCIOSAS = 4
+PRAGMAS_SQLITE = ['PRAGMA busy_timeout=5000']
+
+_pools = {}
+_pragmas_por_banco = {}
+_trava = threading.Lock()
+_totais = Counter()
+_por_thread = threading.local()
+
+
+# ---------- CONTADORES ----------
+def contar(banco, evento):
+    with _trava:
+        _totais[(banco, evento)] += 1
+    contadores = getattr(_por_thread, 'contadores', None)
+    if contadores is None:
+        contadores = _por_thread.contadores = Counter()
+    contadores[(banco, evento)] += 1
+
+
+def zerar_contadores_execucao():
+    # Chamado no início de cada rerun: os contadores por thread passam a medir só esta execução
+    _por_thread.contadores = Counter()
+
+
+def contadores_execucao():
+    return dict(getattr(_por_thread, 'contadores', Counter()))
+
+
+def contadores_totais():
+    with _trava:
+        return dict(_totais)
+
+
+# ---------- POOL ----------
+def pool_do_banco(banco):
+    with _trava:
+        if banco not in _pools:
+            _pools[banco] = queue.LifoQueue(maxsize=MAXIMO_OCIOSAS)
+        return _pools[banco]
+
+
+def fechar(banco, conn):
+    try:
+        conn.close()
+    finally:
+        contar(banco, 'fechadas')
+
+
+@contextmanager
+def conexao(banco, abrir):
+    # Empresta uma conexão ociosa de 'banco' ou abre uma nova com 'abrir()'. Se o bloco falhar,
+    # a conexão é descartada em vez de voltar ao pool (pode ter ficado em estado inválido).
+    pool = pool_do_banco(banco)
+    try:
+        conn = pool.get_nowait()
+        contar(banco, 'reutilizadas')
+    except queue.Empty:
+        conn = abrir()
+        contar(banco, 'abertas')
+
+    try:
+        yield conn
+        # Nada pendente volta para o pool: o próximo usuário começa sem transação aberta
+        conn.rollback()
+    except BaseException:
+        fechar(banco, conn)
+        raise
+
+    try:
+        pool.put_nowait(conn)
+    except queue.Full:
+        fechar(banco, conn)
+
+
+def fechar_todas():
+    with _trava:
+        pools = list(_pools.items())
+    for banco, pool in pools:
+        while True:
+            try:
+                fechar(banco, pool.get_nowait())
+            except queue.Empty:
+                break
+
+
+# ---------- SQLITE ----------
+def abrir_sqlite(caminho, pragmas=()):
+    # PRAGMAs aplicados uma única vez, quando a conexão nasce
+    conn = sqlite3.connect(caminho, check_same_thread=False)
+    for pragma in PRAGMAS_SQLITE + list(pragmas):
+        conn.execute(pragma)
+    return conn
+
+
+def pragmas_do_banco(caminho, pragmas):
+    # Um conjunto fixo de PRAGMAs por banco: toda conexão do pool desse caminho nasce com ele, seja qual
+    # for o chamador que a abriu. Pedir outro conjunto para o mesmo caminho é erro, não vale o primeiro.
+    pragmas = tuple(pragmas)
+    with _trava:
+        fixados = _pragmas_por_banco.setdefault(caminho, pragmas)
+    if fixados != pragmas:
+        raise ValueError(f'{caminho} já é aberto com {list(fixados)}; pedido com {list(pragmas)}')
+    return fixados
+
+
+def conexao_sqlite(caminho, pragmas=()):
+    pragmas = pragmas_do_banco(caminho, pragmas)
+    return conexao(caminho, lambda: abrir_sqlite(caminho, pragmas))
@@ -0,0 +1,479 @@
+import argparse
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from conexoes import conexao_sqlite, fechar_todas
+from esquema import compactar_contas
+from excel_io import escrever_xlsx
+from historico import criar_tabela_historico, registrar_rotacoes
+from metricas import derivar_colunas
+from pipeline import GRUPOS, criar_tabela_vendedores, filtrar_contas_grupo, preparar_base, rotacionar_e_registrar
+from relatorios import gerar_relatorios
+from rotacao import rotacionar_contas_vetorizado
+from sincronizacao import COLUNAS_SAIDA
+
+
+# Base fictícia com as mesmas colunas e tipos de carregar_dados_sql, para medir desempenho
+# sem o ERP nem o cadastro real de vendedores. Os mesmos geradores (e as implementações de referência)
+# servem aos benchmarks e às verificações de paridade do pytest.
+CLASSIFICACOES = [2, 3, 4, 5, 6, 7, 8]
+PESOS_CLASSIFICACAO = [0.15, 0.15, 0.1, 0.2, 0.15, 0.15, 0.1]
+
+
+# ---------- BASE DO ERP ----------
+def nomes_vendedores(n_vendedores):
+    return [f'Vendedor {i:03d}' for i in range(n_vendedores)]
+
+
+def datas_antes(agora, dias, rng):
+    return agora - pd.to_timedelta(dias, unit='D') - pd.to_timedelta(rng.integers(0, 86400, len(dias)), unit='s')
+
+
+def gerar_contagem_e_data(rng, n, media, escala_dias, agora):
+    # Contagem com cauda longa; sem evento, a data fica vazia
+    total = rng.negative_binomial(1, 1 / (1 + media), n)
+    data = datas_antes(agora, rng.exponential(escala_dias, n).astype(int), rng)
+    return total.astype(np.int32), pd.Series(data).where(total > 0)
+
+
+def gerar_base_erp(n_contas=100000, n_vendedores=None, semente=0, agora=None):
+    rng = np.random.default_rng(semente)
+    agora = pd.Timestamp(agora or pd.Timestamp.today().normalize())
+    n_vendedores = n_vendedores or max(20, min(200, n_contas // 2000))
+    vendedores = np.asarray(nomes_vendedores(n_vendedores), dtype=object)
+
+    # ~15% das contas são filiais: repetem a raiz de outra conta
+    indice_raiz = np.arange(n_contas)
+    filial = rng.random(n_contas) < 0.15
+    indice_raiz[filial] = rng.choice(indice_raiz[~filial], filial.sum())
+    raizes = 1_000_000 + rng.permutation(n_contas) * 37
+    raiz = pd.Series(raizes[indice_raiz]).astype(str).str.zfill(8)
+    sufixo = pd.Series(np.where(filial, rng.integers(2, 60, n_contas), 1)).astype(str).str.zfill(4)
+    cnpj = raiz + sufixo + pd.Series(rng.integers(0, 100, n_contas)).astype(str).str.zfill(2)
+
+    # Carteiras desiguais: poucos vendedores concentram muitas contas
+    pesos = 1 / (np.arange(n_vendedores) + 5)
+    vendedor = rng.choice(vendedores, n_contas, p=pesos / pesos.sum())
+
+    grupo_id = np.where(rng.random(n_contas) < 0.8, None, rng.integers(1, max(2, n_contas // 50), n_contas).astype(str))
+    grupo_nome = pd.Series(grupo_id, dtype=object).map(lambda g: None if g is None else f'Grupo {g}')
+
+    abertura = datas_antes(agora, rng.integers(0, 3650, n_contas), rng)
+    dias_sem_comprar = rng.exponential(240, n_contas).astype(int)
+    ultima_venda = pd.Series(np.maximum(datas_antes(agora, dias_sem_comprar, rng), abertura))
+    ultima_venda = ultima_venda.where(rng.random(n_contas) >= 0.35)
+    # Como no SQL: a última venda da raiz vale para todas as contas dela
+    ultima_venda_grupo = ultima_venda.groupby(raiz.to_numpy()).transform('max')
+
+    comprou_6_meses = (ultima_venda >= agora - pd.DateOffset(months=6)).to_numpy()
+    faturamento = np.where(comprou_6_meses, np.round(rng.lognormal(9, 1.6, n_contas), 2), 0.0)
+    pedidos = np.where(comprou_6_meses, rng.poisson(1 + np.log1p(faturamento) / 2), 0)
+
+    df = pd.DataFrame({
+        'Conta_ID': np.arange(1, n_contas + 1),
+        'tipo_conta': 2,
+        'Razao_Social_Pessoas': 'Empresa ' + pd.Series(np.arange(1, n_contas + 1)).astype(str) + ' LTDA',
+        'CNPJ': cnpj,
+        'Raiz_CNPJ': raiz,
+        'Grupo_Econômico_ID': grupo_id,
+        'Grupo_Econômico_Nome': grupo_nome,
+        'Nome_Vendedor': vendedor,
+        'Data_Ultima_Venda_Individual': ultima_venda,
+        'Faturamento_6_Meses': faturamento,
+        'Data_Abertura_Conta': abertura,
+        'Total_Pedidos': pedidos,
+        'Data_Ultima_Venda_Grupo_CNPJ': ultima_venda_grupo,
+        'Classificacao_Conta': rng.choice(CLASSIFICACOES, n_contas, p=PESOS_CLASSIFICACAO),
+        'Classificacao_Pessoa': rng.choice(CLASSIFICACOES, n_contas, p=PESOS_CLASSIFICACAO),
+        'Porte_Empresa': rng.integers(1, 5, n_contas),
+    })
+    for coluna_total, coluna_data, media, escala in [
+        ('Total_Followups', 'Data_Ultimo_Followup', 4, 150),
+        ('Total_Contatos', 'Data_Ultimo_Contato', 2, 400),
+        ('Total_Oportunidades', 'Data_Ultima_Oportunidade', 1, 300),
+        ('Total_Orcamentos', 'Data_Ultimo_Orcamento', 3, 200),
+    ]:
+        df[coluna_total], df[coluna_data] = gerar_contagem_e_data(rng, n_contas, media, escala, agora)
+
+    return compactar_contas(df[COLUNAS_SAIDA])
+
+
+# ---------- CADASTROS E HISTÓRICO ----------
+def dividir_vendedores(df_base):
+    # Metade dos vendedores (intercalados) em cada grupo
+    vendedores = sorted(df_base['Nome_Vendedor'].dropna().unique())
+    return {'distribuicao': vendedores[0::2], 'corporativo': vendedores[1::2]}
+
+
+def gravar_vendedores_db(caminho, vendedores_por_grupo):
+    criar_tabela_vendedores(caminho)
+    with conexao_sqlite(caminho) as conn:
+        with conn:
+            conn.executemany('INSERT OR IGNORE INTO vendedores (nome, tipo) VALUES (?, ?)', [
+                (nome, GRUPOS[grupo]['tipo']) for grupo, nomes in vendedores_por_grupo.items() for nome in nomes
+            ])
+
+
+def gerar_historico(df_base, fracao=0.3, max_rotacoes=4, semente=0, agora=None):
+    # Rotações automáticas passadas: (nome_vendedor, conta_id, tipo_rotacao, data_rotacao, raiz_cnpj)
+    rng = np.random.default_rng(semente + 1)
+    agora = pd.Timestamp(agora or pd.Timestamp.today().normalize())
+    vendedores = np.asarray(sorted(df_base['Nome_Vendedor'].dropna().unique()), dtype=object)
+
+    contas = df_base[rng.random(len(df_base)) < fracao]
+    repeticoes = rng.integers(1, max_rotacoes + 1, len(contas))
+    linhas = np.repeat(np.arange(len(contas)), repeticoes)
+    datas = (agora - pd.to_timedelta(rng.integers(1, 36, len(linhas)) * 30, unit='D')).strftime('%Y-%m-%d')
+    return zip(
+        rng.choice(vendedores, len(linhas)),
+        contas['Conta_ID'].to_numpy()[linhas],
+        ['Automática'] * len(linhas),
+        datas,
+        contas['Raiz_CNPJ'].to_numpy()[linhas],
+    )
+
+
+def gravar_historico_db(caminho, registros):
+    criar_tabela_historico(caminho)
+    return registrar_rotacoes(registros, caminho)
+
+
+def gerar_referencia(df_base, fracao=0.05, semente=0):
+    # Mesmo formato da planilha enviada no app (ex.: contas_que_entraram_20_03_2025.xlsx)
+    rng = np.random.default_rng(semente + 2)
+    amostra = df_base[rng.random(len(df_base)) < fracao]
+    vendedores = np.asarray(sorted(df_base['Nome_Vendedor'].dropna().unique()), dtype=object)
+    return pd.DataFrame({
+        'Nome_Vendedor': rng.choice(vendedores, len(amostra)),
+        'Raiz_CNPJ': amostra['Raiz_CNPJ'].to_numpy(),
+        'Contas que irão entrar': amostra['Razao_Social_Pessoas'].to_numpy(),
+    })
+
+
+# ---------- CENÁRIOS DE ROTAÇÃO ----------
+def gerar_cenario_rotacao(n_contas=50000, n_vendedores=50, max_antigos=45, semente=0):
+    # Parte das contas já passou por quase todos os vendedores, o que deixa poucas
+    # opções e faz o sorteio guloso desperdiçar vagas.
+    rng = np.random.default_rng(semente)
+    vendedores = [f'Vendedor {i:02d}' for i in range(n_vendedores)]
+
+    df_contas = pd.DataFrame({
+        'Conta_ID': np.arange(n_contas),
+        'Raiz_CNPJ': pd.Series(np.arange(n_contas)).astype(str).str.zfill(14),
+        'Nome_Vendedor': rng.choice(vendedores, n_contas),
+        'Faturamento_6_Meses': np.round(rng.lognormal(8, 1.5, n_contas), 2),
+        'Data_Entrou_Carteira': pd.NaT,
+    })
+
+    n_antigos = np.where(rng.random(n_contas) < 0.5, rng.integers(0, 3, n_contas), rng.integers(1, max_antigos + 1, n_contas))
+    linhas = np.repeat(np.arange(n_contas), n_antigos)
+    pesos = np.linspace(1, 3, n_vendedores)
+    antigos = rng.choice(n_vendedores, len(linhas), p=pesos / pesos.sum())
+    df_historico = pd.DataFrame({
+        'Raiz_CNPJ': df_contas['Raiz_CNPJ'].to_numpy()[linhas],
+        'Nome_Vendedor': np.asarray(vendedores)[antigos],
+    }).drop_duplicates()
+
+    return df_contas, vendedores, df_historico
+
+
+def gerar_rotacoes_mes(rng, mes, n_linhas, n_contas, vendedores):
+    # Uma rotação mensal: (nome_vendedor, conta_id, tipo_rotacao, data_rotacao, raiz_cnpj), ~3% manuais
+    dias = rng.integers(1, 29, n_linhas)
+    tipos = np.where(rng.random(n_linhas) < 0.03, 'Manual', 'Automática')
+    return zip(
+        rng.choice(vendedores, n_linhas).tolist(), rng.integers(1, n_contas + 1, n_linhas).tolist(), tipos.tolist(),
+        [f'{mes}-{dia:02d}' for dia in dias], [None] * n_linhas
+    )
+
+
+def ultimas_rotacoes_sinteticas(df_base, semente=0):
+    # Mesmo formato de carregar_ultimas_rotacoes, a partir do histórico fictício
+    historico = pd.DataFrame(
+        list(gerar_historico(df_base, semente=semente)),
+        columns=['nome_vendedor', 'conta_id', 'tipo_rotacao', 'data_rotacao', 'raiz_cnpj']
+    )
+    df_rotacao = historico.groupby('conta_id', as_index=False)['data_rotacao'].max()
+    df_rotacao.columns = ['conta_id', 'data_ultima_rotacao']
+    df_rotacao['data_ultima_rotacao'] = pd.to_datetime(df_rotacao['data_ultima_rotacao'])
+    df_rotacao['conta_id'] = df_rotacao['conta_id'].astype('int64')
+    return df_rotacao
+
+
+# ---------- ERP EM SQLITE ----------
+# O SQLite não aceita o nome em três partes grupofort.dbo.crm_contas: aqui crm_contas fica no mesmo 'dbo'
+CONTAS_SQLITE = 'dbo.crm_contas'
+
+
+def conectar_erp_sqlite(caminho):
+    # Substituto local do SQL Server: o banco anexado como 'dbo' aceita as mesmas consultas dbo.tabela
+    conn = sqlite3.connect(':memory:')
+    conn.execute('ATTACH DATABASE ? AS dbo', (caminho,))
+    return conn
+
+
+def gerar_erp_sqlite(caminho, n_contas=20000, eventos_por_conta=20, semente=0, agora=None):
+    rng = np.random.default_rng(semente)
+    agora = pd.Timestamp(agora or pd.Timestamp.today().normalize())
+    n_vendedores = 50
+
+    def datas(n, dias=720):
+        return (agora - pd.to_timedelta(rng.integers(0, dias * 86400, n), unit='s')).strftime('%Y-%m-%d %H:%M:%S')
+
+    pessoas_id = np.arange(1, n_contas + 1)
+    vendedores_id = np.arange(n_contas + 1, n_contas + n_vendedores + 1)
+    cnpj = pd.Series(rng.integers(10**7, 10**7 + n_contas // 2, n_contas)).astype(str) + '000199'
+    pessoas = pd.DataFrame({
+        'id': np.concatenate([pessoas_id, vendedores_id]),
+        'razao_social': [f'Empresa {i}' for i in pessoas_id] + [f'Vendedor {i}' for i in range(n_vendedores)],
+        'cpf_cnpj': np.concatenate([cnpj.to_numpy(), np.full(n_vendedores, '00000000000000')]),
+        'data_ultima_venda': np.concatenate([np.where(rng.random(n_contas) < 0.3, None, datas(n_contas)), np.full(n_vendedores, None)]),
+        'classificacao_id': rng.integers(2, 9, n_contas + n_vendedores),
+    })
+    contas = pd.DataFrame({
+        'id': pessoas_id, 'cliente_id': pessoas_id, 'vendedor_id': rng.choice(vendedores_id, n_contas),
+        'tipo_conta': 2, 'excluido': 0, 'status_conta': 0,
+        'data_cadastro': datas(n_contas, 2000), 'classificacao_id': rng.integers(2, 9, n_contas), 'porte_id': rng.integers(1, 5, n_contas),
+    })
+    rel_pessoas = pd.DataFrame({
+        'id': pessoas_id,
+        'grupo_id': np.where(rng.random(n_contas) < 0.8, None, rng.integers(1, 500, n_contas).astype(str)),
+        'grupo_nome': None,
+    })
+
+    def eventos(chave, coluna_data, n):
+        return pd.DataFrame({chave: rng.choice(pessoas_id, n), coluna_data: datas(n)})
+
+    n_eventos = n_contas * eventos_por_conta // 4
+    tabelas = {
+        'pessoas': pessoas, 'crm_contas': contas, 'rel_pessoas': rel_pessoas,
+        'pessoas_followup_anexos': eventos('pessoa_id', 'data_cadastro', n_eventos),
+        'contatos': eventos('pessoa_id', 'data_cadastro', n_eventos),
+        'crm_oportunidades': eventos('conta_id', 'data_cadastro', n_eventos),
+        'rel_crm_orcamentos': eventos('pessoa_cliente_id', 'data_emissao', n_eventos),
+        'rel_faturamento': eventos('pessoa_id', 'data_emissao', n_eventos).assign(
+            valor_total=np.round(rng.lognormal(7, 1, n_eventos), 2)),
+    }
+    conn = sqlite3.connect(caminho)
+    for nome, df in tabelas.items():
+        df.to_sql(nome, conn, index=False, if_exists='replace')
+    conn.commit()
+    conn.close()
+
+
+def inserir_eventos_novos(caminho, n_novos=500, semente=1, agora=None):
+    rng = np.random.default_rng(semente)
+    agora = pd.Timestamp(agora or pd.Timestamp.today().normalize())
+    conn = sqlite3.connect(caminho)
+    n_pessoas = conn.execute('SELECT COUNT(*) FROM crm_contas').fetchone()[0]
+    data = (agora + pd.Timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+    for tabela, chave, coluna_data in [('contatos', 'pessoa_id', 'data_cadastro'),
+                                       ('rel_crm_orcamentos', 'pessoa_cliente_id', 'data_emissao')]:
+        conn.executemany(f'INSERT INTO {tabela} ({chave}, {coluna_data}) VALUES (?, ?)',
+                         [(int(p), data) for p in rng.integers(1, n_pessoas + 1, n_novos)])
+    conn.executemany('INSERT INTO rel_faturamento (pessoa_id, data_emissao, valor_total) VALUES (?, ?, ?)',
+                     [(int(p), data, 100.0) for p in rng.integers(1, n_pessoas + 1, n_novos)])
+    conn.commit()
+    conn.close()
+
+
+def alterar_eventos_na_janela(caminho, semente=2, agora=None):
+    # O que um filtro '> marca' perderia: linha atrasada com a mesma data da marca, linha retroativa,
+    # valor editado e linhas excluídas, tudo dentro da janela de releitura
+    rng = np.random.default_rng(semente)
+    agora = pd.Timestamp(agora or pd.Timestamp.today().normalize())
+    conn = sqlite3.connect(caminho)
+    n_pessoas = conn.execute('SELECT COUNT(*) FROM crm_contas').fetchone()[0]
+    mesma_marca = (agora + pd.Timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+    retroativa = (agora - pd.Timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S')
+    recente = (agora - pd.Timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S')
+    for data in [mesma_marca, retroativa]:
+        conn.executemany('INSERT INTO contatos (pessoa_id, data_cadastro) VALUES (?, ?)',
+                         [(int(p), data) for p in rng.integers(1, n_pessoas + 1, 50)])
+        conn.executemany('INSERT INTO rel_faturamento (pessoa_id, data_emissao, valor_total) VALUES (?, ?, ?)',
+                         [(int(p), data, 10.0) for p in rng.integers(1, n_pessoas + 1, 50)])
+    conn.execute('''
+        UPDATE rel_faturamento SET valor_total = valor_total + 50
+        WHERE rowid IN (SELECT rowid FROM rel_faturamento WHERE data_emissao >= ? LIMIT 20)
+    ''', (recente,))
+    for tabela, coluna_data in [('contatos', 'data_cadastro'), ('rel_crm_orcamentos', 'data_emissao')]:
+        conn.execute(f'DELETE FROM {tabela} WHERE rowid IN (SELECT rowid FROM {tabela} WHERE {coluna_data} >= ? LIMIT 20)',
+                     (recente,))
+    conn.commit()
+    conn.close()
+
+
+# ---------- BASES DE DERIVAÇÃO E RELATÓRIO ----------
+def gerar_base_derivacao(n_linhas=200000, semente=0):
+    # Base já mesclada com o histórico, no formato que o upload produz antes das colunas derivadas
+    rng = np.random.default_rng(semente)
+    hoje = pd.Timestamp.today().normalize()
+
+    def datas(fracao_nula=0.3, dias=900):
+        valores = hoje - pd.to_timedelta(rng.integers(0, dias, n_linhas), unit='D')
+        return pd.Series(valores).where(rng.random(n_linhas) >= fracao_nula)
+
+    vendedores = np.array([f'Vendedor {i:02d}' for i in range(40)], dtype=object)
+    df = pd.DataFrame({
+        'Conta_ID': np.arange(n_linhas),
+        'Raiz_CNPJ': pd.Series(np.arange(n_linhas)).astype(str).str.zfill(14),
+        'Nome_Vendedor': rng.choice(vendedores, n_linhas),
+        'Faturamento_6_Meses': np.where(rng.random(n_linhas) < 0.5, 0, np.round(rng.lognormal(8, 1.5, n_linhas), 2)),
+        'Data_Ultima_Venda_Grupo_CNPJ': datas(),
+        'Data_Ultimo_Contato': datas(),
+        'Data_Ultimo_Followup': datas(),
+        'Data_Ultimo_Orcamento': datas(),
+        'Data_Ultima_Oportunidade': datas(),
+        'data_ultima_rotacao': datas(0.6),
+    })
+    for coluna in ['Total_Contatos', 'Total_Followups', 'Total_Orcamentos', 'Total_Oportunidades']:
+        df[coluna] = rng.integers(0, 50, n_linhas)
+
+    na_referencia = rng.random(n_linhas) < 0.4
+    referencia = pd.DataFrame({
+        'Raiz_CNPJ': df.loc[na_referencia, 'Raiz_CNPJ'].to_numpy(),
+        'Nome_Vendedor': rng.choice(vendedores, na_referencia.sum()),
+    })
+    return df, referencia
+
+
+def gerar_base_relatorio(n_linhas=60000, n_vendedores=30, semente=0):
+    # Base anterior (df_filtrado) e atual (após rotação) no formato que os relatórios recebem
+    rng = np.random.default_rng(semente)
+    df, referencia = gerar_base_derivacao(n_linhas, semente)
+    data_limite = datetime.today() - timedelta(days=6*30)
+    df = derivar_colunas(df, referencia, data_limite)
+
+    hoje = pd.Timestamp.today().normalize()
+    vendedores = np.array([f'Vendedor {i:02d}' for i in range(n_vendedores)], dtype=object)
+    df['Nome_Vendedor'] = rng.choice(vendedores, n_linhas)
+    df['Razao_Social_Pessoas'] = 'Empresa ' + df['Conta_ID'].astype(str)
+    df['Total_Pedidos'] = rng.integers(0, 30, n_linhas)
+    df['Grupo_Econômico_ID'] = np.where(rng.random(n_linhas) < 0.8, None, rng.integers(1, 500, n_linhas)).astype(object)
+    df['Data_Abertura_Conta'] = hoje - pd.to_timedelta(rng.integers(0, 2000, n_linhas), unit='D')
+
+    df_atual = df.copy()
+    rotacionadas = rng.random(n_linhas) < 0.1
+    df_atual.loc[rotacionadas, 'Nome_Vendedor'] = rng.choice(vendedores, rotacionadas.sum())
+    df_atual.loc[rotacionadas, 'Data_Entrou_Carteira'] = hoje
+    return df_atual, df, data_limite, hoje
+
+
+# ---------- IMPLEMENTAÇÕES DE REFERÊNCIA ----------
+# Versões anteriores (ou diretas) do que o app faz, comparadas pelo pytest e medidas pelos benchmarks
+def derivar_colunas_legado(df, referencia, data_limite):
+    # Cópia da lógica original com df.apply linha a linha, usada como referência de paridade
+    df = df.copy()
+    dict_transferencia = dict(zip(referencia['Raiz_CNPJ'], referencia['Nome_Vendedor']))
+    df['Nome_Vendedor'] = df.apply(
+        lambda row: dict_transferencia[row['Raiz_CNPJ']] if row['Raiz_CNPJ'] in dict_transferencia else row['Nome_Vendedor'],
+        axis=1
+    )
+    df['Data_Entrou_Carteira'] = np.where(
+        df['Raiz_CNPJ'].isin(referencia['Raiz_CNPJ']),
+        pd.Timestamp('2025-03-20'),
+        pd.NaT
+    )
+    df['Faturamento_6_Meses'] = pd.to_numeric(df['Faturamento_6_Meses'], errors='coerce').fillna(0)
+    df['Status_Cliente'] = df['Data_Ultima_Venda_Grupo_CNPJ'].apply(
+        lambda x: 'Nao Compra' if pd.isna(x) or x < data_limite else 'Compra'
+    )
+    df['Data_Ultimo_Contato'] = pd.to_datetime(df['Data_Ultimo_Contato'], errors='coerce')
+    df['Data_Ultimo_Followup'] = pd.to_datetime(df['Data_Ultimo_Followup'], errors='coerce')
+    df['Data_Entrou_Carteira'] = pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce')
+    df['Data_Ultimo_Orcamento'] = pd.to_datetime(df['Data_Ultimo_Orcamento'], errors='coerce')
+
+    for coluna_total, coluna_data, coluna_saida in [
+        ('Total_Contatos', 'Data_Ultimo_Contato', 'Total_Contatos_Rotacao'),
+        ('Total_Followups', 'Data_Ultimo_Followup', 'Total_Followups_Rotacao'),
+        ('Total_Orcamentos', 'Data_Ultimo_Orcamento', 'Total_Orcamentos_Rotacao'),
+        ('Total_Oportunidades', 'Data_Ultima_Oportunidade', 'Total_Oportunidades_Rotacao'),
+    ]:
+        df[coluna_saida] = df.apply(
+            lambda row: row[coluna_total] if pd.notna(row['Data_Entrou_Carteira']) and
+                                             pd.notna(row[coluna_data]) and
+                                             pd.notna(row['data_ultima_rotacao']) and
+                                             row[coluna_data] >= row['Data_Entrou_Carteira']
+                        else 0,
+            axis=1
+        )
+    return df
+
+
+def simular_rotacoes_ingenuo(df_contas, vendedores, df_historico, sementes, limite_por_vendedor):
+    # Alternativa direta: uma rotação completa (índice de exclusão + DataFrames de saída) por semente
+    notas = []
+    for semente in sementes:
+        df_rotacionadas, df_sobras = rotacionar_contas_vetorizado(
+            df_contas, vendedores, df_historico, limite_por_vendedor, rng=np.random.default_rng(semente)
+        )
+        notas.append({'semente': semente, 'colocadas': len(df_rotacionadas), 'sobras': len(df_sobras)})
+    return pd.DataFrame(notas)
+
+
+def rotacionar_grupo_a_grupo(df_erp, referencia, vendedores_por_grupo, data_limite, semente=0):
+    # Fluxo anterior do app: um upload por grupo, com a derivação refeita a cada vez
+    for grupo, vendedores in vendedores_por_grupo.items():
+        _, df_historico, df_filtrado, contas_vao_rotacionar = preparar_base(df_erp, referencia, vendedores, data_limite)
+        df_rotacionadas, _ = rotacionar_e_registrar(
+            filtrar_contas_grupo(contas_vao_rotacionar, grupo), vendedores, df_historico,
+            rng=np.random.default_rng(semente), registrar=False
+        )
+        df_atual = df_rotacionadas if not df_rotacionadas.empty else df_filtrado
+        gerar_relatorios(df_atual, df_filtrado, data_limite, pd.Timestamp.today().normalize(), GRUPOS[grupo]['pasta'])
+
+
+# ---------- PASTAS ----------
+@contextmanager
+def na_pasta(pasta):
+    # historico_rotacao.db, vendedores.db e as pastas de relatórios usam caminhos relativos
+    anterior = os.getcwd()
+    os.chdir(pasta)
+    try:
+        yield
+    finally:
+        # O pool guarda conexões pelo caminho relativo: não podem sobreviver à troca de pasta
+        fechar_todas()
+        os.chdir(anterior)
+
+
+def datas_modificacao(pasta):
+    return {nome: os.stat(os.path.join(pasta, nome)).st_mtime_ns for nome in os.listdir(pasta) if nome.endswith('.xlsx')}
+
+
+# ---------- CONJUNTO COMPLETO ----------
+def gerar_fixtures(pasta, n_contas=100000, semente=0, agora=None):
+    # base_erp.parquet + vendedores.db + historico_rotacao.db + referência em .xlsx e .csv
+    os.makedirs(pasta, exist_ok=True)
+    caminhos = {
+        'base': os.path.join(pasta, 'base_erp.parquet'),
+        'vendedores': os.path.join(pasta, 'vendedores.db'),
+        'historico': os.path.join(pasta, 'historico_rotacao.db'),
+        'referencia': os.path.join(pasta, 'referencia.xlsx'),
+        'referencia_csv': os.path.join(pasta, 'referencia.csv'),
+    }
+
+    df_base = gerar_base_erp(n_contas, semente=semente, agora=agora)
+    df_base.to_parquet(caminhos['base'], index=False)
+    gravar_vendedores_db(caminhos['vendedores'], dividir_vendedores(df_base))
+    gravar_historico_db(caminhos['historico'], gerar_historico(df_base, semente=semente, agora=agora))
+
+    referencia = gerar_referencia(df_base, semente=semente)
+    escrever_xlsx(caminhos['referencia'], [('Planilha1', referencia)])
+    referencia.to_csv(caminhos['referencia_csv'], sep=';', index=False)
+    return caminhos
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera base, cadastros e referência fictícios para testes de desempenho')
+    parser.add_argument('pasta')
+    parser.add_argument('--contas', type=int, default=100000)
+    parser.add_argument('--semente', type=int, default=0)
+    args = parser.parse_args()
+    for nome, caminho in gerar_fixtures(args.pasta, args.contas, args.semente).items():
+        print(f'{nome:<15} {caminho}')
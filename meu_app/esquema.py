@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+
+# Representação interna da base de contas. Raiz_CNPJ vira chave inteira (int64), nomes repetidos
+# viram categorias e contagens usam inteiros pequenos; o texto com 14 dígitos só volta na exportação.
+VERSAO_ESQUEMA = 2
+DIGITOS_RAIZ = 14
+RAIZ_INVALIDA = -1  # raiz vazia/nula; malformadas ganham chaves negativas próprias (abaixo de -1)
+
+COLUNAS_DATA = [
+    'Data_Ultima_Venda_Individual', 'Data_Abertura_Conta', 'Data_Ultima_Venda_Grupo_CNPJ',
+    'Data_Ultimo_Followup', 'Data_Ultimo_Contato', 'Data_Ultima_Oportunidade', 'Data_Ultimo_Orcamento',
+]
+TIPOS_INTEIROS = {
+    'Conta_ID': 'int64',
+    'tipo_conta': 'int8',
+    'Total_Pedidos': 'int32',
+    'Total_Followups': 'int32',
+    'Total_Contatos': 'int32',
+    'Total_Oportunidades': 'int32',
+    'Total_Orcamentos': 'int32',
+}
+COLUNAS_INTEIRAS = list(TIPOS_INTEIROS)
+COLUNAS_DECIMAIS = ['Faturamento_6_Meses']
+COLUNAS_CATEGORIA = ['Nome_Vendedor', 'Grupo_Econômico_Nome']
+
+
+# ---------- RAIZ DO CNPJ ----------
+def raiz_para_chave(serie):
+    # '00000012345678', '12345678', 12345678 e 12345678.0 (Excel) viram a mesma chave 12345678.
+    # Raiz com letras ou pontuação vira uma chave negativa tirada do hash do texto: raízes malformadas
+    # diferentes não se juntam, e a mesma raiz tem a mesma chave na base, na referência e no histórico.
+    if pd.api.types.is_integer_dtype(serie):
+        return serie.astype('int64')
+    if pd.api.types.is_numeric_dtype(serie):
+        return pd.to_numeric(serie, errors='coerce').fillna(RAIZ_INVALIDA).astype('int64')
+    texto = serie.astype(str).str.strip()
+    numeros = pd.to_numeric(texto, errors='coerce')
+    malformadas = numeros.isna() & serie.notna() & (texto != '')
+    chaves = numeros.fillna(RAIZ_INVALIDA).astype('int64')
+    if malformadas.any():
+        hashes = pd.util.hash_pandas_object(texto[malformadas].str.lstrip('0'), index=False).to_numpy()
+        chaves[malformadas] = -2 - (hashes >> np.uint64(2)).astype('int64')
+    return chaves
+
+
+def chave_para_raiz(serie):
+    # Chaves negativas (raiz vazia ou malformada) não têm texto de 14 dígitos
+    texto = serie.astype('int64').astype(str).str.zfill(DIGITOS_RAIZ)
+    return texto.where(serie >= 0, None)
+
+
+def raiz_texto(valor):
+    # Versão escalar para o que é gravado em historico_rotacao.db (sempre 14 dígitos)
+    if valor is None or pd.isna(valor):
+        return None
+    if isinstance(valor, (int, np.integer)):
+        return None if valor < 0 else f'{int(valor):0{DIGITOS_RAIZ}d}'
+    return str(valor).strip().zfill(DIGITOS_RAIZ)
+
+
+# ---------- NORMALIZAÇÃO ----------
+def compactar_contas(df):
+    # Aplicada uma vez na entrada (ERP/snapshot); idempotente
+    df = df.copy()
+    for coluna in COLUNAS_DATA:
+        if coluna in df.columns:
+            df[coluna] = pd.to_datetime(df[coluna], errors='coerce')
+    for coluna, tipo in TIPOS_INTEIROS.items():
+        if coluna in df.columns:
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').fillna(0).astype(tipo)
+    for coluna in COLUNAS_DECIMAIS:
+        if coluna in df.columns:
+            df[coluna] = pd.to_numeric(df[coluna], errors='coerce').fillna(0).astype('float64')
+    if 'Raiz_CNPJ' in df.columns:
+        df['Raiz_CNPJ'] = raiz_para_chave(df['Raiz_CNPJ'])
+    for coluna in COLUNAS_CATEGORIA:
+        if coluna in df.columns:
+            df[coluna] = df[coluna].astype('category')
+    return df
+
+
+def formatar_para_exportacao(df):
+    # Planilhas e arquivos lidos por pessoas continuam com a raiz em texto de 14 dígitos
+    if 'Raiz_CNPJ' in df.columns and pd.api.types.is_integer_dtype(df['Raiz_CNPJ']):
+        df = df.assign(Raiz_CNPJ=chave_para_raiz(df['Raiz_CNPJ']))
+    return df
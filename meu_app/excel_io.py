@@ -0,0 +1,120 @@
+import os
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from openpyxl import load_workbook
+
+from esquema import formatar_para_exportacao
+
+try:
+    import python_calamine  # noqa: F401
+    TEM_CALAMINE = True
+except ImportError:
+    TEM_CALAMINE = False
+
+
+COLUNAS_REFERENCIA = ['Raiz_CNPJ', 'Nome_Vendedor']
+# Mesmo formato que o pandas usava nas exportações anteriores
+FORMATO_DATA = 'yyyy-mm-dd hh:mm:ss'
+
+
+# ---------- ESCRITA ----------
+def valores_coluna(serie):
+    # Converte a coluna para valores Python aceitos pelo xlsxwriter; vazios viram None (célula em branco)
+    vazio = serie.isna().to_numpy()
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        if serie.dt.tz is not None:
+            serie = serie.dt.tz_localize(None)
+        valores = list(np.asarray(serie.dt.to_pydatetime(), dtype=object))
+    else:
+        valores = serie.astype(object).to_numpy().tolist()
+    for i in np.flatnonzero(vazio):
+        valores[i] = None
+    return valores
+
+
+def escrever_xlsx(destino, abas):
+    # abas: lista de (nome_aba, df). Modo constant_memory: cada linha vai para o disco assim que é
+    # escrita, então a memória não cresce com o tamanho da planilha (exige escrita linha a linha).
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True, 'strings_to_urls': False})
+    formato_data = workbook.add_format({'num_format': FORMATO_DATA})
+    formato_cabecalho = workbook.add_format({'bold': True, 'border': 1})
+
+    for nome_aba, df in abas:
+        df = formatar_para_exportacao(df)
+        worksheet = workbook.add_worksheet(nome_aba)
+        colunas = [str(coluna) for coluna in df.columns]
+        for indice, (nome, serie) in enumerate(df.items()):
+            if pd.api.types.is_datetime64_any_dtype(serie):
+                worksheet.set_column(indice, indice, 19, formato_data)
+        worksheet.write_row(0, 0, colunas, formato_cabecalho)
+
+        valores = [valores_coluna(serie) for _, serie in df.items()]
+        for linha, registro in enumerate(zip(*valores), start=1):
+            worksheet.write_row(linha, 0, registro)
+
+    if not abas:
+        workbook.add_worksheet()
+    workbook.close()
+
+
+def planilha_em_bytes(abas):
+    saida = BytesIO()
+    escrever_xlsx(saida, abas)
+    return saida.getvalue()
+
+
+def gerar_excel_download(df, nome_aba='Planilha1'):
+    return planilha_em_bytes([(nome_aba, df)])
+
+
+# ---------- LEITURA ----------
+def extensao(arquivo):
+    nome = getattr(arquivo, 'name', arquivo)
+    return os.path.splitext(str(nome))[1].lower()
+
+
+def ler_xlsx_colunas(arquivo, colunas, nome_aba='Planilha1'):
+    if TEM_CALAMINE:
+        return pd.read_excel(arquivo, sheet_name=nome_aba, usecols=colunas, engine='calamine')
+
+    # Leitura em fluxo (read_only) trazendo só as colunas pedidas
+    workbook = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[nome_aba]
+        linhas = worksheet.iter_rows(values_only=True)
+        cabecalho = list(next(linhas, ()))
+        faltando = [coluna for coluna in colunas if coluna not in cabecalho]
+        if faltando:
+            raise ValueError(f"Colunas ausentes na aba '{nome_aba}': {', '.join(faltando)}")
+        posicoes = [cabecalho.index(coluna) for coluna in colunas]
+        dados = [[linha[p] if p < len(linha) else None for p in posicoes] for linha in linhas if any(linha)]
+    finally:
+        workbook.close()
+    return pd.DataFrame(dados, columns=colunas)
+
+
+def detectar_separador(arquivo):
+    # Planilhas exportadas no Brasil costumam vir com ';'
+    if hasattr(arquivo, 'read'):
+        posicao = arquivo.tell()
+        primeira_linha = arquivo.readline()
+        arquivo.seek(posicao)
+    else:
+        with open(arquivo, 'rb') as f:
+            primeira_linha = f.readline()
+    if isinstance(primeira_linha, bytes):
+        primeira_linha = primeira_linha.decode('utf-8', errors='ignore')
+    return ';' if primeira_linha.count(';') > primeira_linha.count(',') else ','
+
+
+def ler_referencia(arquivo, colunas=COLUNAS_REFERENCIA, nome_aba='Planilha1'):
+    # Aceita .xlsx (aba 'Planilha1'), .csv e .parquet; sempre devolve só as colunas usadas na rotação
+    tipo = extensao(arquivo)
+    if tipo == '.csv':
+        return pd.read_csv(arquivo, usecols=colunas, dtype=str, sep=detectar_separador(arquivo))
+    if tipo == '.parquet':
+        return pd.read_parquet(arquivo, columns=colunas)
+    return ler_xlsx_colunas(arquivo, colunas, nome_aba)
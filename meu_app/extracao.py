@@ -0,0 +1,177 @@
+from datetime import datetime
+
+import pandas as pd
+
+from leitura_erp import ler_em_lotes
+from sincronizacao import COLUNAS_SAIDA, MESES_JANELA_FATURAMENTO, TABELA_CONTAS, parametro_data
+
+
+# Agregados por tabela de movimento, uma única varredura cada: valor e pedidos saem juntos de
+# rel_faturamento e os orçamentos vêm de um CTE (antes eram duas subconsultas correlacionadas por linha).
+# {restricao_*} limita a agregação às pessoas/contas selecionadas quando há um CTE de candidatos.
+AGREGADOS = """
+Faturamento AS (
+    SELECT pessoa_id, SUM(valor_total) AS valor_total, COUNT(*) AS total_pedidos
+    FROM dbo.rel_faturamento
+    WHERE data_emissao >= ? {restricao_pessoa}
+    GROUP BY pessoa_id
+),
+Followups AS (
+    SELECT pessoa_id, COUNT(*) AS total_followups, MAX(data_cadastro) AS data_ultimo_followup
+    FROM dbo.pessoas_followup_anexos
+    WHERE 1 = 1 {restricao_pessoa}
+    GROUP BY pessoa_id
+),
+Contatos AS (
+    SELECT pessoa_id, COUNT(*) AS total_contatos, MAX(data_cadastro) AS data_ultimo_contato
+    FROM dbo.contatos
+    WHERE 1 = 1 {restricao_pessoa}
+    GROUP BY pessoa_id
+),
+Oportunidades AS (
+    SELECT conta_id, COUNT(*) AS total_oportunidades, MAX(data_cadastro) AS data_ultima_oportunidade
+    FROM dbo.crm_oportunidades
+    WHERE 1 = 1 {restricao_conta}
+    GROUP BY conta_id
+),
+Orcamentos AS (
+    SELECT pessoa_cliente_id, COUNT(*) AS total_orcamentos, MAX(data_emissao) AS data_ultimo_orcamento
+    FROM dbo.rel_crm_orcamentos
+    WHERE 1 = 1 {restricao_orcamento}
+    GROUP BY pessoa_cliente_id
+)
+"""
+
+ULTIMA_VENDA_RAIZ = """
+UltimaVendaPorRaizCNPJ AS (
+    SELECT SUBSTRING(cpf_cnpj, 1, 8) AS Raiz_CNPJ, MAX(data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ
+    FROM dbo.pessoas
+    WHERE data_ultima_venda IS NOT NULL
+    GROUP BY SUBSTRING(cpf_cnpj, 1, 8)
+)
+"""
+
+CONTAS = """
+Contas AS (
+    SELECT
+        a.id AS Conta_ID,
+        a.cliente_id AS Cliente_ID,
+        a.tipo_conta,
+        b.razao_social AS Razao_Social_Pessoas,
+        b.cpf_cnpj AS CNPJ,
+        SUBSTRING(b.cpf_cnpj, 1, 8) AS Raiz_CNPJ,
+        c.grupo_id AS Grupo_Econômico_ID,
+        c.grupo_nome AS Grupo_Econômico_Nome,
+        v.razao_social AS Nome_Vendedor,
+        b.data_ultima_venda AS Data_Ultima_Venda_Individual,
+        a.data_cadastro AS Data_Abertura_Conta,
+        COALESCE(g.Data_Ultima_Venda_Grupo_CNPJ, b.data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ,
+        a.classificacao_id AS Classificacao_Conta,
+        b.classificacao_id AS Classificacao_Pessoa,
+        a.porte_id AS Porte_Empresa,
+        ROW_NUMBER() OVER (PARTITION BY SUBSTRING(b.cpf_cnpj, 1, 8) ORDER BY a.id) AS Ordem_Raiz
+    FROM
+        {tabela_contas} a
+        INNER JOIN dbo.pessoas b ON a.cliente_id = b.id
+        INNER JOIN dbo.rel_pessoas c ON b.id = c.id
+        INNER JOIN dbo.pessoas v ON a.vendedor_id = v.id
+        LEFT JOIN UltimaVendaPorRaizCNPJ g ON SUBSTRING(b.cpf_cnpj, 1, 8) = g.Raiz_CNPJ
+    WHERE
+        a.tipo_conta = 2
+        AND a.excluido = 0
+        AND a.status_conta = 0
+        AND b.classificacao_id <> 1
+        AND a.classificacao_id <> 1
+)
+"""
+
+# Mesmas regras de preparar_base: Nao Compra, conta aberta antes de data_limite e sem grupo econômico.
+# A data de entrada na carteira vem da referência enviada, então esse filtro continua no pandas.
+CANDIDATOS = """
+Candidatos AS (
+    SELECT * FROM Contas
+    WHERE
+        Ordem_Raiz = 1
+        AND Data_Abertura_Conta < ?
+        AND (Data_Ultima_Venda_Grupo_CNPJ IS NULL OR Data_Ultima_Venda_Grupo_CNPJ < ?)
+        AND NULLIF(CAST(Grupo_Econômico_ID AS VARCHAR(50)), '') IS NULL
+        {filtro_classificacao}
+)
+"""
+
+SELECAO = """
+SELECT
+    t.Conta_ID,
+    t.tipo_conta,
+    t.Razao_Social_Pessoas,
+    t.CNPJ,
+    t.Raiz_CNPJ,
+    t.Grupo_Econômico_ID,
+    t.Grupo_Econômico_Nome,
+    t.Nome_Vendedor,
+    t.Data_Ultima_Venda_Individual,
+    COALESCE(f.valor_total, 0) AS Faturamento_6_Meses,
+    t.Data_Abertura_Conta,
+    COALESCE(f.total_pedidos, 0) AS Total_Pedidos,
+    t.Data_Ultima_Venda_Grupo_CNPJ,
+    COALESCE(fu.total_followups, 0) AS Total_Followups,
+    fu.data_ultimo_followup AS Data_Ultimo_Followup,
+    COALESCE(ct.total_contatos, 0) AS Total_Contatos,
+    ct.data_ultimo_contato AS Data_Ultimo_Contato,
+    COALESCE(o.total_oportunidades, 0) AS Total_Oportunidades,
+    o.data_ultima_oportunidade AS Data_Ultima_Oportunidade,
+    t.Classificacao_Conta,
+    t.Classificacao_Pessoa,
+    t.Porte_Empresa,
+    COALESCE(oc.total_orcamentos, 0) AS Total_Orcamentos,
+    oc.data_ultimo_orcamento AS Data_Ultimo_Orcamento
+FROM
+    {origem} t
+    LEFT JOIN Faturamento f ON t.Cliente_ID = f.pessoa_id
+    LEFT JOIN Followups fu ON t.Cliente_ID = fu.pessoa_id
+    LEFT JOIN Contatos ct ON t.Cliente_ID = ct.pessoa_id
+    LEFT JOIN Oportunidades o ON t.Conta_ID = o.conta_id
+    LEFT JOIN Orcamentos oc ON t.Cliente_ID = oc.pessoa_cliente_id
+"""
+
+
+# ---------- CONSULTAS ----------
+def montar_consulta_completa(tabela_contas=TABELA_CONTAS):
+    # Base inteira (relatórios): todas as contas ativas, sem filtro de elegibilidade
+    agregados = AGREGADOS.format(restricao_pessoa='', restricao_conta='', restricao_orcamento='')
+    contas = CONTAS.format(tabela_contas=tabela_contas)
+    return f"WITH {ULTIMA_VENDA_RAIZ},{contas},{agregados}{SELECAO.format(origem='Contas')}"
+
+
+def montar_consulta_candidatos(classificacoes_5_7=None, tabela_contas=TABELA_CONTAS):
+    # classificacoes_5_7: True só 5 e 7 (Distribuição), False sem 5 e 7 (Corporativo), None as duas
+    filtro_classificacao = {
+        True: 'AND Classificacao_Conta IN (5, 7)',
+        False: 'AND Classificacao_Conta NOT IN (5, 7)',
+        None: '',
+    }[classificacoes_5_7]
+    agregados = AGREGADOS.format(
+        restricao_pessoa='AND pessoa_id IN (SELECT Cliente_ID FROM Candidatos)',
+        restricao_conta='AND conta_id IN (SELECT Conta_ID FROM Candidatos)',
+        restricao_orcamento='AND pessoa_cliente_id IN (SELECT Cliente_ID FROM Candidatos)',
+    )
+    candidatos = CANDIDATOS.format(filtro_classificacao=filtro_classificacao)
+    contas = CONTAS.format(tabela_contas=tabela_contas)
+    return f"WITH {ULTIMA_VENDA_RAIZ},{contas},{candidatos},{agregados}{SELECAO.format(origem='Candidatos')}"
+
+
+def corte_faturamento(agora=None):
+    agora = pd.Timestamp(agora or datetime.now())
+    return parametro_data(agora - pd.DateOffset(months=MESES_JANELA_FATURAMENTO))
+
+
+# ---------- EXTRAÇÃO ----------
+def carregar_base_completa(conn_erp, agora=None, tabela_contas=TABELA_CONTAS):
+    return ler_em_lotes(conn_erp, montar_consulta_completa(tabela_contas), (corte_faturamento(agora),))[COLUNAS_SAIDA]
+
+
+def carregar_candidatos(conn_erp, data_limite, classificacoes_5_7=None, agora=None, tabela_contas=TABELA_CONTAS):
+    # Só as contas que podem rotacionar atravessam a rede (uma por Raiz_CNPJ, a de menor Conta_ID)
+    limite = parametro_data(data_limite)
+    parametros = (limite, limite, corte_faturamento(agora))
+    return ler_em_lotes(conn_erp, montar_consulta_candidatos(classificacoes_5_7, tabela_contas), parametros)[COLUNAS_SAIDA]
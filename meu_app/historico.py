@@ -0,0 +1,500 @@
+import os
+import sqlite3
+from datetime import datetime
+from urllib.parse import quote
+
+import pandas as pd
+
+from conexoes import conexao_sqlite
+from esquema import formatar_para_exportacao, raiz_para_chave, raiz_texto
+
+
+CAMINHO_HISTORICO = 'historico_rotacao.db'
+VERSAO_HISTORICO = 5
+PRAGMAS_HISTORICO = ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL']
+PASTA_CONTAS_ROTACIONADAS = 'historico_rotacoes'
+PLANILHA_CONTAS_ROTACIONADAS = 'historico_rotacoes_completo.xlsx'
+TAMANHO_PAGINA_HISTORICO = 50
+COLUNAS_PAGINA_HISTORICO = ['id', 'data_rotacao', 'nome_vendedor', 'conta_id', 'raiz_cnpj', 'tipo_rotacao', 'tarefa_id']
+
+
+# ---------- CONEXÃO E ESQUEMA ----------
+def conectar_historico(caminho=CAMINHO_HISTORICO):
+    # Conexão do pool (uso: with conectar_historico() as conn); WAL e synchronous só na abertura
+    return conexao_sqlite(caminho, PRAGMAS_HISTORICO)
+
+
+def criar_tabela_historico(caminho=CAMINHO_HISTORICO):
+    with conectar_historico(caminho) as conn:
+        with conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS historico_rotacao (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome_vendedor TEXT,
+                conta_id INTEGER NOT NULL CHECK (typeof(conta_id) = 'integer'),
+                tipo_rotacao TEXT,
+                data_rotacao TEXT
+            )
+            ''')
+        migrar_historico(conn)
+
+
+def historico_atualizado(caminho=CAMINHO_HISTORICO):
+    # Só leitura (mode=ro): não cria o arquivo, não migra e não muda o journal. Usado pela simulação,
+    # que não pode gravar nada no histórico.
+    if not os.path.exists(caminho):
+        return False
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(caminho))}?mode=ro", uri=True)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0] >= VERSAO_HISTORICO
+    finally:
+        conn.close()
+
+
+def converter_conta_id(valor):
+    # Versões antigas gravavam o numpy.int64 como BLOB de 8 bytes (little-endian)
+    if isinstance(valor, bytes):
+        return int.from_bytes(valor, byteorder='little')
+    return int(valor)
+
+
+def migrar_historico(conn):
+    versao = conn.execute('PRAGMA user_version').fetchone()[0]
+    if versao < 1:
+        migrar_para_v1(conn)
+    if versao < 2:
+        migrar_para_v2(conn)
+    if versao < 3:
+        migrar_para_v3(conn)
+    if versao < 4:
+        migrar_para_v4(conn)
+    if versao < 5:
+        migrar_para_v5(conn)
+
+
+def migrar_para_v1(conn):
+    with conn:
+        conn.execute('BEGIN')
+        definicao = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'historico_rotacao'"
+        ).fetchone()[0]
+
+        # Bancos criados antes da v1 aceitavam qualquer tipo em conta_id: recria a tabela
+        # com a restrição de inteiro, convertendo os BLOBs no caminho
+        if 'typeof(conta_id)' not in definicao:
+            linhas = conn.execute(
+                'SELECT id, nome_vendedor, conta_id, tipo_rotacao, data_rotacao FROM historico_rotacao'
+            ).fetchall()
+            conn.execute('ALTER TABLE historico_rotacao RENAME TO historico_rotacao_antigo')
+            conn.execute('''
+            CREATE TABLE historico_rotacao (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nome_vendedor TEXT,
+                conta_id INTEGER NOT NULL CHECK (typeof(conta_id) = 'integer'),
+                tipo_rotacao TEXT,
+                data_rotacao TEXT
+            )
+            ''')
+            conn.executemany('''
+                INSERT INTO historico_rotacao (id, nome_vendedor, conta_id, tipo_rotacao, data_rotacao)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (id_, nome, converter_conta_id(conta_id), tipo, data)
+                for id_, nome, conta_id, tipo, data in linhas if conta_id is not None
+            ])
+            conn.execute('DROP TABLE historico_rotacao_antigo')
+
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_conta_data ON historico_rotacao (conta_id, data_rotacao)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_vendedor ON historico_rotacao (nome_vendedor)')
+        conn.execute('PRAGMA user_version = 1')
+
+
+def migrar_para_v2(conn):
+    # v2: cada rotação guarda a Raiz_CNPJ e a tabela donos_cnpj responde, por chave primária,
+    # quais vendedores uma raiz já teve (mantida a cada inserção, sem varrer o histórico)
+    with conn:
+        conn.execute('BEGIN')
+        colunas = [linha[1] for linha in conn.execute('PRAGMA table_info(historico_rotacao)')]
+        if 'raiz_cnpj' not in colunas:
+            conn.execute('ALTER TABLE historico_rotacao ADD COLUMN raiz_cnpj TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_raiz ON historico_rotacao (raiz_cnpj)')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS donos_cnpj (
+            raiz_cnpj TEXT NOT NULL,
+            nome_vendedor TEXT NOT NULL,
+            primeira_data TEXT,
+            ultima_data TEXT,
+            PRIMARY KEY (raiz_cnpj, nome_vendedor)
+        ) WITHOUT ROWID
+        ''')
+        conn.execute('PRAGMA user_version = 2')
+
+
+def migrar_para_v3(conn):
+    # v3: tarefas em segundo plano (tarefas.py) ficam no mesmo banco, para a tarefa de rotação
+    # gravar o histórico e o próprio estado numa única transação; cada rotação guarda a tarefa de origem
+    with conn:
+        conn.execute('BEGIN')
+        colunas = [linha[1] for linha in conn.execute('PRAGMA table_info(historico_rotacao)')]
+        if 'tarefa_id' not in colunas:
+            conn.execute('ALTER TABLE historico_rotacao ADD COLUMN tarefa_id INTEGER')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS tarefas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            progresso INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            mensagem TEXT,
+            resultado TEXT,
+            erro TEXT,
+            criada_em TEXT NOT NULL,
+            iniciada_em TEXT,
+            terminada_em TEXT
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tarefas_estado ON tarefas (estado)')
+        conn.execute('PRAGMA user_version = 3')
+
+
+def migrar_para_v4(conn):
+    # v4: navegação do histórico. Todo índice do SQLite termina no rowid (id), então cada filtro tem um
+    # índice já na ordem (data_rotacao, id) da paginação por chave. Os resumos por vendedor e mês são
+    # mantidos a cada inserção (atualizar_resumos), como donos_cnpj, e nunca exigem varrer o histórico.
+    with conn:
+        conn.execute('BEGIN')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_data ON historico_rotacao (data_rotacao)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_vendedor_data ON historico_rotacao (nome_vendedor, data_rotacao)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_tipo_data ON historico_rotacao (tipo_rotacao, data_rotacao)')
+        # Prefixo de idx_historico_vendedor_data
+        conn.execute('DROP INDEX IF EXISTS idx_historico_vendedor')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS rotacoes_vendedor_mes (
+            nome_vendedor TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            tipo_rotacao TEXT NOT NULL,
+            rotacoes INTEGER NOT NULL,
+            PRIMARY KEY (nome_vendedor, mes, tipo_rotacao)
+        ) WITHOUT ROWID
+        ''')
+        # entradas/saídas: contas que passaram a ser do vendedor (ou deixaram de ser) no mês,
+        # pela rotação mais recente de cada conta; a carteira ao longo do tempo é a soma acumulada
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS contas_vendedor_mes (
+            nome_vendedor TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            entradas INTEGER NOT NULL,
+            saidas INTEGER NOT NULL,
+            PRIMARY KEY (nome_vendedor, mes)
+        ) WITHOUT ROWID
+        ''')
+        recalcular_resumos(conn)
+        conn.execute('PRAGMA user_version = 4')
+
+
+def migrar_para_v5(conn):
+    # v5: cada tarefa guarda o processo dono (servidor:pid) e a última batida dele; só tarefas cujo dono
+    # morreu ou parou de bater são dadas como interrompidas (outros processos podem estar rodando as suas)
+    with conn:
+        conn.execute('BEGIN')
+        colunas = [linha[1] for linha in conn.execute('PRAGMA table_info(tarefas)')]
+        if 'dono' not in colunas:
+            conn.execute('ALTER TABLE tarefas ADD COLUMN dono TEXT')
+        if 'batida_em' not in colunas:
+            conn.execute('ALTER TABLE tarefas ADD COLUMN batida_em TEXT')
+        conn.execute('PRAGMA user_version = 5')
+
+
+def atualizar_donos(conn, pares):
+    # pares: (raiz_cnpj, nome_vendedor, data_rotacao)
+    conn.executemany('''
+        INSERT INTO donos_cnpj (raiz_cnpj, nome_vendedor, primeira_data, ultima_data)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(raiz_cnpj, nome_vendedor) DO UPDATE SET
+            primeira_data = MIN(donos_cnpj.primeira_data, excluded.primeira_data),
+            ultima_data = MAX(donos_cnpj.ultima_data, excluded.ultima_data)
+    ''', [(raiz, nome, data, data) for raiz, nome, data in pares if raiz and nome])
+
+
+# ---------- RESUMOS ----------
+def somar_rotacoes_mes(conn, desde_id=0):
+    conn.execute('''
+        INSERT INTO rotacoes_vendedor_mes (nome_vendedor, mes, tipo_rotacao, rotacoes)
+        SELECT nome_vendedor, substr(data_rotacao, 1, 7), COALESCE(tipo_rotacao, ''), COUNT(*)
+        FROM historico_rotacao
+        WHERE id > ? AND nome_vendedor IS NOT NULL AND data_rotacao IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (nome_vendedor, mes, tipo_rotacao) DO UPDATE SET rotacoes = rotacoes + excluded.rotacoes
+    ''', (desde_id,))
+
+
+def somar_movimentos_contas(conn, desde_id=0):
+    # Troca de dono de cada linha nova em relação à rotação anterior da mesma conta (que pode ser antiga);
+    # só as contas tocadas pelas linhas novas são lidas, pelo índice (conta_id, data_rotacao)
+    conn.execute('''
+        WITH transicoes AS (
+            SELECT nome_vendedor, anterior, substr(data_rotacao, 1, 7) AS mes FROM (
+                SELECT id, nome_vendedor, data_rotacao,
+                       LAG(nome_vendedor) OVER (PARTITION BY conta_id ORDER BY data_rotacao, id) AS anterior
+                FROM historico_rotacao
+                WHERE nome_vendedor IS NOT NULL AND data_rotacao IS NOT NULL
+                  AND conta_id IN (SELECT conta_id FROM historico_rotacao WHERE id > ?1)
+            )
+            WHERE id > ?1 AND (anterior IS NULL OR anterior <> nome_vendedor)
+        )
+        INSERT INTO contas_vendedor_mes (nome_vendedor, mes, entradas, saidas)
+        SELECT vendedor, mes, SUM(entrada), SUM(saida) FROM (
+            SELECT nome_vendedor AS vendedor, mes, 1 AS entrada, 0 AS saida FROM transicoes
+            UNION ALL
+            SELECT anterior, mes, 0, 1 FROM transicoes WHERE anterior IS NOT NULL
+        )
+        WHERE true
+        GROUP BY vendedor, mes
+        ON CONFLICT (nome_vendedor, mes) DO UPDATE SET
+            entradas = entradas + excluded.entradas,
+            saidas = saidas + excluded.saidas
+    ''', (desde_id,))
+
+
+def recalcular_resumos(conn):
+    conn.execute('DELETE FROM rotacoes_vendedor_mes')
+    conn.execute('DELETE FROM contas_vendedor_mes')
+    somar_rotacoes_mes(conn)
+    somar_movimentos_contas(conn)
+
+
+def atualizar_resumos(conn, desde_id):
+    # Soma só as linhas com id > desde_id. Uma linha com data anterior à última rotação já gravada da
+    # mesma conta muda trocas de dono já somadas: nesse caso (importação de histórico) tudo é recalculado.
+    retroativa = conn.execute('''
+        SELECT 1 FROM historico_rotacao nova
+        JOIN historico_rotacao antiga ON antiga.conta_id = nova.conta_id AND antiga.data_rotacao > nova.data_rotacao
+        WHERE nova.id > ?1 AND antiga.id <= ?1
+        LIMIT 1
+    ''', (desde_id,)).fetchone()
+    if retroativa:
+        recalcular_resumos(conn)
+    else:
+        somar_rotacoes_mes(conn, desde_id)
+        somar_movimentos_contas(conn, desde_id)
+
+
+# ---------- ESCRITA ----------
+def inserir_rotacoes(conn, registros, tarefa_id=None):
+    # Só os INSERTs, sem commit: quem chama decide a transação (registrar_rotacoes ou a tarefa de rotação)
+    linhas = [
+        (nome, int(conta_id), tipo, data, raiz_texto(raiz), tarefa_id)
+        for nome, conta_id, tipo, data, raiz in registros
+    ]
+    ultimo_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM historico_rotacao').fetchone()[0]
+    conn.executemany('''
+        INSERT INTO historico_rotacao (nome_vendedor, conta_id, tipo_rotacao, data_rotacao, raiz_cnpj, tarefa_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', linhas)
+    atualizar_donos(conn, [(raiz, nome, data) for nome, _, _, data, raiz, _ in linhas])
+    atualizar_resumos(conn, ultimo_id)
+    return len(linhas)
+
+
+def registrar_rotacoes(registros, caminho=CAMINHO_HISTORICO):
+    # registros: iterável de (nome_vendedor, conta_id, tipo_rotacao, data_rotacao, raiz_cnpj),
+    # gravados numa única transação (um único fsync para a rotação inteira)
+    registros = list(registros)
+    if not registros:
+        return 0
+
+    with conectar_historico(caminho) as conn:
+        with conn:
+            return inserir_rotacoes(conn, registros)
+
+
+def preencher_raiz_cnpj(df_contas, caminho=CAMINHO_HISTORICO):
+    # Rotações gravadas antes da v2 não têm raiz_cnpj: completa a partir da base atual (Conta_ID -> Raiz_CNPJ)
+    with conectar_historico(caminho) as conn:
+        if conn.execute('SELECT 1 FROM historico_rotacao WHERE raiz_cnpj IS NULL LIMIT 1').fetchone() is None:
+            return 0
+        with conn:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS mapa_raiz (conta_id INTEGER PRIMARY KEY, raiz_cnpj TEXT)')
+            conn.execute('DELETE FROM mapa_raiz')
+            conn.executemany('INSERT OR REPLACE INTO mapa_raiz VALUES (?, ?)', [
+                (int(conta_id), raiz_texto(raiz)) for conta_id, raiz in zip(df_contas['Conta_ID'], df_contas['Raiz_CNPJ'])
+            ])
+            pares = conn.execute('''
+                SELECT m.raiz_cnpj, h.nome_vendedor, h.data_rotacao
+                FROM historico_rotacao h JOIN mapa_raiz m ON m.conta_id = h.conta_id
+                WHERE h.raiz_cnpj IS NULL
+            ''').fetchall()
+            conn.execute('''
+                UPDATE historico_rotacao
+                SET raiz_cnpj = (SELECT raiz_cnpj FROM mapa_raiz WHERE mapa_raiz.conta_id = historico_rotacao.conta_id)
+                WHERE raiz_cnpj IS NULL
+                  AND conta_id IN (SELECT conta_id FROM mapa_raiz)
+            ''')
+            atualizar_donos(conn, pares)
+        return len(pares)
+
+
+def donos_sem_raiz(df_contas, caminho=CAMINHO_HISTORICO):
+    # Mesmo cruzamento de preencher_raiz_cnpj, só em memória: pares (Raiz_CNPJ, vendedor) sem gravar nada
+    with conectar_historico(caminho) as conn:
+        pendentes = pd.read_sql_query(
+            'SELECT conta_id AS Conta_ID, nome_vendedor AS Nome_Vendedor FROM historico_rotacao WHERE raiz_cnpj IS NULL', conn
+        )
+    pendentes['Conta_ID'] = pendentes['Conta_ID'].astype('int64')
+    return pendentes.merge(df_contas, on='Conta_ID')[['Raiz_CNPJ', 'Nome_Vendedor']]
+
+
+def registrar_contas_rotacionadas(df_rotacionadas, pasta=PASTA_CONTAS_ROTACIONADAS):
+    # Substitui a regravação do historico_rotacoes_completo.xlsx: cada rotação vira um arquivo
+    # novo na pasta, então o custo não cresce com os anos de histórico acumulado
+    if df_rotacionadas.empty:
+        return None
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f"rotacao_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.parquet")
+    formatar_para_exportacao(df_rotacionadas).to_parquet(caminho, index=False)
+    return caminho
+
+
+def importar_planilha_contas_rotacionadas(planilha=PLANILHA_CONTAS_ROTACIONADAS, pasta=PASTA_CONTAS_ROTACIONADAS):
+    # A planilha regravada pelas versões anteriores vira o primeiro arquivo da pasta (o nome ordena antes
+    # das rotações). Depois de importada é renomeada para .importada e não entra de novo.
+    if not os.path.exists(planilha):
+        return None
+    df = pd.read_excel(planilha, engine='calamine')
+    df['Raiz_CNPJ'] = raiz_para_chave(df['Raiz_CNPJ'])
+    # Colunas com tipos misturados (digitação no Excel) vão como texto para o parquet
+    for nome in df.columns[df.dtypes == object]:
+        df[nome] = df[nome].where(df[nome].isna(), df[nome].astype(str))
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, 'rotacao_00000000_planilha_anterior.parquet')
+    formatar_para_exportacao(df).to_parquet(caminho, index=False)
+    os.replace(planilha, planilha + '.importada')
+    return caminho
+
+
+# ---------- LEITURA ----------
+def carregar_ultimas_rotacoes(caminho=CAMINHO_HISTORICO):
+    with conectar_historico(caminho) as conn:
+        df_rotacao = pd.read_sql_query('''
+            SELECT conta_id, MAX(data_rotacao) as data_ultima_rotacao
+            FROM historico_rotacao
+            GROUP BY conta_id
+        ''', conn)
+
+    df_rotacao['data_ultima_rotacao'] = pd.to_datetime(df_rotacao['data_ultima_rotacao'])
+    df_rotacao['conta_id'] = df_rotacao['conta_id'].astype('int64')
+    return df_rotacao
+
+
+def marca_dagua_historico(caminho=CAMINHO_HISTORICO):
+    # Muda sempre que uma rotação é gravada (MAX pela chave primária, sem varrer a tabela)
+    with conectar_historico(caminho) as conn:
+        ultimo_id = conn.execute('SELECT MAX(id) FROM historico_rotacao').fetchone()[0]
+    return ultimo_id or 0
+
+
+def carregar_donos_cnpj(caminho=CAMINHO_HISTORICO):
+    # Todos os pares (Raiz_CNPJ, vendedor) que já existiram, no formato do df_historico da rotação
+    with conectar_historico(caminho) as conn:
+        donos = pd.read_sql_query(
+            'SELECT raiz_cnpj AS Raiz_CNPJ, nome_vendedor AS Nome_Vendedor FROM donos_cnpj', conn
+        )
+    donos['Raiz_CNPJ'] = raiz_para_chave(donos['Raiz_CNPJ'])
+    return donos
+
+
+def ler_contas_rotacionadas(pasta=PASTA_CONTAS_ROTACIONADAS):
+    # Visão consolidada (mesma deduplicação da antiga planilha), montada só quando alguém pede
+    if not os.path.isdir(pasta):
+        return pd.DataFrame()
+    arquivos = sorted(os.path.join(pasta, nome) for nome in os.listdir(pasta) if nome.endswith('.parquet'))
+    if not arquivos:
+        return pd.DataFrame()
+    df = pd.concat([pd.read_parquet(arquivo) for arquivo in arquivos], ignore_index=True)
+    return df.drop_duplicates(subset=['Raiz_CNPJ', 'Data_Entrou_Carteira'], keep='last').reset_index(drop=True)
+
+
+# ---------- NAVEGAÇÃO ----------
+def filtros_historico(vendedor=None, conta_id=None, data_inicio=None, data_fim=None, tipo_rotacao=None):
+    # Só o filtro mais seletivo (conta > vendedor > tipo) usa índice; nos outros o '+' impede o SQLite
+    # de escolher, sem estatísticas, o índice de tipo_rotacao (quase todas as linhas são 'Automática')
+    condicoes, parametros = [], []
+    for coluna, valor in [('conta_id', conta_id), ('nome_vendedor', vendedor), ('tipo_rotacao', tipo_rotacao)]:
+        if valor is None or valor == '':
+            continue
+        condicoes.append(f"{'+' if condicoes else ''}{coluna} = ?")
+        parametros.append(int(valor) if coluna == 'conta_id' else valor)
+    if data_inicio is not None:
+        condicoes.append('data_rotacao >= ?')
+        parametros.append(pd.Timestamp(data_inicio).strftime('%Y-%m-%d'))
+    if data_fim is not None:
+        # data_rotacao é texto ('AAAA-MM-DD' ou com hora): o dia final entra inteiro
+        condicoes.append('data_rotacao < ?')
+        parametros.append((pd.Timestamp(data_fim).normalize() + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+    return condicoes, parametros
+
+
+def pagina_historico(apos=None, tamanho=TAMANHO_PAGINA_HISTORICO, caminho=CAMINHO_HISTORICO, **filtros):
+    # Paginação por chave: mais recentes primeiro, (data_rotacao, id) decrescente. A página seguinte começa
+    # depois de 'apos' (a chave da última linha da página atual), sem OFFSET, então o custo de uma página não
+    # cresce com a profundidade nem com os anos de histórico. Devolve (página, chave da próxima ou None).
+    # Linhas legadas sem data_rotacao vêm por último, em id decrescente: a comparação (data_rotacao, id) < (?, ?)
+    # é NULL para elas, então ficam numa segunda consulta em vez de um OR (que obrigaria a ordenar tudo).
+    condicoes, parametros = filtros_historico(**filtros)
+    linhas = []
+    with conectar_historico(caminho) as conn:
+        if apos is None or apos[0] is not None:
+            chave = ['(data_rotacao, id) < (?, ?)'] if apos is not None else []
+            linhas = conn.execute(f'''
+                SELECT {', '.join(COLUNAS_PAGINA_HISTORICO)} FROM historico_rotacao
+                WHERE {' AND '.join([*condicoes, 'data_rotacao IS NOT NULL', *chave])}
+                ORDER BY data_rotacao DESC, id DESC
+                LIMIT ?
+            ''', [*parametros, *(apos or ()), tamanho + 1]).fetchall()
+        if len(linhas) <= tamanho:
+            chave = ['id < ?'] if apos is not None and apos[0] is None else []
+            linhas += conn.execute(f'''
+                SELECT {', '.join(COLUNAS_PAGINA_HISTORICO)} FROM historico_rotacao
+                WHERE {' AND '.join([*condicoes, 'data_rotacao IS NULL', *chave])}
+                ORDER BY id DESC
+                LIMIT ?
+            ''', [*parametros, *([apos[1]] if chave else []), tamanho + 1 - len(linhas)]).fetchall()
+    pagina = pd.DataFrame(linhas[:tamanho], columns=COLUNAS_PAGINA_HISTORICO)
+    proxima = (linhas[tamanho - 1][1], linhas[tamanho - 1][0]) if len(linhas) > tamanho else None
+    return pagina, proxima
+
+
+def resumo_rotacoes_mes(vendedor=None, tipo_rotacao=None, caminho=CAMINHO_HISTORICO):
+    condicoes, parametros = [], []
+    for coluna, valor in [('nome_vendedor', vendedor), ('tipo_rotacao', tipo_rotacao)]:
+        if valor:
+            condicoes.append(f'{coluna} = ?')
+            parametros.append(valor)
+    onde = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    with conectar_historico(caminho) as conn:
+        return pd.read_sql_query(f'''
+            SELECT nome_vendedor, mes, SUM(rotacoes) AS rotacoes
+            FROM rotacoes_vendedor_mes {onde}
+            GROUP BY nome_vendedor, mes
+            ORDER BY mes, nome_vendedor
+        ''', conn, params=parametros)
+
+
+def contas_vendedor_ao_longo_do_tempo(vendedor=None, caminho=CAMINHO_HISTORICO):
+    # Carteira vinda de rotações ao fim de cada mês com movimento: soma acumulada de entradas - saídas
+    with conectar_historico(caminho) as conn:
+        return pd.read_sql_query(f'''
+            SELECT nome_vendedor, mes, entradas, saidas,
+                   SUM(entradas - saidas) OVER (PARTITION BY nome_vendedor ORDER BY mes) AS contas
+            FROM contas_vendedor_mes
+            {'WHERE nome_vendedor = ?' if vendedor else ''}
+            ORDER BY mes, nome_vendedor
+        ''', conn, params=[vendedor] if vendedor else [])
+
+
+def opcoes_filtro_historico(caminho=CAMINHO_HISTORICO):
+    # Vendedores e tipos presentes no histórico, lidos do resumo (poucas linhas) e não da tabela inteira
+    with conectar_historico(caminho) as conn:
+        vendedores = [linha[0] for linha in conn.execute('SELECT DISTINCT nome_vendedor FROM rotacoes_vendedor_mes ORDER BY 1')]
+        tipos = [linha[0] for linha in conn.execute('SELECT DISTINCT tipo_rotacao FROM rotacoes_vendedor_mes ORDER BY 1')]
+    return vendedores, tipos
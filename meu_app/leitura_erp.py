@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from esquema import COLUNAS_DATA, COLUNAS_DECIMAIS, TIPOS_INTEIROS, compactar_contas, raiz_para_chave
+
+
+TAMANHO_LOTE = 50000
+
+
+# ---------- TIPAGEM POR LOTE ----------
+def coluna_tipada(nome, valores):
+    # Mesmos tipos de compactar_contas, montados direto das tuplas do cursor (sem coluna object intermediária)
+    if nome in COLUNAS_DATA:
+        return pd.to_datetime(pd.Series(valores, dtype=object), errors='coerce', format='ISO8601')
+    if nome in TIPOS_INTEIROS:
+        try:
+            return pd.Series(np.array(valores, dtype=np.int64).astype(TIPOS_INTEIROS[nome]))
+        except (TypeError, ValueError):
+            # Há nulos (ou Decimal/texto): passa por float e zera os vazios, como o fillna(0) do snapshot
+            return pd.Series(np.nan_to_num(np.array(valores, dtype=np.float64)).astype(TIPOS_INTEIROS[nome]))
+    if nome in COLUNAS_DECIMAIS:
+        # Decimal do SQL Server (money) vira float64 sem passar por pd.to_numeric
+        return pd.Series(np.nan_to_num(np.array(valores, dtype=np.float64)))
+    if nome == 'Raiz_CNPJ':
+        return raiz_para_chave(pd.Series(valores, dtype=object))
+    return pd.Series(valores)
+
+
+def tipar_lote(colunas, linhas):
+    valores = list(zip(*linhas)) or [()] * len(colunas)
+    return pd.DataFrame({nome: coluna_tipada(nome, list(coluna)) for nome, coluna in zip(colunas, valores)})
+
+
+# ---------- LEITURA ----------
+def iterar_lotes(conn, consulta, parametros=(), tamanho_lote=TAMANHO_LOTE):
+    # fetchmany em blocos fixos: só um lote de tuplas do driver fica vivo por vez.
+    # Funciona com pyodbc e com o sqlite3 usado como substituto local do ERP.
+    cursor = conn.cursor()
+    try:
+        cursor.execute(consulta, parametros)
+        colunas = [descricao[0] for descricao in cursor.description]
+        linhas = cursor.fetchmany(tamanho_lote)
+        if not linhas:
+            yield tipar_lote(colunas, [])
+        while linhas:
+            yield tipar_lote(colunas, linhas)
+            linhas = cursor.fetchmany(tamanho_lote)
+    finally:
+        cursor.close()
+
+
+def ler_em_lotes(conn, consulta, parametros=(), tamanho_lote=TAMANHO_LOTE):
+    # Substitui pd.read_sql: mesmo DataFrame, já tipado, sem materializar o resultado inteiro como object
+    # (as categorias só podem ser montadas depois de juntar os lotes)
+    return compactar_contas(pd.concat(iterar_lotes(conn, consulta, parametros, tamanho_lote), ignore_index=True))
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+
+DATA_ENTRADA_REFERENCIA = pd.Timestamp('2025-03-20')
+
+# coluna de total -> (coluna da data do último evento, coluna derivada após a rotação)
+METRICAS_ROTACAO = {
+    'Total_Contatos': ('Data_Ultimo_Contato', 'Total_Contatos_Rotacao'),
+    'Total_Followups': ('Data_Ultimo_Followup', 'Total_Followups_Rotacao'),
+    'Total_Orcamentos': ('Data_Ultimo_Orcamento', 'Total_Orcamentos_Rotacao'),
+    'Total_Oportunidades': ('Data_Ultima_Oportunidade', 'Total_Oportunidades_Rotacao'),
+}
+
+
+def aplicar_transferencias(nomes_vendedor, posicao_referencia, vendedores_referencia):
+    # Quem está na referência assume o vendedor de lá (mesmo que vazio); o resto mantém o atual
+    na_referencia = posicao_referencia >= 0
+    nomes = nomes_vendedor.astype(object).to_numpy(copy=True)
+    nomes[na_referencia] = vendedores_referencia[posicao_referencia[na_referencia]]
+    return pd.Series(nomes, index=nomes_vendedor.index, name=nomes_vendedor.name)
+
+
+def calcular_status_cliente(data_ultima_venda, data_limite):
+    data_ultima_venda = pd.to_datetime(data_ultima_venda, errors='coerce')
+    nao_compra = data_ultima_venda.isna() | (data_ultima_venda < data_limite)
+    return pd.Series(np.where(nao_compra, 'Nao Compra', 'Compra'), index=data_ultima_venda.index)
+
+
+def calcular_metricas_rotacao(df):
+    # Só conta eventos de contas que entraram pela referência, já rotacionadas,
+    # e cujo último evento é posterior à entrada na carteira
+    entrou = df['Data_Entrou_Carteira']
+    base = entrou.notna() & df['data_ultima_rotacao'].notna()
+
+    metricas = {}
+    for coluna_total, (coluna_data, coluna_saida) in METRICAS_ROTACAO.items():
+        data_evento = pd.to_datetime(df[coluna_data], errors='coerce')
+        valido = base & data_evento.notna() & (data_evento >= entrou)
+        metricas[coluna_saida] = df[coluna_total].where(valido, 0)
+    return metricas
+
+
+def derivar_colunas(df, referencia, data_limite, data_entrada=DATA_ENTRADA_REFERENCIA):
+    # Passo único e vetorizado sobre a base já mesclada com o histórico (data_ultima_rotacao)
+    df = df.copy()
+    # Mesmo efeito de dict(zip(...)): vale o último vendedor de cada Raiz_CNPJ repetida.
+    # Uma única busca em hash serve para a transferência e para a data de entrada.
+    transferencias = referencia.drop_duplicates(subset='Raiz_CNPJ', keep='last')
+    posicao_referencia = pd.Index(transferencias['Raiz_CNPJ']).get_indexer(df['Raiz_CNPJ'])
+    vendedores_referencia = transferencias['Nome_Vendedor'].astype(object).to_numpy()
+    df['Nome_Vendedor'] = aplicar_transferencias(df['Nome_Vendedor'], posicao_referencia, vendedores_referencia).astype('category')
+
+    df['Data_Entrou_Carteira'] = pd.to_datetime(pd.Series(
+        np.where(posicao_referencia >= 0, data_entrada, pd.NaT), index=df.index
+    ), errors='coerce')
+
+    df['Faturamento_6_Meses'] = pd.to_numeric(df['Faturamento_6_Meses'], errors='coerce').fillna(0)
+    df['Status_Cliente'] = calcular_status_cliente(df['Data_Ultima_Venda_Grupo_CNPJ'], data_limite)
+
+    for coluna in ['Data_Ultimo_Contato', 'Data_Ultimo_Followup', 'Data_Ultimo_Orcamento']:
+        df[coluna] = pd.to_datetime(df[coluna], errors='coerce')
+
+    for coluna, valores in calcular_metricas_rotacao(df).items():
+        df[coluna] = valores
+    return df
@@ -0,0 +1,228 @@
+import os
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+    TEM_DUCKDB = True
+except ImportError:
+    TEM_DUCKDB = False
+
+from esquema import raiz_para_chave
+from metricas import DATA_ENTRADA_REFERENCIA, METRICAS_ROTACAO
+from relatorios import COLUNAS_RELATORIO
+
+
+# Motor opcional (motor='duckdb') para a derivação da base e a classificação dos relatórios: as bases
+# entram como tabelas (sem cópia) e cada etapa vira uma consulta com janelas/CASE, executada em várias
+# threads. Junções, ordenações e tabelas intermediárias que não cabem em LIMITE_MEMORIA_DUCKDB vão
+# para PASTA_TEMPORARIA_DUCKDB. O resultado é o mesmo do caminho pandas (ver benchmark 'motor_duckdb').
+# As entradas continuam sendo DataFrames já em memória (snapshot carregado) e o resultado volta ao pandas:
+# só o trabalho intermediário das consultas pode sair da RAM.
+MOTORES = ('pandas', 'duckdb')
+LIMITE_MEMORIA_DUCKDB = None  # None = padrão do DuckDB (80% da RAM)
+PASTA_TEMPORARIA_DUCKDB = 'duckdb_temp'
+
+
+def coluna(nome):
+    return '"' + nome.replace('"', '""') + '"'
+
+
+# ---------- CONEXÃO ----------
+def conectar_duckdb(limite_memoria=LIMITE_MEMORIA_DUCKDB, threads=None, pasta_temporaria=PASTA_TEMPORARIA_DUCKDB):
+    if not TEM_DUCKDB:
+        raise RuntimeError("motor='duckdb' exige o pacote duckdb (pip install duckdb)")
+    os.makedirs(pasta_temporaria, exist_ok=True)
+    conn = duckdb.connect(config={'temp_directory': pasta_temporaria})
+    if limite_memoria:
+        conn.execute(f"SET memory_limit = '{limite_memoria}'")
+    if threads:
+        conn.execute(f'SET threads = {int(threads)}')
+    return conn
+
+
+def abrir_duckdb(conn=None):
+    # Conexão do chamador continua aberta; a criada aqui fecha ao fim do with
+    return nullcontext(conn) if conn is not None else conectar_duckdb()
+
+
+def registrar_tabela(conn, nome, df):
+    # Nome_Vendedor chega como category (ENUM no DuckDB); como texto, bases com categorias diferentes se comparam
+    conn.register(f'{nome}_origem', df)
+    if 'Nome_Vendedor' in df.columns:
+        conn.execute(f'''
+            CREATE OR REPLACE TEMP VIEW {nome} AS
+            SELECT * REPLACE (CAST(Nome_Vendedor AS VARCHAR) AS Nome_Vendedor) FROM {nome}_origem
+        ''')
+    else:
+        conn.execute(f'CREATE OR REPLACE TEMP VIEW {nome} AS SELECT * FROM {nome}_origem')
+
+
+def restaurar_tipos(df, tipos):
+    # Volta aos tipos do caminho pandas (o DuckDB devolve datas em microssegundos e texto no lugar de category)
+    for nome, tipo in tipos.items():
+        if nome in df.columns and df[nome].dtype != tipo:
+            df[nome] = df[nome].astype(tipo)
+    return df
+
+
+# ---------- DERIVAÇÃO DA BASE ----------
+COLUNAS_DERIVADAS = ['Raiz_CNPJ', 'Nome_Vendedor', 'Faturamento_6_Meses', 'conta_id', 'data_ultima_rotacao',
+                     'Data_Entrou_Carteira', 'Status_Cliente']
+
+
+def consulta_base():
+    # Mesmo resultado de drop_duplicates + merge com df_rotacao + derivar_colunas + filtros (pipeline.derivar_base).
+    # Só as colunas calculadas saem da consulta; as demais são copiadas uma vez da base pela posição (_posicao).
+    metricas = ',\n'.join(
+        f'''CASE WHEN Data_Entrou_Carteira IS NOT NULL AND data_ultima_rotacao IS NOT NULL
+                 AND TRY_CAST({coluna(coluna_data)} AS TIMESTAMP) >= Data_Entrou_Carteira
+                 THEN {coluna(coluna_total)} ELSE 0 END AS {coluna(coluna_saida)}'''
+        for coluna_total, (coluna_data, coluna_saida) in METRICAS_ROTACAO.items()
+    )
+    return f'''
+        WITH contas_unicas AS (
+            -- drop_duplicates(subset='Raiz_CNPJ'): só a primeira linha de cada raiz (agrupa só a chave e a posição)
+            SELECT * FROM contas
+            WHERE _posicao IN (SELECT MIN(_posicao) FROM contas GROUP BY Raiz_CNPJ)
+        ),
+        transferencias AS (
+            -- como dict(zip(...)): vale a última linha de cada Raiz_CNPJ da referência
+            SELECT _chave, Nome_Vendedor, TRUE AS _na_referencia FROM referencia
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY _chave ORDER BY _posicao DESC) = 1
+        ),
+        mesclada AS (
+            SELECT
+                c._posicao,
+                c._chave AS Raiz_CNPJ,
+                CASE WHEN t._na_referencia THEN t.Nome_Vendedor ELSE c.Nome_Vendedor END AS Nome_Vendedor,
+                COALESCE(TRY_CAST(c.Faturamento_6_Meses AS DOUBLE), 0) AS Faturamento_6_Meses,
+                r.conta_id AS _conta_id_rotacao,  -- nomes sem distinção de caixa: conta_id colidiria com Conta_ID
+                r.data_ultima_rotacao,
+                CASE WHEN t._na_referencia THEN $data_entrada END AS Data_Entrou_Carteira,
+                CASE WHEN c.Data_Ultima_Venda_Grupo_CNPJ IS NULL
+                          OR c.Data_Ultima_Venda_Grupo_CNPJ < $data_limite
+                     THEN 'Nao Compra' ELSE 'Compra' END AS Status_Cliente,
+                c.Data_Abertura_Conta,
+                c."Grupo_Econômico_ID",
+                {', '.join(f'c.{coluna(coluna_data)}' for coluna_data, _ in METRICAS_ROTACAO.values())},
+                {', '.join(f'c.{coluna(coluna_total)}' for coluna_total in METRICAS_ROTACAO)}
+            FROM contas_unicas c
+            LEFT JOIN rotacoes r ON c.Conta_ID = r.conta_id
+            LEFT JOIN transferencias t ON c._chave = t._chave
+        )
+        SELECT
+            _posicao, Raiz_CNPJ, Nome_Vendedor, Faturamento_6_Meses, _conta_id_rotacao, data_ultima_rotacao,
+            Data_Entrou_Carteira, Status_Cliente, {metricas},
+            COALESCE(Nome_Vendedor IN (SELECT nome FROM vendedores_ativos), FALSE) AS _ativo,
+            COALESCE(
+                Status_Cliente = 'Nao Compra'
+                AND Data_Abertura_Conta < $data_limite
+                AND (Data_Entrou_Carteira < $data_limite OR Data_Entrou_Carteira IS NULL)
+                AND ("Grupo_Econômico_ID" IS NULL OR "Grupo_Econômico_ID" = ''),
+                FALSE
+            ) AS _elegivel
+        FROM mesclada
+        ORDER BY _posicao
+    '''
+
+
+def derivar_base_duckdb(df, referencia, df_rotacao, vendedores_ativos, data_limite,
+                        data_entrada=DATA_ENTRADA_REFERENCIA, conn=None):
+    # Devolve (df, df_filtrado, contas_vao_rotacionar) com os mesmos tipos, ordem e índices do caminho pandas
+    # Só as colunas que a consulta lê (texto do pandas passa por conversão ao entrar no DuckDB)
+    lidas = ['Raiz_CNPJ', 'Conta_ID', 'Nome_Vendedor', 'Faturamento_6_Meses', 'Data_Ultima_Venda_Grupo_CNPJ',
+             'Data_Abertura_Conta', 'Grupo_Econômico_ID', *METRICAS_ROTACAO,
+             *(coluna_data for coluna_data, _ in METRICAS_ROTACAO.values())]
+    with abrir_duckdb(conn) as conn:
+        registrar_tabela(conn, 'contas', df[lidas].assign(_posicao=np.arange(len(df)), _chave=raiz_para_chave(df['Raiz_CNPJ'])))
+        registrar_tabela(conn, 'referencia', pd.DataFrame({
+            '_chave': raiz_para_chave(referencia['Raiz_CNPJ']).to_numpy(),
+            'Nome_Vendedor': referencia['Nome_Vendedor'].astype(object).to_numpy(),
+            '_posicao': np.arange(len(referencia)),
+        }))
+        registrar_tabela(conn, 'rotacoes', df_rotacao)
+        registrar_tabela(conn, 'vendedores_ativos', pd.DataFrame({'nome': pd.Series(list(vendedores_ativos), dtype=object)}))
+        derivadas = conn.execute(consulta_base(), {
+            'data_limite': pd.Timestamp(data_limite).to_pydatetime(),
+            'data_entrada': pd.Timestamp(data_entrada).to_pydatetime(),
+        }).fetchdf().rename(columns={'_conta_id_rotacao': 'conta_id'})
+
+    # Como no merge: conta sem rotação em alguma linha deixa conta_id inteira em float
+    conta_id = derivadas['conta_id']
+    tipos = {
+        'Raiz_CNPJ': 'int64',
+        'Faturamento_6_Meses': 'float64',
+        'conta_id': 'float64' if conta_id.isna().any() else df_rotacao['conta_id'].dtype,
+        'data_ultima_rotacao': df_rotacao['data_ultima_rotacao'].dtype,
+        'Data_Entrou_Carteira': 'datetime64[us]',
+        'Status_Cliente': pd.Series(['Compra']).dtype,
+        **{coluna_saida: df[coluna_total].dtype for coluna_total, (_, coluna_saida) in METRICAS_ROTACAO.items()},
+    }
+    derivadas = restaurar_tipos(derivadas, tipos)
+    derivadas['Nome_Vendedor'] = derivadas['Nome_Vendedor'].astype(object).astype('category')
+
+    # Mesma ordem de colunas do merge + derivar_colunas
+    base = df.take(derivadas['_posicao'].to_numpy()).reset_index(drop=True)
+    for coluna_data in ['Data_Ultimo_Contato', 'Data_Ultimo_Followup', 'Data_Ultimo_Orcamento']:
+        base[coluna_data] = pd.to_datetime(base[coluna_data], errors='coerce')
+    novas = [coluna_saida for _, coluna_saida in METRICAS_ROTACAO.values()]
+    base = base.assign(**{nome: derivadas[nome] for nome in COLUNAS_DERIVADAS + novas})
+    base = base[[*df.columns, *df_rotacao.columns, 'Data_Entrou_Carteira', 'Status_Cliente', *novas]]
+
+    df_filtrado = base[derivadas['_ativo'].to_numpy()].reset_index(drop=True)
+    contas_vao_rotacionar = base[derivadas['_elegivel'].to_numpy()]
+    return base, df_filtrado, contas_vao_rotacionar
+
+
+# ---------- CLASSIFICAÇÃO DOS RELATÓRIOS ----------
+def consulta_relatorios():
+    # Os blocos de montar_relatorio_vendedor numa consulta só: cada Raiz_CNPJ fica no primeiro bloco
+    # (na ordem abaixo) em que aparece para o vendedor, no lugar do isin(usados) sequencial
+    selecao = ', '.join(coluna(nome) for nome in COLUNAS_RELATORIO)
+    return f'''
+        WITH blocos AS (
+            SELECT 1 AS _bloco, 'Ativa' AS Status, {selecao}, _posicao FROM anterior
+            WHERE Data_Ultima_Venda_Grupo_CNPJ >= $data_limite OR "Grupo_Econômico_ID" IS NOT NULL
+            UNION ALL
+            SELECT 2, 'Entraram Recentemente', {selecao}, _posicao FROM anterior
+            WHERE Data_Entrou_Carteira >= $seis_meses_atras AND Data_Entrou_Carteira <> $data_rotacao
+            UNION ALL
+            SELECT 3, 'Novas Recebidas', {selecao}, _posicao FROM atual
+            WHERE Data_Entrou_Carteira = $data_rotacao
+            UNION ALL
+            SELECT 4, 'Cadastrado Recentemente', {selecao}, _posicao FROM anterior
+            WHERE Data_Abertura_Conta >= $seis_meses_atras
+            UNION ALL
+            SELECT 5, 'Retiradas', {selecao}, _posicao FROM anterior a
+            WHERE NOT EXISTS (
+                SELECT 1 FROM atual b WHERE b.Nome_Vendedor = a.Nome_Vendedor AND b.Raiz_CNPJ = a.Raiz_CNPJ
+            )
+        )
+        SELECT Status, {selecao} FROM blocos
+        WHERE Nome_Vendedor IN (SELECT Nome_Vendedor FROM atual)
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY Nome_Vendedor, Raiz_CNPJ ORDER BY _bloco, _posicao) = 1
+        ORDER BY Nome_Vendedor, Status, Razao_Social_Pessoas, _bloco, _posicao
+    '''
+
+
+def montar_relatorios_duckdb(df_atual, df_anterior, data_limite, data_rotacao, conn=None):
+    # Gera (vendedor, df_relatorio) na ordem de separar_por_vendedor, com as datas já normalizadas pelo chamador
+    # A consulta termina (e a conexão própria fecha) antes do primeiro yield
+    with abrir_duckdb(conn) as conn:
+        registrar_tabela(conn, 'atual', df_atual.assign(_posicao=np.arange(len(df_atual))))
+        registrar_tabela(conn, 'anterior', df_anterior.assign(_posicao=np.arange(len(df_anterior))))
+        relatorios = conn.execute(consulta_relatorios(), {
+            'data_limite': data_limite.to_pydatetime(),
+            'data_rotacao': data_rotacao.to_pydatetime(),
+            'seis_meses_atras': (data_rotacao - pd.DateOffset(months=6)).to_pydatetime(),
+        }).fetchdf()
+
+    tipos = {nome: tipo for nome, tipo in df_anterior.dtypes.items() if nome in COLUNAS_RELATORIO and tipo != 'category'}
+    relatorios = restaurar_tipos(relatorios, tipos)
+    por_vendedor = dict(tuple(relatorios.groupby('Nome_Vendedor', sort=False)))
+    vazio = relatorios.iloc[0:0]
+    for vendedor in df_atual['Nome_Vendedor'].dropna().unique():
+        yield vendedor, por_vendedor.get(vendedor, vazio).reset_index(drop=True)
@@ -0,0 +1,122 @@
+import cProfile
+import csv
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil
+    TEM_PSUTIL = True
+except ImportError:
+    TEM_PSUTIL = False
+
+
+CAMINHO_METRICAS = 'metricas_execucao.csv'
+PASTA_PERFIS = 'perfis'
+INTERVALO_AMOSTRA = 0.05
+CAMPOS_METRICAS = [
+    'execucao', 'origem', 'etapa', 'inicio', 'segundos', 'linhas_entrada', 'linhas_saida',
+    'rss_inicio_mb', 'pico_rss_mb', 'acrescimo_pico_mb',
+]
+
+
+# ---------- MEMÓRIA ----------
+def rss_atual_mb():
+    # psutil quando instalado; no Linux sem psutil lê /proc; nos demais casos não mede
+    if TEM_PSUTIL:
+        return psutil.Process().memory_info().rss / 1024**2
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+@contextmanager
+def amostrar_pico_rss(medida):
+    # Uma thread lê o RSS a cada INTERVALO_AMOSTRA enquanto a etapa roda e guarda o maior valor
+    inicio = rss_atual_mb()
+    if inicio is None:
+        yield
+        return
+    pico = [inicio]
+    parar = threading.Event()
+
+    def amostrar():
+        while not parar.wait(INTERVALO_AMOSTRA):
+            pico[0] = max(pico[0], rss_atual_mb())
+
+    amostrador = threading.Thread(target=amostrar, daemon=True)
+    amostrador.start()
+    try:
+        yield
+    finally:
+        parar.set()
+        amostrador.join()
+        pico[0] = max(pico[0], rss_atual_mb())
+        medida.update({
+            'rss_inicio_mb': round(inicio, 1),
+            'pico_rss_mb': round(pico[0], 1),
+            'acrescimo_pico_mb': round(pico[0] - inicio, 1),
+        })
+
+
+# ---------- ETAPAS ----------
+def novo_registro(origem):
+    return {'execucao': datetime.now().strftime('%Y%m%d_%H%M%S_%f'), 'origem': origem, 'etapas': []}
+
+
+@contextmanager
+def medir_etapa(registro, etapa, linhas_entrada=None):
+    # Uso: with medir_etapa(registro, 'rotação', len(df)) as medida: ...; medida['linhas_saida'] = n
+    medida = {'etapa': etapa, 'inicio': datetime.now().isoformat(timespec='seconds'), 'linhas_entrada': linhas_entrada}
+    inicio = time.perf_counter()
+    try:
+        with amostrar_pico_rss(medida):
+            yield medida
+    finally:
+        medida['segundos'] = round(time.perf_counter() - inicio, 3)
+        registro['etapas'].append(medida)
+
+
+def registro_de_tempos(origem, tempos):
+    # Converte o dicionário {etapa: segundos} do pipeline/CLI para o mesmo formato
+    registro = novo_registro(origem)
+    registro['etapas'] = [{'etapa': etapa, 'segundos': round(segundos, 3)} for etapa, segundos in tempos.items()]
+    return registro
+
+
+# ---------- PERSISTÊNCIA ----------
+def gravar_metricas(registro, caminho=CAMINHO_METRICAS):
+    # Acrescenta uma linha por etapa; o arquivo acumula as execuções para comparar mês a mês
+    if not registro['etapas']:
+        return
+    novo = not os.path.exists(caminho)
+    with open(caminho, 'a', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=CAMPOS_METRICAS, extrasaction='ignore')
+        if novo:
+            escritor.writeheader()
+        for medida in registro['etapas']:
+            escritor.writerow({'execucao': registro['execucao'], 'origem': registro['origem'], **medida})
+
+
+# ---------- cPROFILE ----------
+def iniciar_perfil():
+    perfilador = cProfile.Profile()
+    perfilador.enable()
+    return perfilador
+
+
+def encerrar_perfil(perfilador, registro, pasta=PASTA_PERFIS, linhas=25):
+    # Grava o .prof (abre em snakeviz/tuna como flame graph) e devolve o resumo por tempo acumulado
+    perfilador.disable()
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f"execucao_{registro['execucao']}.prof")
+    perfilador.dump_stats(caminho)
+    saida = io.StringIO()
+    pstats.Stats(perfilador, stream=saida).sort_stats('cumulative').print_stats(linhas)
+    return caminho, saida.getvalue()
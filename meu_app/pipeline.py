@@ -0,0 +1,302 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from conexoes import conexao, conexao_sqlite
+from esquema import raiz_para_chave
+from extracao import carregar_candidatos
+from historico import carregar_donos_cnpj, carregar_ultimas_rotacoes, donos_sem_raiz, preencher_raiz_cnpj, registrar_contas_rotacionadas, registrar_rotacoes
+from metricas import derivar_colunas
+from motor_duckdb import derivar_base_duckdb
+from relatorios import arquivar_relatorios, iterar_relatorios
+from rotacao import rotacionar_contas_vetorizado
+from simulacao import simular_rotacoes
+from sincronizacao import TABELA_CONTAS, carregar_dados_incremental
+
+
+CAMINHO_VENDEDORES = 'vendedores.db'
+
+# Grupos de vendedores: tipo no cadastro (vendedores.db), se ficam com as classificações 5 e 7 e pasta dos relatórios
+GRUPOS = {
+    'distribuicao': {'tipo': 'Distribuição', 'classificacoes_5_7': True, 'pasta': 'Relatorio_Vendedores_Helder'},
+    'corporativo': {'tipo': 'Corporativo', 'classificacoes_5_7': False, 'pasta': 'Relatorio_Vendedores_Karen'},
+}
+
+
+# ---------- TEMPOS POR ETAPA ----------
+@contextmanager
+def cronometrar(tempos, etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        tempos[etapa] = time.perf_counter() - inicio
+
+
+# ---------- CARGA ----------
+def conectar_erp(config):
+    # config: qualquer mapeamento com DB_SERVER, DB_NAME, DB_USER e DB_PASSWORD (st.secrets, secrets.toml, env).
+    # pyodbc só é importado aqui: derivação, rotação e relatórios rodam sem o driver ODBC (snapshot, benchmarks)
+    import pyodbc
+    connection_string = (
+        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+        f"SERVER={config['DB_SERVER']};DATABASE={config['DB_NAME']};UID={config['DB_USER']};PWD={config['DB_PASSWORD']}"
+    )
+    return pyodbc.connect(connection_string)
+
+
+def tabela_contas(config):
+    # DB_TABELA_CONTAS: nome completo de crm_contas quando não está em grupofort.dbo
+    return config.get('DB_TABELA_CONTAS') or TABELA_CONTAS
+
+
+def conexao_erp(config):
+    # Conexão do pool (uso: with conexao_erp(config) as conn), uma fila por servidor/banco
+    return conexao(f"erp:{config['DB_SERVER']}/{config['DB_NAME']}", lambda: conectar_erp(config))
+
+
+def buscar_dados_erp(config, caminho_sincronizacao='sincronizacao_erp.db', forcar_completa=False):
+    # forcar_completa: refaz do zero os agregados locais (alterações anteriores à janela de releitura)
+    with conexao_erp(config) as conn:
+        return carregar_dados_incremental(conn, caminho_sincronizacao, forcar_completa=forcar_completa,
+                                          tabela_contas=tabela_contas(config))
+
+
+def buscar_candidatos_erp(config, data_limite, grupos=None):
+    # Só as contas elegíveis (filtros aplicados no servidor); não serve para os relatórios, que usam a base inteira
+    grupos = list(GRUPOS) if grupos is None else grupos
+    classificacoes_5_7 = GRUPOS[grupos[0]]['classificacoes_5_7'] if len(grupos) == 1 else None
+    with conexao_erp(config) as conn:
+        return carregar_candidatos(conn, data_limite, classificacoes_5_7, tabela_contas=tabela_contas(config))
+
+
+def criar_tabela_vendedores(caminho=CAMINHO_VENDEDORES):
+    with conexao_sqlite(caminho) as conn:
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vendedores (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nome TEXT NOT NULL UNIQUE,
+                    tipo TEXT NOT NULL CHECK(tipo IN ('Distribuição', 'Corporativo'))
+                )
+            """)
+
+
+def carregar_vendedores_grupo(grupo, caminho=CAMINHO_VENDEDORES):
+    with conexao_sqlite(caminho) as conn:
+        linhas = conn.execute('SELECT nome FROM vendedores WHERE tipo = ?', (GRUPOS[grupo]['tipo'],)).fetchall()
+    return [linha[0] for linha in linhas]
+
+
+# ---------- DERIVAÇÃO ----------
+def calcular_data_limite(hoje=None):
+    return (hoje or datetime.today()) - timedelta(days=6*30)
+
+
+def derivar_base(df, referencia, df_rotacao, vendedores_ativos, data_limite):
+    # Base do ERP + referência + última rotação -> (base derivada, base dos vendedores ativos, contas elegíveis)
+    df = df.drop_duplicates(subset='Raiz_CNPJ')
+    referencia = referencia.copy()
+
+    # Chave inteira nos dois lados: o texto com 14 dígitos só volta na exportação
+    df['Raiz_CNPJ'] = raiz_para_chave(df['Raiz_CNPJ'])
+    referencia['Raiz_CNPJ'] = raiz_para_chave(referencia['Raiz_CNPJ'])
+
+    df = df.merge(df_rotacao, how='left', left_on='Conta_ID', right_on='conta_id')
+    df = derivar_colunas(df, referencia, data_limite)
+
+    df_filtrado = df[df['Nome_Vendedor'].isin(vendedores_ativos)].reset_index(drop=True)
+
+    contas_vao_rotacionar = df[
+        (df['Status_Cliente'] == 'Nao Compra') &
+        (df['Data_Abertura_Conta'] < data_limite) &
+        ((df['Data_Entrou_Carteira'] < data_limite) | (df['Data_Entrou_Carteira'].isnull())) &
+        ((df['Grupo_Econômico_ID'].isnull()) | (df['Grupo_Econômico_ID'] == ''))
+    ]
+    return df, df_filtrado, contas_vao_rotacionar
+
+
+def preparar_base(df, referencia, vendedores_ativos, data_limite, motor='pandas', registrar=True):
+    # Mesmo encadeamento da tela de upload: base do ERP + referência + histórico -> contas elegíveis
+    # motor='duckdb': a derivação roda como consulta SQL (motor_duckdb), com o mesmo resultado
+    # registrar=False (simulação): as rotações antigas sem raiz_cnpj entram só em memória, o banco fica intacto
+    df_rotacao = carregar_ultimas_rotacoes()
+    if motor == 'duckdb':
+        df, df_filtrado, contas_vao_rotacionar = derivar_base_duckdb(df, referencia, df_rotacao, vendedores_ativos, data_limite)
+    else:
+        df, df_filtrado, contas_vao_rotacionar = derivar_base(df, referencia, df_rotacao, vendedores_ativos, data_limite)
+
+    # Vendedores que cada Raiz_CNPJ já teve: dono atual + todos os donos gravados em historico_rotacao.db
+    contas = df[['Conta_ID', 'Raiz_CNPJ']]
+    donos_pendentes = None
+    if registrar:
+        preencher_raiz_cnpj(contas)
+    else:
+        donos_pendentes = donos_sem_raiz(contas)
+    df_historico = pd.concat(
+        [df[['Raiz_CNPJ', 'Nome_Vendedor']], carregar_donos_cnpj(), donos_pendentes], ignore_index=True
+    ).dropna().drop_duplicates().reset_index(drop=True)
+    return df, df_historico, df_filtrado, contas_vao_rotacionar
+
+
+def filtrar_contas_grupo(contas_vao_rotacionar, grupo):
+    classificacoes_5_7 = contas_vao_rotacionar['Classificacao_Conta'].isin([5, 7])
+    if GRUPOS[grupo]['classificacoes_5_7']:
+        return contas_vao_rotacionar[classificacoes_5_7]
+    return contas_vao_rotacionar[~classificacoes_5_7]
+
+
+def particionar_por_grupo(contas_vao_rotacionar, grupos):
+    # Uma única máscara de Classificacao_Conta para todos os grupos (mesma regra de filtrar_contas_grupo)
+    classificacoes_5_7 = contas_vao_rotacionar['Classificacao_Conta'].isin([5, 7])
+    return {
+        grupo: contas_vao_rotacionar[classificacoes_5_7 if GRUPOS[grupo]['classificacoes_5_7'] else ~classificacoes_5_7]
+        for grupo in grupos
+    }
+
+
+# ---------- ROTAÇÃO ----------
+def rotacionar_e_registrar(df_contas, lista_vendedores, df_historico, limite_por_vendedor=50, rng=None,
+                           modo='aleatorio', prioridade=None, balancear=None, registrar=True):
+    df_rotacionadas, df_sobras = rotacionar_contas_vetorizado(
+        df_contas, lista_vendedores, df_historico,
+        limite_por_vendedor=limite_por_vendedor, rng=rng,
+        modo=modo, prioridade=prioridade, balancear=balancear
+    )
+
+    if registrar:
+        registrar_resultado(df_rotacionadas)
+
+    return df_rotacionadas, df_sobras
+
+
+def registros_rotacao(df_rotacionadas):
+    # (nome_vendedor, conta_id, tipo_rotacao, data_rotacao, raiz_cnpj) de cada conta rotacionada hoje
+    data_hoje = pd.Timestamp.today().normalize().strftime('%Y-%m-%d')
+    return (
+        (novo_vendedor, conta_id, 'Automática', data_hoje, raiz_cnpj)
+        for conta_id, novo_vendedor, raiz_cnpj in zip(
+            df_rotacionadas['Conta_ID'], df_rotacionadas['Nome_Vendedor'], df_rotacionadas['Raiz_CNPJ']
+        )
+    )
+
+
+def registrar_resultado(df_rotacionadas):
+    # Registrar histórico no banco (uma única transação)
+    registrar_rotacoes(registros_rotacao(df_rotacionadas))
+    registrar_contas_rotacionadas(df_rotacionadas)
+
+
+def rotacionar_grupos(contas_por_grupo, vendedores_por_grupo, df_historico, limite_por_vendedor=50, rngs=None,
+                      modo='aleatorio', prioridade=None, balancear=None):
+    # Os grupos não dividem contas (partição por classificação) nem vendedores (nome único no cadastro):
+    # cada sorteio roda na sua thread, com o próprio gerador, sobre o mesmo df_historico (só leitura)
+    rngs = rngs or {grupo: np.random.default_rng() for grupo in contas_por_grupo}
+    with ThreadPoolExecutor(max_workers=max(1, len(contas_por_grupo))) as executor:
+        futuros = {
+            grupo: executor.submit(
+                rotacionar_contas_vetorizado, contas, vendedores_por_grupo[grupo], df_historico,
+                limite_por_vendedor, rngs[grupo], modo, prioridade, balancear
+            )
+            for grupo, contas in contas_por_grupo.items()
+        }
+    return {grupo: futuro.result() for grupo, futuro in futuros.items()}
+
+
+# ---------- RELATÓRIOS ----------
+def separar_por_grupo(resultados, vendedores_por_grupo):
+    # Resultados de iterar_relatorios -> {grupo: [resultados dos vendedores do grupo]}
+    grupo_do_vendedor = {nome: grupo for grupo, nomes in vendedores_por_grupo.items() for nome in nomes}
+    por_grupo = {grupo: [] for grupo in vendedores_por_grupo}
+    for resultado in resultados:
+        grupo = grupo_do_vendedor.get(resultado[0])
+        if grupo is not None:
+            por_grupo[grupo].append(resultado)
+    return por_grupo
+
+
+def gerar_relatorios_grupos(rotacionadas_por_grupo, df_filtrado, vendedores_por_grupo, data_limite, n_processos=None,
+                            motor='pandas'):
+    # Um único pool de processos monta os relatórios de todos os grupos; cada grupo é gravado na sua pasta.
+    # Grupo sem contas rotacionadas usa a carteira atual dos seus vendedores.
+    df_atual = pd.concat([
+        df_rotacionadas if not df_rotacionadas.empty
+        else df_filtrado[df_filtrado['Nome_Vendedor'].isin(vendedores_por_grupo[grupo])]
+        for grupo, df_rotacionadas in rotacionadas_por_grupo.items()
+    ], ignore_index=True)
+    resultados = iterar_relatorios(
+        df_atual, df_filtrado, data_limite, pd.Timestamp.today().normalize(), n_processos,
+        pastas_reuso=[GRUPOS[grupo]['pasta'] for grupo in rotacionadas_por_grupo], motor=motor
+    )
+    vendedores = {grupo: vendedores_por_grupo[grupo] for grupo in rotacionadas_por_grupo}
+    return {
+        grupo: arquivar_relatorios(lista, GRUPOS[grupo]['pasta'])
+        for grupo, lista in separar_por_grupo(resultados, vendedores).items()
+    }
+
+
+# ---------- EXECUÇÃO COMPLETA ----------
+def executar_rotacao_mensal(df_erp, referencia, vendedores_por_grupo, grupos, limite_por_vendedor=50, rng=None,
+                            modo='aleatorio', prioridade=None, balancear=None, registrar=True,
+                            gerar_relatorio=True, n_processos=None, tempos=None, data_limite=None,
+                            simulacoes=0, semente_inicial=0, motor='pandas'):
+    # vendedores_por_grupo: {'distribuicao': [...], 'corporativo': [...]}; grupos: quais rotacionar
+    # simulacoes > 0: sorteia antes essa quantidade de sementes por grupo e rotaciona com a melhor
+    # motor: 'pandas' ou 'duckdb' para a derivação da base e a classificação dos relatórios
+    tempos = {} if tempos is None else tempos
+    data_limite = data_limite or calcular_data_limite()
+    todos_vendedores = [nome for nomes in vendedores_por_grupo.values() for nome in nomes]
+
+    with cronometrar(tempos, 'derivação'):
+        _, df_historico, df_filtrado, contas_vao_rotacionar = preparar_base(
+            df_erp, referencia, todos_vendedores, data_limite, motor, registrar
+        )
+
+    contas_por_grupo = particionar_por_grupo(contas_vao_rotacionar, grupos)
+    # Um gerador independente por grupo (derivado de rng): os sorteios podem rodar ao mesmo tempo
+    rngs = dict(zip(grupos, (rng or np.random.default_rng()).spawn(len(grupos))))
+    rankings = dict.fromkeys(grupos)
+    if simulacoes:
+        for grupo in grupos:
+            with cronometrar(tempos, f'simulação {grupo}'):
+                rankings[grupo] = simular_rotacoes(
+                    contas_por_grupo[grupo], vendedores_por_grupo[grupo], df_historico, simulacoes, semente_inicial,
+                    limite_por_vendedor, modo=modo, prioridade=prioridade, balancear=balancear, n_processos=n_processos
+                )
+            if not rankings[grupo].empty:
+                rngs[grupo] = np.random.default_rng(int(rankings[grupo]['semente'].iloc[0]))
+
+    with cronometrar(tempos, 'rotação'):
+        saidas = rotacionar_grupos(
+            contas_por_grupo, vendedores_por_grupo, df_historico, limite_por_vendedor, rngs,
+            modo=modo, prioridade=prioridade, balancear=balancear
+        )
+
+    # Todos os grupos entram no histórico numa única transação
+    if registrar:
+        with cronometrar(tempos, 'registro do histórico'):
+            registrar_resultado(pd.concat([df_rotacionadas for df_rotacionadas, _ in saidas.values()], ignore_index=True))
+
+    arquivos = {}
+    if gerar_relatorio:
+        with cronometrar(tempos, 'relatórios'):
+            arquivos = gerar_relatorios_grupos(
+                {grupo: df_rotacionadas for grupo, (df_rotacionadas, _) in saidas.items()},
+                df_filtrado, vendedores_por_grupo, data_limite, n_processos, motor
+            )
+
+    resultados = {
+        grupo: {
+            'elegiveis': len(contas_por_grupo[grupo]),
+            'rotacionadas': saidas[grupo][0],
+            'sobras': saidas[grupo][1],
+            'arquivos': arquivos.get(grupo, {}),
+            'simulacao': rankings[grupo],
+        }
+        for grupo in grupos
+    }
+    return resultados, tempos
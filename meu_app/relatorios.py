@@ -0,0 +1,316 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pandas as pd
+
+from excel_io import planilha_em_bytes
+
+
+NOME_CONSOLIDADO = 'relatorio_mensal_completo.xlsx'
+NOME_MANIFESTO = 'manifesto_relatorios.json'
+LIMITE_ZIP_EM_MEMORIA = 64 * 1024 * 1024
+# iterar_relatorios roda numa thread de tarefas.py dentro do servidor: fork ali herdaria travas de outras
+# threads. Os processos nascem do forkserver (spawn onde ele não existe); as fatias chegam por pickle.
+METODO_PROCESSOS = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+COLUNAS_RELATORIO = [
+    'Nome_Vendedor',
+    'Razao_Social_Pessoas',
+    'Raiz_CNPJ',
+    'Faturamento_6_Meses',
+    'Total_Pedidos',
+    'Data_Ultima_Venda_Grupo_CNPJ',
+    'Data_Entrou_Carteira',
+    'data_ultima_rotacao',
+    'Total_Contatos_Rotacao',
+    'Data_Ultimo_Contato',
+    'Total_Followups_Rotacao',
+    'Data_Ultimo_Followup',
+    'Total_Orcamentos_Rotacao',
+    'Data_Ultimo_Orcamento'
+]
+
+
+def montar_bloco(df, status):
+    bloco = df[COLUNAS_RELATORIO].copy()
+    bloco.insert(0, 'Status', status)
+    return bloco
+
+
+# ---------- RELATÓRIO DE UM VENDEDOR ----------
+def montar_relatorio_vendedor(atual_vend, anterior_vend, data_limite, data_rotacao):
+    usados = set()
+    blocos = []
+
+    ativas = anterior_vend[
+        (
+            (anterior_vend['Data_Ultima_Venda_Grupo_CNPJ'] >= data_limite) |
+            (anterior_vend['Grupo_Econômico_ID'].notnull())
+        ) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados))
+    ]
+    usados.update(ativas['Raiz_CNPJ'])
+    blocos.append(montar_bloco(ativas, 'Ativa'))
+
+    seis_meses_atras = data_rotacao - pd.DateOffset(months=6)
+    recentes = anterior_vend[
+        (anterior_vend['Data_Entrou_Carteira'] >= seis_meses_atras) &
+        (anterior_vend['Data_Entrou_Carteira'] != data_rotacao) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados))
+    ]
+    usados.update(recentes['Raiz_CNPJ'])
+    blocos.append(montar_bloco(recentes, 'Entraram Recentemente'))
+
+    novas = atual_vend[
+        (atual_vend['Data_Entrou_Carteira'] == data_rotacao) &
+        (~atual_vend['Raiz_CNPJ'].isin(usados))
+    ]
+    usados.update(novas['Raiz_CNPJ'])
+    blocos.append(montar_bloco(novas, 'Novas Recebidas'))
+
+    cadastradas_recente = anterior_vend[
+        (anterior_vend['Data_Abertura_Conta'] >= seis_meses_atras) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados))
+    ]
+    usados.update(cadastradas_recente['Raiz_CNPJ'])
+    blocos.append(montar_bloco(cadastradas_recente, 'Cadastrado Recentemente'))
+
+    retiradas = anterior_vend[
+        (~anterior_vend['Raiz_CNPJ'].isin(atual_vend['Raiz_CNPJ'])) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados))
+    ]
+    usados.update(retiradas['Raiz_CNPJ'])
+    blocos.append(montar_bloco(retiradas, 'Retiradas'))
+
+    df_relatorio = pd.concat(blocos, ignore_index=True)
+    df_relatorio = df_relatorio.drop_duplicates(subset='Raiz_CNPJ', keep='first')
+    return df_relatorio.sort_values(['Status', 'Razao_Social_Pessoas']).reset_index(drop=True)
+
+
+def processar_vendedor(vendedor, atual_vend, anterior_vend, data_limite, data_rotacao, registro_anterior=None):
+    # Executado nos processos de trabalho: monta o relatório e devolve a planilha individual pronta
+    df_relatorio = montar_relatorio_vendedor(atual_vend, anterior_vend, data_limite, data_rotacao)
+    return renderizar_relatorio(vendedor, df_relatorio, data_rotacao, registro_anterior)
+
+
+def renderizar_relatorio(vendedor, df_relatorio, data_rotacao, registro_anterior=None):
+    # Se o conteúdo e o nome do arquivo batem com o manifesto (registro_anterior), a planilha não é
+    # gerada de novo (conteudo=None) e o arquivo que já está na pasta é reaproveitado.
+    if df_relatorio.empty:
+        return vendedor, df_relatorio, None, None
+    nome_arquivo = f"relatorio_{vendedor.replace(' ', '_')}_{data_rotacao.strftime('%Y-%m-%d')}.xlsx"
+    if registro_anterior and registro_anterior['arquivo'] == nome_arquivo \
+            and registro_anterior['impressao'] == impressao_relatorio(df_relatorio):
+        return vendedor, df_relatorio, nome_arquivo, None
+    return vendedor, df_relatorio, nome_arquivo, planilha_em_bytes([('Sheet1', df_relatorio)])
+
+
+# ---------- MANIFESTO ----------
+def impressao_relatorio(df_relatorio):
+    # sha256 do conteúdo calculado (colunas, tipos e valores), independente de como o xlsx é gravado
+    impressao = hashlib.sha256()
+    impressao.update(repr([(str(coluna), str(tipo)) for coluna, tipo in df_relatorio.dtypes.items()]).encode())
+    impressao.update(pd.util.hash_pandas_object(df_relatorio, index=False).to_numpy().tobytes())
+    return impressao.hexdigest()
+
+
+def impressao_consolidado(impressoes):
+    # impressoes: [(vendedor, impressao)] na ordem das abas
+    return hashlib.sha256(json.dumps(impressoes, ensure_ascii=False).encode()).hexdigest()
+
+
+def ler_manifesto_relatorios(pasta):
+    # {'vendedores': {vendedor: {'arquivo': nome, 'impressao': sha256}}, 'consolidado': sha256}
+    try:
+        with open(os.path.join(pasta, NOME_MANIFESTO), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'vendedores': {}, 'consolidado': None}
+
+
+def gravar_manifesto_relatorios(pasta, manifesto):
+    # Escreve num arquivo temporário e troca de uma vez: uma interrupção não deixa o manifesto pela metade
+    caminho = os.path.join(pasta, NOME_MANIFESTO)
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=1)
+    os.replace(caminho + '.tmp', caminho)
+
+
+def registros_reaproveitaveis(pastas_reuso):
+    # Junta os manifestos das pastas (a última vence) guardando de onde veio cada arquivo
+    registros = {}
+    for pasta in pastas_reuso:
+        for vendedor, registro in ler_manifesto_relatorios(pasta)['vendedores'].items():
+            if os.path.exists(os.path.join(pasta, registro['arquivo'])):
+                registros[vendedor] = {**registro, 'pasta': pasta}
+    return registros
+
+
+# ---------- TODOS OS VENDEDORES ----------
+def separar_por_vendedor(df_atual, df_anterior):
+    # Um único groupby por base no lugar de uma varredura booleana por vendedor
+    vazio_atual, vazio_anterior = df_atual.iloc[0:0], df_anterior.iloc[0:0]
+    grupos_atual = dict(tuple(df_atual.groupby('Nome_Vendedor', sort=False, observed=True)))
+    grupos_anterior = dict(tuple(df_anterior.groupby('Nome_Vendedor', sort=False, observed=True)))
+
+    for vendedor in df_atual['Nome_Vendedor'].dropna().unique():
+        yield vendedor, grupos_atual.get(vendedor, vazio_atual), grupos_anterior.get(vendedor, vazio_anterior)
+
+
+def iterar_relatorios(df_atual, df_anterior, data_limite, data_rotacao, n_processos=None, pastas_reuso=(),
+                      motor='pandas'):
+    # Gera (vendedor, df_relatorio, nome_arquivo, conteudo) na ordem dos vendedores,
+    # à medida que cada processo termina; vendedores sem contas no relatório são omitidos.
+    # pastas_reuso: pastas com manifesto; planilhas de conteúdo igual são lidas de lá em vez de geradas.
+    # motor='duckdb': os blocos de todos os vendedores saem de uma consulta só e os processos só gravam o xlsx.
+    data_rotacao = pd.to_datetime(data_rotacao).normalize()
+    data_limite = pd.to_datetime(data_limite).normalize()
+
+    # assign não altera as bases recebidas (sem .copy() no chamador) e, com copy-on-write, não duplica as demais colunas
+    df_atual, df_anterior = [
+        df.assign(
+            Data_Entrou_Carteira=pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce'),
+            Data_Ultima_Venda_Grupo_CNPJ=pd.to_datetime(df['Data_Ultima_Venda_Grupo_CNPJ'], errors='coerce')
+        )
+        for df in [df_atual, df_anterior]
+    ]
+
+    n_processos = n_processos or os.cpu_count() or 1
+    reaproveitaveis = registros_reaproveitaveis(pastas_reuso)
+    if motor == 'duckdb':
+        from motor_duckdb import montar_relatorios_duckdb
+        funcao = renderizar_relatorio
+        tarefas = [
+            (vendedor, df_relatorio, data_rotacao, reaproveitaveis.get(vendedor))
+            for vendedor, df_relatorio in montar_relatorios_duckdb(df_atual, df_anterior, data_limite, data_rotacao)
+        ]
+    else:
+        funcao = processar_vendedor
+        tarefas = [
+            (vendedor, atual_vend, anterior_vend, data_limite, data_rotacao, reaproveitaveis.get(vendedor))
+            for vendedor, atual_vend, anterior_vend in separar_por_vendedor(df_atual, df_anterior)
+        ]
+
+    if n_processos > 1 and len(tarefas) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_processos, len(tarefas)), mp_context=contexto_processos()) as executor:
+            resultados = executor.map(funcao, *zip(*tarefas))
+            yield from completar_reaproveitados(resultados, reaproveitaveis)
+    else:
+        yield from completar_reaproveitados((funcao(*tarefa) for tarefa in tarefas), reaproveitaveis)
+
+
+def contexto_processos():
+    contexto = multiprocessing.get_context(METODO_PROCESSOS)
+    if METODO_PROCESSOS == 'forkserver':
+        # Módulo (pandas, xlsxwriter) importado uma vez no forkserver, se for ele quem o inicia
+        contexto.set_forkserver_preload([__name__])
+    return contexto
+
+
+def completar_reaproveitados(resultados, reaproveitaveis):
+    for vendedor, df_relatorio, nome_arquivo, conteudo in resultados:
+        if nome_arquivo is None:
+            continue
+        if conteudo is None:
+            try:
+                with open(os.path.join(reaproveitaveis[vendedor]['pasta'], nome_arquivo), 'rb') as f:
+                    conteudo = f.read()
+            except OSError:
+                # Arquivo apagado depois da leitura do manifesto: gera de novo
+                conteudo = planilha_em_bytes([('Sheet1', df_relatorio)])
+        yield vendedor, df_relatorio, nome_arquivo, conteudo
+
+
+def planilha_consolidada(resultados):
+    # Uma aba por vendedor, na ordem dos vendedores. As abas não são renderizadas de novo: o xlsxwriter
+    # (constant_memory) grava o texto inline, sem sharedStrings, e os estilos são os mesmos em todas as
+    # planilhas, então o XML da aba de cada planilha individual entra como está num esqueleto com as abas vazias.
+    # Se o styles.xml de alguma planilha não for o do esqueleto (os índices de estilo das células mudariam),
+    # a consolidada é gravada inteira pelo xlsxwriter. test_paridade.py compara as duas saídas.
+    if not resultados:
+        return planilha_em_bytes([])
+    abas_consolidadas = [(vendedor[:31], df_relatorio) for vendedor, df_relatorio, _, _ in resultados]
+    esqueleto = planilha_em_bytes([(nome_aba, df_relatorio.iloc[0:0]) for nome_aba, df_relatorio in abas_consolidadas])
+    with zipfile.ZipFile(BytesIO(esqueleto)) as origem:
+        estilos = origem.read('xl/styles.xml')
+    abas = {}
+    for posicao, (_, _, _, conteudo) in enumerate(resultados, start=1):
+        with zipfile.ZipFile(BytesIO(conteudo)) as planilha:
+            if planilha.read('xl/styles.xml') != estilos:
+                return planilha_em_bytes(abas_consolidadas)
+            aba = planilha.read('xl/worksheets/sheet1.xml')
+        if posicao > 1:
+            aba = aba.replace(b'<sheetView tabSelected="1" ', b'<sheetView ', 1)
+        abas[f'xl/worksheets/sheet{posicao}.xml'] = aba
+
+    saida = BytesIO()
+    with zipfile.ZipFile(BytesIO(esqueleto)) as origem, zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as destino:
+        for item in origem.infolist():
+            destino.writestr(item, abas.get(item.filename) or origem.read(item))
+    return saida.getvalue()
+
+
+# ---------- EXPORTAÇÃO ----------
+def exportar_zip_relatorios(resultados, limite_memoria=LIMITE_ZIP_EM_MEMORIA):
+    # Cada planilha entra no ZIP assim que fica pronta. O ZIP fica em memória até 'limite_memoria'
+    # e depois passa para um arquivo temporário anônimo, exclusivo desta chamada (sem colisão entre sessões).
+    arquivo_zip = tempfile.SpooledTemporaryFile(max_size=limite_memoria)
+    gerados = []
+    with zipfile.ZipFile(arquivo_zip, 'w') as zipf:
+        for resultado in resultados:
+            _, _, nome_arquivo, conteudo = resultado
+            zipf.writestr(nome_arquivo, conteudo)
+            gerados.append(resultado)
+        zipf.writestr(NOME_CONSOLIDADO, planilha_consolidada(gerados))
+    arquivo_zip.seek(0)
+    return arquivo_zip, gerados
+
+
+def arquivar_relatorios(resultados, pasta_destino='Relatorio_Rotação'):
+    # Cópia no servidor: grava os bytes já prontos, sem recalcular nada. Pelo manifesto da pasta,
+    # só os arquivos cujo conteúdo mudou (ou que sumiram) são regravados; os de vendedores que saíram são apagados.
+    os.makedirs(pasta_destino, exist_ok=True)
+    anterior = ler_manifesto_relatorios(pasta_destino)
+    manifesto = {'vendedores': {}, 'consolidado': None}
+    arquivos_por_vendedor = {}
+    for vendedor, df_relatorio, nome_arquivo, conteudo in resultados:
+        caminho = f'{pasta_destino}/{nome_arquivo}'
+        registro = {'arquivo': nome_arquivo, 'impressao': impressao_relatorio(df_relatorio)}
+        if anterior['vendedores'].get(vendedor) != registro or not os.path.exists(caminho):
+            with open(caminho, 'wb') as f:
+                f.write(conteudo)
+        manifesto['vendedores'][vendedor] = registro
+        arquivos_por_vendedor[vendedor] = caminho
+
+    manifesto['consolidado'] = impressao_consolidado(
+        [(vendedor, registro['impressao']) for vendedor, registro in manifesto['vendedores'].items()]
+    )
+    caminho_consolidado = f'{pasta_destino}/{NOME_CONSOLIDADO}'
+    if anterior['consolidado'] != manifesto['consolidado'] or not os.path.exists(caminho_consolidado):
+        with open(caminho_consolidado, 'wb') as f:
+            f.write(planilha_consolidada(resultados))
+    gravar_manifesto_relatorios(pasta_destino, manifesto)
+
+    # Só arquivos que o manifesto anterior registrou: o que foi posto na pasta à mão fica
+    atuais = {registro['arquivo'] for registro in manifesto['vendedores'].values()}
+    for registro in anterior['vendedores'].values():
+        if registro['arquivo'] not in atuais:
+            try:
+                os.remove(os.path.join(pasta_destino, registro['arquivo']))
+            except OSError:
+                pass
+    return arquivos_por_vendedor
+
+
+def gerar_relatorios(df_atual, df_anterior, data_limite, data_rotacao, pasta_destino='Relatorio_Rotação', n_processos=None,
+                     motor='pandas'):
+    resultados = list(iterar_relatorios(
+        df_atual, df_anterior, data_limite, data_rotacao, n_processos, [pasta_destino], motor
+    ))
+    return arquivar_relatorios(resultados, pasta_destino)
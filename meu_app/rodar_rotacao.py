@@ -0,0 +1,113 @@
+import argparse
+import os
+import tomllib
+from functools import partial
+
+import numpy as np
+
+from cache_snapshot import obter_snapshot
+from excel_io import ler_referencia
+from historico import CAMINHO_HISTORICO, criar_tabela_historico, historico_atualizado
+from motor_duckdb import MOTORES
+from perfil import gravar_metricas, registro_de_tempos
+from pipeline import (
+    GRUPOS, buscar_candidatos_erp, buscar_dados_erp, calcular_data_limite, carregar_vendedores_grupo, cronometrar,
+    executar_rotacao_mensal
+)
+
+CHAVES_CONFIG = ['DB_SERVER', 'DB_NAME', 'DB_USER', 'DB_PASSWORD', 'DB_TABELA_CONTAS', 'SNAPSHOT_TTL_HORAS', 'MOTOR_CONSULTAS']
+
+
+def carregar_config(caminho_secrets='.streamlit/secrets.toml'):
+    # Mesmas chaves do st.secrets; variáveis de ambiente têm prioridade sobre o arquivo
+    config = {}
+    if os.path.exists(caminho_secrets):
+        with open(caminho_secrets, 'rb') as f:
+            config.update(tomllib.load(f))
+    config.update({chave: os.environ[chave] for chave in CHAVES_CONFIG if chave in os.environ})
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rotação mensal de carteiras sem interface (agendável)')
+    parser.add_argument('referencia', help="Histórico de rotação mais recente (.xlsx com aba 'Planilha1', .csv ou .parquet)")
+    parser.add_argument('--grupo', choices=['distribuicao', 'corporativo', 'ambos'], default='ambos')
+    parser.add_argument('--modo', choices=['aleatorio', 'otimo'], default='aleatorio')
+    parser.add_argument('--prioridade', choices=['faturamento'], default=None)
+    parser.add_argument('--limite', type=int, default=50, help='Contas novas por vendedor')
+    parser.add_argument('--semente', type=int, default=None, help='Semente do sorteio, para reproduzir uma rodada')
+    parser.add_argument('--processos', type=int, default=None, help='Processos para os relatórios')
+    parser.add_argument('--simular', action='store_true',
+                        help='Não grava nada em historico_rotacao.db (o banco precisa já estar na versão atual)')
+    parser.add_argument('--simulacoes', type=int, default=0,
+                        help='Sorteia antes N sementes por grupo (sem gravar) e rotaciona com a mais equilibrada')
+    parser.add_argument('--motor', choices=MOTORES, default=None,
+                        help='Derivação e relatórios em pandas ou DuckDB (padrão: MOTOR_CONSULTAS da configuração ou pandas)')
+    parser.add_argument('--sem-relatorio', action='store_true')
+    parser.add_argument('--atualizar-base', action='store_true', help='Ignora o snapshot local e consulta o ERP')
+    parser.add_argument('--ressincronizar', action='store_true',
+                        help='Refaz do zero os agregados locais do ERP (sincronizacao_erp.db); implica --atualizar-base')
+    parser.add_argument('--somente-candidatos', action='store_true',
+                        help='Traz do ERP só as contas elegíveis (filtros no servidor); implica --sem-relatorio')
+    args = parser.parse_args()
+
+    config = carregar_config()
+    grupos = list(GRUPOS) if args.grupo == 'ambos' else [args.grupo]
+    tempos = {}
+    data_limite = calcular_data_limite()
+    # Os relatórios comparam com a carteira inteira, que o modo de candidatos não traz
+    gerar_relatorio = not (args.sem_relatorio or args.somente_candidatos)
+
+    # A simulação só lê o histórico: criar ou migrar o esquema fica para uma rodada de verdade (ou o app)
+    if not args.simular:
+        criar_tabela_historico()
+    elif not historico_atualizado():
+        parser.error(f'--simular não cria nem migra {CAMINHO_HISTORICO}; ele está ausente ou em versão antiga. '
+                     'Rode uma vez sem --simular (ou abra o app) para atualizá-lo.')
+
+    with cronometrar(tempos, 'carga da base'):
+        if args.somente_candidatos:
+            df_erp = buscar_candidatos_erp(config, data_limite, grupos)
+            manifesto = None
+        else:
+            df_erp, manifesto = obter_snapshot(
+                partial(buscar_dados_erp, config, forcar_completa=args.ressincronizar), 'snapshot_erp',
+                ttl_horas=float(config.get('SNAPSHOT_TTL_HORAS', 12)), forcar=args.atualizar_base or args.ressincronizar
+            )
+    with cronometrar(tempos, 'leitura da referência'):
+        referencia = ler_referencia(args.referencia)
+
+    vendedores_por_grupo = {grupo: carregar_vendedores_grupo(grupo) for grupo in GRUPOS}
+
+    resultados, tempos = executar_rotacao_mensal(
+        df_erp, referencia, vendedores_por_grupo, grupos,
+        limite_por_vendedor=args.limite, rng=np.random.default_rng(args.semente),
+        modo=args.modo, prioridade=args.prioridade, balancear='contas' if args.modo == 'otimo' else None,
+        registrar=not args.simular, gerar_relatorio=gerar_relatorio,
+        n_processos=args.processos, tempos=tempos, data_limite=data_limite,
+        simulacoes=args.simulacoes, semente_inicial=args.semente or 0,
+        motor=args.motor or config.get('MOTOR_CONSULTAS', 'pandas')
+    )
+
+    if manifesto is None:
+        print(f"Base do ERP: {len(df_erp)} contas candidatas consultadas agora")
+    else:
+        print(f"Base do ERP: snapshot de {manifesto['criado_em']} ({manifesto['linhas']} contas)")
+    for grupo, resultado in resultados.items():
+        print(
+            f"[{grupo}] {resultado['elegiveis']} contas elegíveis, "
+            f"{len(resultado['rotacionadas'])} rotacionadas, {len(resultado['sobras'])} sem vendedor disponível, "
+            f"{len(resultado['arquivos'])} relatórios em {GRUPOS[grupo]['pasta']}/"
+        )
+        if resultado['simulacao'] is not None and not resultado['simulacao'].empty:
+            print(f"[{grupo}] {len(resultado['simulacao'])} simulações; usada a semente {resultado['simulacao']['semente'].iloc[0]}:")
+            print(resultado['simulacao'].head(5).to_string(index=False))
+    print('Tempo por etapa:')
+    for etapa, segundos in tempos.items():
+        print(f'  {etapa:<28} {segundos:8.2f}s')
+    # Mesmo arquivo de métricas do app, para comparar as rodadas mensais
+    gravar_metricas(registro_de_tempos('rodar_rotacao', tempos))
+
+
+if __name__ == '__main__':
+    main()
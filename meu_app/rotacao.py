@@ -0,0 +1,218 @@
+import numpy as np
+import pandas as pd
+
+
+# ---------- ÍNDICE DE EXCLUSÃO ----------
+def montar_indice_exclusao(df_contas, lista_vendedores, df_historico):
+    # Retorna as posições (linha, vendedor) proibidas em formato esparso (COO):
+    # a conta na linha i não pode voltar para o vendedor j que já a teve.
+    codigos_vendedor = pd.Index(lista_vendedores)
+    codigos_cnpj, cnpjs = pd.factorize(df_contas['Raiz_CNPJ'], sort=False)
+
+    hist = df_historico[['Raiz_CNPJ', 'Nome_Vendedor']].dropna()
+    hist = hist[hist['Raiz_CNPJ'].isin(cnpjs) & hist['Nome_Vendedor'].isin(codigos_vendedor)]
+    if hist.empty:
+        vazio = np.empty(0, dtype=np.int64)
+        return vazio, vazio
+
+    hist = hist.assign(
+        cnpj_cod=cnpjs.get_indexer(hist['Raiz_CNPJ']),
+        vend_cod=codigos_vendedor.get_indexer(hist['Nome_Vendedor'])
+    )[['cnpj_cod', 'vend_cod']].drop_duplicates()
+
+    contas = pd.DataFrame({'linha': np.arange(len(codigos_cnpj)), 'cnpj_cod': codigos_cnpj})
+    pares = contas.merge(hist, on='cnpj_cod', how='inner')
+    return pares['linha'].to_numpy(np.int64), pares['vend_cod'].to_numpy(np.int64)
+
+
+def montar_elegibilidade(n_contas, n_vendedores, linhas_excluidas, vendedores_excluidos):
+    # Matriz densa de propósito: os dois motores leem linhas inteiras (sorteio por lote,
+    # caminhos aumentantes) e um vendedor só fica fora para poucas contas, então o CSR
+    # não economizaria quase nada. Custa n_contas x n_vendedores bytes (1 milhão de
+    # contas x 60 vendedores ~ 60 MB; a simulação soma uma cópia em memória compartilhada).
+    # Acima disso, a base deve ser rotacionada por grupo (pipeline.rotacionar_grupos).
+    elegivel = np.ones((n_contas, n_vendedores), dtype=bool)
+    elegivel[linhas_excluidas, vendedores_excluidos] = False
+    return elegivel
+
+
+# ---------- MOTOR DE ATRIBUIÇÃO ----------
+def atribuir_em_lotes(elegivel, limite_por_vendedor, rng, tamanho_lote=4096):
+    # Cada conta sorteia um vendedor uniforme entre os elegíveis com vaga;
+    # conflitos de capacidade dentro do lote são resolvidos pela ordem das linhas
+    # e as contas recusadas tentam de novo com as vagas que sobraram.
+    n_contas, n_vendedores = elegivel.shape
+    vagas = np.full(n_vendedores, limite_por_vendedor, dtype=np.int64)
+    escolhidos = np.full(n_contas, -1, dtype=np.int64)
+
+    for inicio in range(0, n_contas, tamanho_lote):
+        pendentes = np.arange(inicio, min(inicio + tamanho_lote, n_contas))
+
+        while len(pendentes) and vagas.any():
+            # cópias limitadas ao lote: tamanho_lote x n_vendedores (bool + float64 no sorteio)
+            opcoes = elegivel[pendentes] & (vagas > 0)
+            tem_opcao = opcoes.any(axis=1)
+            pendentes, opcoes = pendentes[tem_opcao], opcoes[tem_opcao]
+            if not len(pendentes):
+                break
+
+            sorteio = np.where(opcoes, rng.random(opcoes.shape), -1.0)
+            pedido = sorteio.argmax(axis=1)
+
+            # posição de cada pedido na fila do vendedor, respeitando a ordem das linhas
+            ordem = np.argsort(pedido, kind='stable')
+            pedido_ordenado = pedido[ordem]
+            inicio_grupo = np.searchsorted(pedido_ordenado, pedido_ordenado, side='left')
+            posicao = np.empty_like(ordem)
+            posicao[ordem] = np.arange(len(ordem)) - inicio_grupo
+
+            aceito = posicao < vagas[pedido]
+            escolhidos[pendentes[aceito]] = pedido[aceito]
+            vagas -= np.bincount(pedido[aceito], minlength=n_vendedores)
+            pendentes = pendentes[~aceito]
+
+    return escolhidos
+
+
+def atribuir_otimo(elegivel, limite_por_vendedor, rng, ordem=None, cargas=None):
+    # Fluxo máximo com capacidades: origem -> conta (1) -> vendedor elegível -> destino (limite).
+    # Como há poucos vendedores, o caminho aumentante é buscado no grafo vendedor -> vendedor,
+    # onde s -> t existe se alguma conta hoje com s também é elegível para t.
+    # Processar as contas uma única vez em 'ordem' (algoritmo de Kuhn) já dá o máximo de contas
+    # colocadas; com a ordem por peso decrescente, o conjunto colocado também tem o maior peso total.
+    n_contas, n_vendedores = elegivel.shape
+    if ordem is None:
+        ordem = np.arange(n_contas)
+    if cargas is None:
+        cargas = np.ones(n_contas)
+
+    vagas = np.full(n_vendedores, limite_por_vendedor, dtype=np.int64)
+    carga_vendedor = np.zeros(n_vendedores)
+    escolhidos = np.full(n_contas, -1, dtype=np.int64)
+    # contas de cada vendedor e a posição de cada conta na lista dele: sair troca com a última, sem busca
+    membros = [[] for _ in range(n_vendedores)]
+    posicao = np.zeros(n_contas, dtype=np.int64)
+    transferiveis = np.zeros((n_vendedores, n_vendedores), dtype=np.int64)
+    total_vagas = vagas.sum()
+    colocadas = 0
+
+    def entrar(conta, vendedor):
+        escolhidos[conta] = vendedor
+        posicao[conta] = len(membros[vendedor])
+        membros[vendedor].append(conta)
+        transferiveis[vendedor] += elegivel[conta]
+        carga_vendedor[vendedor] += cargas[conta]
+
+    def sair(conta, vendedor):
+        lista = membros[vendedor]
+        ultima = lista.pop()
+        if ultima != conta:
+            lista[posicao[conta]] = ultima
+            posicao[ultima] = posicao[conta]
+        transferiveis[vendedor] -= elegivel[conta]
+        carga_vendedor[vendedor] -= cargas[conta]
+
+    for conta in ordem:
+        if colocadas == total_vagas:
+            break
+
+        opcoes = elegivel[conta]
+        livres = opcoes & (vagas > 0)
+        if livres.any():
+            candidatos = np.flatnonzero(livres)
+            menor = carga_vendedor[candidatos].min()
+            candidatos = candidatos[carga_vendedor[candidatos] == menor]
+            vendedor = candidatos[rng.integers(len(candidatos))]
+            entrar(conta, vendedor)
+            vagas[vendedor] -= 1
+            colocadas += 1
+            continue
+
+        # busca em largura por um vendedor com vaga alcançável a partir dos elegíveis
+        anterior = np.full(n_vendedores, -1, dtype=np.int64)
+        visitados = opcoes.copy()
+        fronteira = np.flatnonzero(opcoes)
+        destino = -1
+        while len(fronteira) and destino < 0:
+            alcance = transferiveis[fronteira] > 0
+            novos = alcance.any(axis=0) & ~visitados
+            if not novos.any():
+                break
+            novos_idx = np.flatnonzero(novos)
+            anterior[novos_idx] = fronteira[alcance[:, novos_idx].argmax(axis=0)]
+            visitados |= novos
+            com_vaga = novos_idx[vagas[novos_idx] > 0]
+            if len(com_vaga):
+                destino = com_vaga[0]
+            fronteira = novos_idx
+
+        if destino < 0:
+            continue
+
+        # desloca uma conta em cada elo do caminho, do fim para o começo
+        atual = destino
+        while anterior[atual] >= 0:
+            origem = anterior[atual]
+            lista = np.asarray(membros[origem])
+            movida = lista[elegivel[lista, atual].argmax()]
+            sair(movida, origem)
+            entrar(movida, atual)
+            atual = origem
+        entrar(conta, atual)
+        vagas[destino] -= 1
+        colocadas += 1
+
+    return escolhidos
+
+
+def preparar_atribuicao(df_contas, lista_vendedores, df_historico, prioridade=None, balancear=None):
+    # Entradas numéricas do motor: matriz de elegibilidade, ordem das contas e carga de cada conta
+    linhas_exc, vend_exc = montar_indice_exclusao(df_contas, lista_vendedores, df_historico)
+    elegivel = montar_elegibilidade(len(df_contas), len(lista_vendedores), linhas_exc, vend_exc)
+    faturamento = pd.to_numeric(df_contas['Faturamento_6_Meses'], errors='coerce').fillna(0).to_numpy(float) \
+        if 'Faturamento_6_Meses' in df_contas.columns else np.zeros(len(df_contas))
+    ordem = np.argsort(-faturamento, kind='stable') if prioridade == 'faturamento' else None
+    if balancear == 'faturamento':
+        cargas = faturamento
+    elif balancear == 'contas':
+        cargas = np.ones(len(df_contas))
+    else:
+        cargas = np.zeros(len(df_contas))
+    return elegivel, ordem, cargas
+
+
+def atribuir(elegivel, limite_por_vendedor, rng, modo='aleatorio', ordem=None, cargas=None):
+    # Mesmo sorteio para a rotação gravada e para a simulação: a mesma semente dá o mesmo resultado
+    if modo == 'otimo':
+        return atribuir_otimo(elegivel, limite_por_vendedor, rng, ordem=ordem, cargas=cargas)
+    if modo == 'aleatorio':
+        return atribuir_em_lotes(elegivel, limite_por_vendedor, rng)
+    raise ValueError(f"Modo de rotação desconhecido: {modo}")
+
+
+def rotacionar_contas_vetorizado(df_contas, lista_vendedores, df_historico, limite_por_vendedor=50, rng=None,
+                                 modo='aleatorio', prioridade=None, balancear=None):
+    # modo: 'aleatorio' (sorteio em lotes) ou 'otimo' (máximo de contas colocadas)
+    # prioridade: None (ordem das linhas) ou 'faturamento' (maior Faturamento_6_Meses primeiro)
+    # balancear: None (sorteio uniforme), 'contas' ou 'faturamento' (carga por vendedor)
+    if rng is None:
+        rng = np.random.default_rng()
+
+    lista_vendedores = list(dict.fromkeys(lista_vendedores))
+    data_hoje = pd.Timestamp.today().normalize()
+
+    if not lista_vendedores or df_contas.empty:
+        return df_contas.iloc[0:0].reset_index(drop=True), df_contas.reset_index(drop=True)
+
+    elegivel, ordem, cargas = preparar_atribuicao(df_contas, lista_vendedores, df_historico, prioridade, balancear)
+    escolhidos = atribuir(elegivel, limite_por_vendedor, rng, modo, ordem, cargas)
+    rotacionada = escolhidos >= 0
+
+    # A seleção booleana já cria frames novos: a base de entrada não é copiada nem alterada
+    df_rotacionadas = df_contas[rotacionada].assign(
+        Nome_Vendedor=pd.Categorical.from_codes(escolhidos[rotacionada], categories=lista_vendedores),
+        Data_Entrou_Carteira=data_hoje
+    )
+
+    df_sobras = df_contas[~rotacionada]
+    return df_rotacionadas.reset_index(drop=True), df_sobras.reset_index(drop=True)
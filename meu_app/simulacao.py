@@ -0,0 +1,156 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from rotacao import atribuir, preparar_atribuicao
+
+
+# Simulação (dry-run) da rotação: N sementes sorteadas sem gravar nada. Cada rodada recebe notas
+# e a melhor semente pode ser usada na rotação de verdade, que repete exatamente o mesmo sorteio.
+SIMULACOES_PADRAO = 200
+SEMENTES_POR_TAREFA = 25
+# O servidor do Streamlit tem várias threads: fork copiaria travas presas por elas. forkserver (ou spawn, onde
+# não existe) parte de um processo limpo; os vetores chegam pela memória compartilhada, não pela cópia do fork.
+METODO_PROCESSOS = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Ordem do ranking: mais contas colocadas, depois faturamento e classificações mais equilibrados
+CRITERIOS = ['colocadas', 'desequilibrio_faturamento', 'desequilibrio_classificacao']
+CRESCENTE = [False, True, True]
+
+_entradas = {}
+
+
+# ---------- NOTAS ----------
+def avaliar_atribuicao(escolhidos, faturamento, classe, n_vendedores, n_classes):
+    # Notas de uma rodada a partir do vetor de vendedores escolhidos (-1 = sobra)
+    colocada = escolhidos >= 0
+    vendedor = escolhidos[colocada]
+    colocadas = int(colocada.sum())
+
+    # Coeficiente de variação do faturamento recebido por vendedor (0 = todos iguais)
+    faturamento_vendedor = np.bincount(vendedor, weights=faturamento[colocada], minlength=n_vendedores)
+    media = faturamento_vendedor.mean()
+    desequilibrio_faturamento = float(faturamento_vendedor.std() / media) if media > 0 else 0.0
+
+    # Distância média (variação total) entre o mix de Classificacao_Conta de cada vendedor e o mix geral
+    contagem = np.bincount(vendedor * n_classes + classe[colocada], minlength=n_vendedores * n_classes)
+    contagem = contagem.reshape(n_vendedores, n_classes)
+    por_vendedor = contagem.sum(axis=1)
+    recebeu = por_vendedor > 0
+    if recebeu.any():
+        geral = contagem.sum(axis=0) / colocadas
+        mix = contagem[recebeu] / por_vendedor[recebeu, None]
+        desequilibrio_classificacao = float(np.abs(mix - geral).sum(axis=1).mean() / 2)
+    else:
+        desequilibrio_classificacao = 0.0
+
+    return {
+        'colocadas': colocadas,
+        'sobras': len(escolhidos) - colocadas,
+        'desequilibrio_faturamento': round(desequilibrio_faturamento, 4),
+        'desequilibrio_classificacao': round(desequilibrio_classificacao, 4),
+        'faturamento_min': round(float(faturamento_vendedor.min()), 2),
+        'faturamento_max': round(float(faturamento_vendedor.max()), 2),
+    }
+
+
+def simular_sementes(sementes, entradas, parametros):
+    notas = []
+    for semente in sementes:
+        escolhidos = atribuir(
+            entradas['elegivel'], parametros['limite_por_vendedor'], np.random.default_rng(semente),
+            parametros['modo'], entradas.get('ordem'), entradas.get('cargas')
+        )
+        notas.append({'semente': semente, **avaliar_atribuicao(
+            escolhidos, entradas['faturamento'], entradas['classe'], parametros['n_vendedores'], parametros['n_classes']
+        )})
+    return notas
+
+
+# ---------- MEMÓRIA COMPARTILHADA ----------
+def publicar_entradas(entradas):
+    # Copia cada vetor uma única vez para um bloco compartilhado; os processos só recebem o nome do bloco.
+    # A matriz 'elegivel' é a maior entrada (n_contas x n_vendedores bytes, ver montar_elegibilidade)
+    blocos, descricao = [], {}
+    for nome, valor in entradas.items():
+        if valor is None:
+            continue
+        bloco = shared_memory.SharedMemory(create=True, size=max(valor.nbytes, 1))
+        np.ndarray(valor.shape, dtype=valor.dtype, buffer=bloco.buf)[...] = valor
+        blocos.append(bloco)
+        descricao[nome] = (bloco.name, valor.shape, valor.dtype.str)
+    return blocos, descricao
+
+
+def anexar_entradas(descricao):
+    # Inicializador dos processos: visões somente leitura sobre os blocos, sem cópia
+    for nome, (bloco_nome, forma, tipo) in descricao.items():
+        bloco = shared_memory.SharedMemory(name=bloco_nome)
+        vetor = np.ndarray(forma, dtype=tipo, buffer=bloco.buf)
+        vetor.flags.writeable = False
+        _entradas[nome] = vetor
+        _entradas[f'_bloco_{nome}'] = bloco
+
+
+def simular_no_processo(sementes, parametros):
+    entradas = {nome: valor for nome, valor in _entradas.items() if not nome.startswith('_bloco_')}
+    return simular_sementes(sementes, entradas, parametros)
+
+
+def contexto_processos():
+    contexto = multiprocessing.get_context(METODO_PROCESSOS)
+    if METODO_PROCESSOS == 'forkserver':
+        # O forkserver (de uma thread só) importa este módulo, com numpy e pandas, uma vez; cada processo
+        # nasce dele já importado. Só vale se o forkserver ainda não estiver rodando.
+        contexto.set_forkserver_preload([__name__])
+    return contexto
+
+
+# ---------- SIMULAÇÃO ----------
+def simular_rotacoes(df_contas, lista_vendedores, df_historico, n_simulacoes=SIMULACOES_PADRAO, semente_inicial=0,
+                     limite_por_vendedor=50, modo='aleatorio', prioridade=None, balancear=None, n_processos=None):
+    # Devolve uma linha por semente, já ordenada pelo ranking (a primeira é a melhor).
+    # Nada é gravado; para aplicar, rotacionar com rng=np.random.default_rng(semente) e os mesmos parâmetros.
+    lista_vendedores = list(dict.fromkeys(lista_vendedores))
+    sementes = list(range(semente_inicial, semente_inicial + n_simulacoes))
+    if not lista_vendedores or df_contas.empty or not sementes:
+        return pd.DataFrame(columns=['semente', 'colocadas', 'sobras', 'desequilibrio_faturamento',
+                                     'desequilibrio_classificacao', 'faturamento_min', 'faturamento_max'])
+
+    elegivel, ordem, cargas = preparar_atribuicao(df_contas, lista_vendedores, df_historico, prioridade, balancear)
+    classe, classes = pd.factorize(df_contas['Classificacao_Conta'], use_na_sentinel=False)
+    entradas = {
+        'elegivel': elegivel,
+        'ordem': ordem,
+        'cargas': cargas if modo == 'otimo' else None,
+        'faturamento': pd.to_numeric(df_contas['Faturamento_6_Meses'], errors='coerce').fillna(0).to_numpy(float),
+        'classe': classe.astype(np.int64),
+    }
+    parametros = {
+        'modo': modo,
+        'limite_por_vendedor': limite_por_vendedor,
+        'n_vendedores': len(lista_vendedores),
+        'n_classes': len(classes),
+    }
+
+    n_processos = min(n_processos or os.cpu_count() or 1, -(-len(sementes) // SEMENTES_POR_TAREFA))
+    lotes = [sementes[i:i + SEMENTES_POR_TAREFA] for i in range(0, len(sementes), SEMENTES_POR_TAREFA)]
+    if n_processos > 1:
+        blocos, descricao = publicar_entradas(entradas)
+        try:
+            with ProcessPoolExecutor(max_workers=n_processos, mp_context=contexto_processos(),
+                                     initializer=anexar_entradas, initargs=(descricao,)) as executor:
+                notas = [nota for lote in executor.map(simular_no_processo, lotes, [parametros] * len(lotes)) for nota in lote]
+        finally:
+            for bloco in blocos:
+                bloco.close()
+                bloco.unlink()
+    else:
+        notas = simular_sementes(sementes, entradas, parametros)
+
+    ranking = pd.DataFrame(notas).sort_values(CRITERIOS + ['semente'], ascending=CRESCENTE + [True], kind='stable')
+    return ranking.reset_index(drop=True)
@@ -0,0 +1,332 @@
+import sqlite3
+from datetime import datetime
+
+import pandas as pd
+
+from leitura_erp import ler_em_lotes
+
+
+# Fontes cujos agregados são contagem + data mais recente por pessoa/conta.
+# nome -> (tabela no ERP, coluna de chave, coluna de data usada como marca d'água)
+FONTES_EVENTOS = {
+    'followups': ('pessoas_followup_anexos', 'pessoa_id', 'data_cadastro'),
+    'contatos': ('contatos', 'pessoa_id', 'data_cadastro'),
+    'oportunidades': ('crm_oportunidades', 'conta_id', 'data_cadastro'),
+    'orcamentos': ('rel_crm_orcamentos', 'pessoa_cliente_id', 'data_emissao'),
+}
+
+MESES_JANELA_FATURAMENTO = 6
+# Cada carga incremental relê os últimos DIAS_RELEITURA dias antes da marca d'água e substitui o que já tinha
+# lido deles: linhas atrasadas com a mesma data da marca, retroativas, editadas ou excluídas nessa janela entram
+# certas. O que muda antes da janela só volta com a carga completa (forcar_completa).
+DIAS_RELEITURA = 7
+FORMATO_DATA = '%Y-%m-%d %H:%M:%S.%f'
+VERSAO_ARMAZENAMENTO = 2
+
+# Mesmas colunas e ordem devolvidas pela consulta completa de carregar_dados_sql
+COLUNAS_SAIDA = [
+    'Conta_ID', 'tipo_conta', 'Razao_Social_Pessoas', 'CNPJ', 'Raiz_CNPJ',
+    'Grupo_Econômico_ID', 'Grupo_Econômico_Nome', 'Nome_Vendedor',
+    'Data_Ultima_Venda_Individual', 'Faturamento_6_Meses', 'Data_Abertura_Conta',
+    'Total_Pedidos', 'Data_Ultima_Venda_Grupo_CNPJ', 'Total_Followups',
+    'Data_Ultimo_Followup', 'Total_Contatos', 'Data_Ultimo_Contato',
+    'Total_Oportunidades', 'Data_Ultima_Oportunidade', 'Classificacao_Conta',
+    'Classificacao_Pessoa', 'Porte_Empresa', 'Total_Orcamentos', 'Data_Ultimo_Orcamento',
+]
+
+# crm_contas fica no banco grupofort, não no DB_NAME da conexão (onde estão pessoas e as tabelas de movimento).
+# Outro nome completo pode vir da chave DB_TABELA_CONTAS da configuração; a base SQLite local usa dbo.crm_contas.
+TABELA_CONTAS = 'grupofort.dbo.crm_contas'
+
+# Contas e dados cadastrais: leve, sem agregar as tabelas de movimento.
+# SUBSTRING(x, 1, 8) equivale a LEFT(x, 8) e também roda no SQLite usado nos testes locais.
+CONSULTA_BASE = """
+WITH UltimaVendaPorRaizCNPJ AS (
+    SELECT SUBSTRING(cpf_cnpj, 1, 8) AS Raiz_CNPJ, MAX(data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ
+    FROM dbo.pessoas
+    WHERE data_ultima_venda IS NOT NULL
+    GROUP BY SUBSTRING(cpf_cnpj, 1, 8)
+)
+SELECT
+    a.id AS Conta_ID,
+    a.cliente_id AS Cliente_ID,
+    a.tipo_conta,
+    b.razao_social AS Razao_Social_Pessoas,
+    b.cpf_cnpj AS CNPJ,
+    SUBSTRING(b.cpf_cnpj, 1, 8) AS Raiz_CNPJ,
+    c.grupo_id AS Grupo_Econômico_ID,
+    c.grupo_nome AS Grupo_Econômico_Nome,
+    v.razao_social AS Nome_Vendedor,
+    b.data_ultima_venda AS Data_Ultima_Venda_Individual,
+    a.data_cadastro AS Data_Abertura_Conta,
+    COALESCE(g.Data_Ultima_Venda_Grupo_CNPJ, b.data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ,
+    a.classificacao_id AS Classificacao_Conta,
+    b.classificacao_id AS Classificacao_Pessoa,
+    a.porte_id AS Porte_Empresa
+FROM
+    {tabela_contas} a
+    INNER JOIN dbo.pessoas b ON a.cliente_id = b.id
+    INNER JOIN dbo.rel_pessoas c ON b.id = c.id
+    INNER JOIN dbo.pessoas v ON a.vendedor_id = v.id
+    LEFT JOIN UltimaVendaPorRaizCNPJ g ON SUBSTRING(b.cpf_cnpj, 1, 8) = g.Raiz_CNPJ
+WHERE
+    a.tipo_conta = 2
+    AND a.excluido = 0
+    AND a.status_conta = 0
+    AND b.classificacao_id <> 1
+    AND a.classificacao_id <> 1
+"""
+
+
+# ---------- ARMAZENAMENTO LOCAL ----------
+def conectar_armazenamento(caminho):
+    conn = sqlite3.connect(caminho)
+    # Armazenamento de versão anterior (deltas somados sem janela de releitura) é refeito do zero
+    if conn.execute('PRAGMA user_version').fetchone()[0] < VERSAO_ARMAZENAMENTO:
+        conn.executescript('''
+            DROP TABLE IF EXISTS marcas_dagua;
+            DROP TABLE IF EXISTS agregados_eventos;
+            DROP TABLE IF EXISTS faturamento_janela;
+        ''')
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS marcas_dagua (
+            fonte TEXT PRIMARY KEY,
+            ultima_data TEXT,
+            inicio_releitura TEXT,
+            atualizado_em TEXT
+        );
+        -- Linhas anteriores à janela de releitura (e as sem data): não são mais lidas do ERP
+        CREATE TABLE IF NOT EXISTS agregados_eventos (
+            fonte TEXT NOT NULL,
+            chave INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            data_ultima TEXT,
+            PRIMARY KEY (fonte, chave)
+        );
+        -- Janela de releitura: substituída inteira a cada carga
+        CREATE TABLE IF NOT EXISTS eventos_recentes (
+            fonte TEXT NOT NULL,
+            chave INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (fonte, chave, data)
+        );
+        CREATE TABLE IF NOT EXISTS faturamento_janela (
+            pessoa_id INTEGER NOT NULL,
+            data_emissao TEXT NOT NULL,
+            valor REAL NOT NULL,
+            pedidos INTEGER NOT NULL,
+            PRIMARY KEY (pessoa_id, data_emissao)
+        );
+        PRAGMA user_version = {VERSAO_ARMAZENAMENTO};
+    ''')
+    return conn
+
+
+def formatar_data(valor):
+    # Texto ISO com milissegundos, só para o armazenamento local: ordena corretamente no SQLite
+    if valor is None or pd.isna(valor):
+        return None
+    return pd.Timestamp(valor).strftime(FORMATO_DATA)[:-3]
+
+
+def parametro_data(valor):
+    # Datas enviadas ao ERP vão como datetime: o pyodbc as passa tipadas, sem o SQL Server interpretar texto
+    # pelo DATEFORMAT/idioma do login (num login dmy, '2025-03-04' viraria 3 de abril)
+    if valor is None or pd.isna(valor):
+        return None
+    return pd.Timestamp(valor).to_pydatetime()
+
+
+def ler_marca_dagua(armazenamento, fonte):
+    # (última data lida, início da janela de releitura)
+    linha = armazenamento.execute(
+        'SELECT ultima_data, inicio_releitura FROM marcas_dagua WHERE fonte = ?', (fonte,)
+    ).fetchone()
+    return linha if linha else (None, None)
+
+
+def gravar_marca_dagua(armazenamento, fonte, ultima_data, inicio_releitura=None):
+    armazenamento.execute('''
+        INSERT INTO marcas_dagua (fonte, ultima_data, inicio_releitura, atualizado_em) VALUES (?, ?, ?, ?)
+        ON CONFLICT(fonte) DO UPDATE SET
+            ultima_data = COALESCE(excluded.ultima_data, marcas_dagua.ultima_data),
+            inicio_releitura = COALESCE(excluded.inicio_releitura, marcas_dagua.inicio_releitura),
+            atualizado_em = excluded.atualizado_em
+    ''', (fonte, ultima_data, inicio_releitura, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def calcular_inicio_releitura(marca, inicio_anterior=None):
+    # Marca d'água menos DIAS_RELEITURA, sem voltar para antes do que já foi consolidado
+    inicio = formatar_data(pd.Timestamp(marca) - pd.Timedelta(days=DIAS_RELEITURA))
+    return max(inicio, inicio_anterior) if inicio_anterior else inicio
+
+
+# ---------- SINCRONIZAÇÃO POR FONTE ----------
+def sincronizar_eventos(conn_erp, armazenamento, fonte, agora=None):
+    tabela, chave, coluna_data = FONTES_EVENTOS[fonte]
+    marca, inicio_anterior = ler_marca_dagua(armazenamento, fonte)
+    cursor = conn_erp.cursor()
+    lidas = 0
+
+    if marca is None:
+        # Primeira carga: o que é mais antigo que a janela (inclusive linhas sem data, como o COUNT(*) original)
+        # já entra agregado por chave nos consolidados
+        inicio = formatar_data(pd.Timestamp(agora or datetime.now()) - pd.Timedelta(days=DIAS_RELEITURA))
+        armazenamento.execute('DELETE FROM agregados_eventos WHERE fonte = ?', (fonte,))
+        cursor.execute(f"""
+            SELECT {chave} AS chave, COUNT(*) AS total, MAX({coluna_data}) AS data_ultima
+            FROM dbo.{tabela}
+            WHERE {coluna_data} < ? OR {coluna_data} IS NULL
+            GROUP BY {chave}
+        """, (parametro_data(inicio),))
+        consolidados = [(fonte, int(k), int(total), formatar_data(data)) for k, total, data in cursor.fetchall() if k is not None]
+        armazenamento.executemany(
+            'INSERT INTO agregados_eventos (fonte, chave, total, data_ultima) VALUES (?, ?, ?, ?)', consolidados
+        )
+        lidas += len(consolidados)
+    else:
+        # A janela avança: o que fica antes do novo início não será mais relido e passa para os consolidados
+        inicio = calcular_inicio_releitura(marca, inicio_anterior)
+        armazenamento.execute('''
+            INSERT INTO agregados_eventos (fonte, chave, total, data_ultima)
+            SELECT fonte, chave, SUM(total), MAX(data) FROM eventos_recentes
+            WHERE fonte = ? AND data < ?
+            GROUP BY fonte, chave
+            ON CONFLICT(fonte, chave) DO UPDATE SET
+                total = agregados_eventos.total + excluded.total,
+                data_ultima = CASE
+                    WHEN agregados_eventos.data_ultima IS NULL THEN excluded.data_ultima
+                    ELSE MAX(agregados_eventos.data_ultima, excluded.data_ultima)
+                END
+        ''', (fonte, inicio))
+
+    # A janela é relida inteira e substitui a anterior: repetir a carga não soma nada duas vezes
+    armazenamento.execute('DELETE FROM eventos_recentes WHERE fonte = ?', (fonte,))
+    cursor.execute(f"""
+        SELECT {chave} AS chave, {coluna_data} AS data, COUNT(*) AS total
+        FROM dbo.{tabela}
+        WHERE {coluna_data} >= ?
+        GROUP BY {chave}, {coluna_data}
+    """, (parametro_data(inicio),))
+    janela = [(fonte, int(k), formatar_data(data), int(total)) for k, data, total in cursor.fetchall() if k is not None]
+    # Datas que só diferem abaixo do milissegundo caem na mesma linha
+    armazenamento.executemany('''
+        INSERT INTO eventos_recentes (fonte, chave, data, total) VALUES (?, ?, ?, ?)
+        ON CONFLICT(fonte, chave, data) DO UPDATE SET total = eventos_recentes.total + excluded.total
+    ''', janela)
+
+    datas = [data for _, _, data, _ in janela]
+    gravar_marca_dagua(armazenamento, fonte, max(datas + [marca or inicio]), inicio)
+    return lidas + len(janela)
+
+
+def sincronizar_faturamento(conn_erp, armazenamento, agora=None):
+    agora = pd.Timestamp(agora or datetime.now())
+    corte = formatar_data(agora - pd.DateOffset(months=MESES_JANELA_FATURAMENTO))
+    marca, _ = ler_marca_dagua(armazenamento, 'faturamento')
+
+    # Primeira carga desde o corte (>=, como no DATEADD original); depois só a janela de releitura,
+    # apagada e lida de novo (as linhas já são por pessoa e data, não há consolidação)
+    inicio = corte if marca is None else max(corte, calcular_inicio_releitura(marca))
+    cursor = conn_erp.cursor()
+    cursor.execute("""
+        SELECT pessoa_id, data_emissao, SUM(valor_total) AS valor, COUNT(*) AS pedidos
+        FROM dbo.rel_faturamento
+        WHERE data_emissao >= ?
+        GROUP BY pessoa_id, data_emissao
+    """, (parametro_data(inicio),))
+    janela = [
+        (int(pessoa), formatar_data(data), float(valor or 0), int(pedidos))
+        for pessoa, data, valor, pedidos in cursor.fetchall() if pessoa is not None
+    ]
+
+    armazenamento.execute('DELETE FROM faturamento_janela WHERE data_emissao >= ?', (inicio,))
+    armazenamento.executemany('''
+        INSERT INTO faturamento_janela (pessoa_id, data_emissao, valor, pedidos) VALUES (?, ?, ?, ?)
+        ON CONFLICT(pessoa_id, data_emissao) DO UPDATE SET
+            valor = faturamento_janela.valor + excluded.valor,
+            pedidos = faturamento_janela.pedidos + excluded.pedidos
+    ''', janela)
+
+    # Expira o que saiu da janela de 6 meses
+    armazenamento.execute('DELETE FROM faturamento_janela WHERE data_emissao < ?', (corte,))
+
+    datas = [d for _, d, _, _ in janela]
+    gravar_marca_dagua(armazenamento, 'faturamento', max(datas + [marca or inicio]), inicio)
+    return len(janela)
+
+
+def sincronizar_fontes(conn_erp, armazenamento, agora=None, forcar_completa=False):
+    with armazenamento:
+        if forcar_completa:
+            armazenamento.executescript('''
+                DELETE FROM marcas_dagua;
+                DELETE FROM agregados_eventos;
+                DELETE FROM eventos_recentes;
+                DELETE FROM faturamento_janela;
+            ''')
+        linhas = {fonte: sincronizar_eventos(conn_erp, armazenamento, fonte, agora) for fonte in FONTES_EVENTOS}
+        linhas['faturamento'] = sincronizar_faturamento(conn_erp, armazenamento, agora)
+    return linhas
+
+
+# ---------- MONTAGEM DA BASE ----------
+def ler_agregados(armazenamento, agora=None):
+    agora = pd.Timestamp(agora or datetime.now())
+    corte = formatar_data(agora - pd.DateOffset(months=MESES_JANELA_FATURAMENTO))
+
+    eventos = pd.read_sql_query('''
+        SELECT fonte, chave, SUM(total) AS total, MAX(data_ultima) AS data_ultima FROM (
+            SELECT fonte, chave, total, data_ultima FROM agregados_eventos
+            UNION ALL
+            SELECT fonte, chave, total, data FROM eventos_recentes
+        )
+        GROUP BY fonte, chave
+    ''', armazenamento)
+    faturamento = pd.read_sql_query('''
+        SELECT pessoa_id AS Cliente_ID, SUM(valor) AS Faturamento_6_Meses, SUM(pedidos) AS Total_Pedidos
+        FROM faturamento_janela
+        WHERE data_emissao >= ?
+        GROUP BY pessoa_id
+    ''', armazenamento, params=(corte,))
+
+    por_fonte = {}
+    for fonte, bloco in eventos.groupby('fonte'):
+        por_fonte[fonte] = bloco.drop(columns='fonte').assign(data_ultima=pd.to_datetime(bloco['data_ultima']))
+    return por_fonte, faturamento
+
+
+def montar_base(df_base, agregados, faturamento):
+    nomes = {
+        'followups': ('Cliente_ID', 'Total_Followups', 'Data_Ultimo_Followup'),
+        'contatos': ('Cliente_ID', 'Total_Contatos', 'Data_Ultimo_Contato'),
+        'oportunidades': ('Conta_ID', 'Total_Oportunidades', 'Data_Ultima_Oportunidade'),
+        'orcamentos': ('Cliente_ID', 'Total_Orcamentos', 'Data_Ultimo_Orcamento'),
+    }
+
+    df = df_base.merge(faturamento, on='Cliente_ID', how='left')
+    for fonte, (chave, coluna_total, coluna_data) in nomes.items():
+        bloco = agregados.get(fonte, pd.DataFrame(columns=['chave', 'total', 'data_ultima']))
+        bloco = bloco.rename(columns={'chave': chave, 'total': coluna_total, 'data_ultima': coluna_data})
+        df = df.merge(bloco, on=chave, how='left')
+
+    for coluna in ['Faturamento_6_Meses', 'Total_Pedidos', 'Total_Followups', 'Total_Contatos',
+                   'Total_Oportunidades', 'Total_Orcamentos']:
+        df[coluna] = df[coluna].fillna(0)
+    for coluna in ['Total_Pedidos', 'Total_Followups', 'Total_Contatos', 'Total_Oportunidades', 'Total_Orcamentos']:
+        df[coluna] = df[coluna].astype('int64')
+
+    return df[COLUNAS_SAIDA]
+
+
+def carregar_dados_incremental(conn_erp, caminho_armazenamento='sincronizacao_erp.db', agora=None, forcar_completa=False,
+                               tabela_contas=TABELA_CONTAS):
+    armazenamento = conectar_armazenamento(caminho_armazenamento)
+    try:
+        sincronizar_fontes(conn_erp, armazenamento, agora=agora, forcar_completa=forcar_completa)
+        df_base = ler_em_lotes(conn_erp, CONSULTA_BASE.format(tabela_contas=tabela_contas))
+        agregados, faturamento = ler_agregados(armazenamento, agora=agora)
+    finally:
+        armazenamento.close()
+    return montar_base(df_base, agregados, faturamento)
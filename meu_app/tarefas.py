@@ -0,0 +1,332 @@
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+try:
+    import psutil
+    TEM_PSUTIL = True
+except ImportError:
+    TEM_PSUTIL = False
+
+from historico import CAMINHO_HISTORICO, conectar_historico, inserir_rotacoes, registrar_contas_rotacionadas
+from perfil import gravar_metricas, medir_etapa, novo_registro
+from pipeline import GRUPOS, registros_rotacao, rotacionar_grupos, separar_por_grupo
+from relatorios import arquivar_relatorios, exportar_zip_relatorios, iterar_relatorios
+
+
+# Tarefas em segundo plano (rotação e relatórios). O estado fica na tabela 'tarefas' de historico_rotacao.db,
+# então a página pode fechar ou recarregar: a tarefa continua no servidor e é reencontrada pelo id.
+PASTA_TAREFAS = 'tarefas'
+MAXIMO_TAREFAS_SIMULTANEAS = 2
+# Cada processo renova a batida das suas tarefas ativas; sem batida há BATIDA_EXPIRADA segundos o dono sumiu
+INTERVALO_BATIDA = 15
+BATIDA_EXPIRADA = 120
+# Tarefas terminadas há mais dias que isso saem da tabela, com a pasta tarefas/<id>/
+DIAS_RETENCAO_TAREFAS = 30
+
+NA_FILA = 'na fila'
+EXECUTANDO = 'executando'
+CONCLUIDA = 'concluída'
+FALHOU = 'falhou'
+INTERROMPIDA = 'interrompida'
+ESTADOS_ATIVOS = (NA_FILA, EXECUTANDO)
+
+_executor = None
+_trava = threading.Lock()
+_caminhos_batida = set()
+
+
+def agora():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def dono_processo():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# ---------- TABELA DE TAREFAS ----------
+def criar_tarefa(tipo, caminho=CAMINHO_HISTORICO, exclusiva=False):
+    # exclusiva: não cria (devolve None) se já houver tarefa do mesmo tipo na fila ou rodando. A checagem e
+    # o INSERT são um único comando, então duas sessões ou dois processos não passam ao mesmo tempo.
+    if exclusiva:
+        marcar_interrompidas(caminho)
+    with conectar_historico(caminho) as conn:
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO tarefas (tipo, estado, criada_em, dono, batida_em)
+                SELECT ?1, ?2, ?3, ?4, ?3
+                WHERE NOT ?5 OR NOT EXISTS (SELECT 1 FROM tarefas WHERE tipo = ?1 AND estado IN (?6, ?7))
+            ''', (tipo, NA_FILA, agora(), dono_processo(), exclusiva, *ESTADOS_ATIVOS))
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+def tarefa_ativa(tipo, caminho=CAMINHO_HISTORICO):
+    # Id da tarefa do tipo que está na fila ou rodando (em qualquer processo), ou None
+    with conectar_historico(caminho) as conn:
+        linha = conn.execute(
+            'SELECT id FROM tarefas WHERE tipo = ? AND estado IN (?, ?) ORDER BY id LIMIT 1', (tipo, *ESTADOS_ATIVOS)
+        ).fetchone()
+    return linha[0] if linha else None
+
+
+def informar_progresso(tarefa_id, progresso, total=None, mensagem=None, caminho=CAMINHO_HISTORICO):
+    # Transação curta e própria: a interface lê o progresso enquanto a tarefa roda
+    with conectar_historico(caminho) as conn:
+        with conn:
+            conn.execute('''
+                UPDATE tarefas SET progresso = ?, total = COALESCE(?, total), mensagem = COALESCE(?, mensagem)
+                WHERE id = ?
+            ''', (int(progresso), total, mensagem, tarefa_id))
+
+
+def concluir_tarefa(conn, tarefa_id, resultado):
+    # Sem commit: a tarefa de rotação chama dentro da mesma transação dos INSERTs do histórico.
+    # Devolve 0 se a tarefa já não estava rodando (dada como interrompida por outro processo).
+    return conn.execute('''
+        UPDATE tarefas SET estado = ?, resultado = ?, terminada_em = ?, progresso = COALESCE(total, progresso)
+        WHERE id = ? AND estado = ?
+    ''', (CONCLUIDA, json.dumps(resultado, ensure_ascii=False), agora(), tarefa_id, EXECUTANDO)).rowcount
+
+
+def ler_tarefa(linha):
+    tarefa = dict(zip(
+        ['id', 'tipo', 'estado', 'progresso', 'total', 'mensagem', 'resultado', 'erro',
+         'criada_em', 'iniciada_em', 'terminada_em', 'dono', 'batida_em'],
+        linha
+    ))
+    tarefa['resultado'] = json.loads(tarefa['resultado']) if tarefa['resultado'] else {}
+    return tarefa
+
+
+def obter_tarefa(tarefa_id, caminho=CAMINHO_HISTORICO):
+    with conectar_historico(caminho) as conn:
+        linha = conn.execute('SELECT * FROM tarefas WHERE id = ?', (tarefa_id,)).fetchone()
+    return ler_tarefa(linha) if linha else None
+
+
+def listar_tarefas(limite=20, caminho=CAMINHO_HISTORICO):
+    with conectar_historico(caminho) as conn:
+        return pd.read_sql_query('''
+            SELECT id, tipo, estado, progresso, total, mensagem, criada_em, terminada_em
+            FROM tarefas ORDER BY id DESC LIMIT ?
+        ''', conn, params=(limite,))
+
+
+def processo_vivo(dono):
+    # True/False quando dá para conferir o pid no próprio servidor; None (decide a batida) nos demais casos
+    servidor, _, pid = (dono or '').rpartition(':')
+    if servidor != socket.gethostname() or not pid.isdigit():
+        return None
+    if TEM_PSUTIL:
+        return psutil.pid_exists(int(pid))
+    if os.name != 'posix':
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def marcar_interrompidas(caminho=CAMINHO_HISTORICO):
+    # Tarefas ativas cujo processo dono morreu ou parou de bater não vão terminar (a transação do histórico
+    # não chegou ao commit, então nada delas ficou gravado). As de processos vivos continuam.
+    limite = (datetime.now() - timedelta(seconds=BATIDA_EXPIRADA)).isoformat(timespec='seconds')
+    with conectar_historico(caminho) as conn:
+        with conn:
+            ativas = conn.execute(
+                'SELECT id, dono, batida_em FROM tarefas WHERE estado IN (?, ?)', ESTADOS_ATIVOS
+            ).fetchall()
+            orfas = [
+                (INTERROMPIDA, agora(), tarefa_id) for tarefa_id, dono, batida_em in ativas
+                if batida_em is None or batida_em < limite or processo_vivo(dono) is False
+            ]
+            conn.executemany('''
+                UPDATE tarefas SET estado = ?, terminada_em = ?, erro = 'Processo do servidor encerrado durante a execução'
+                WHERE id = ?
+            ''', orfas)
+    return len(orfas)
+
+
+def limpar_tarefas(dias=DIAS_RETENCAO_TAREFAS, caminho=CAMINHO_HISTORICO):
+    # Remove as tarefas terminadas há mais de 'dias' e as saídas delas em tarefas/<id>/ (parquets e ZIP).
+    # As rotações gravadas no histórico mantêm o tarefa_id de origem.
+    limite = (datetime.now() - timedelta(days=dias)).isoformat(timespec='seconds')
+    with conectar_historico(caminho) as conn:
+        with conn:
+            antigas = conn.execute(
+                'SELECT id FROM tarefas WHERE estado NOT IN (?, ?) AND terminada_em < ?', (*ESTADOS_ATIVOS, limite)
+            ).fetchall()
+            conn.executemany('DELETE FROM tarefas WHERE id = ?', antigas)
+    for (tarefa_id,) in antigas:
+        shutil.rmtree(os.path.join(PASTA_TAREFAS, str(tarefa_id)), ignore_errors=True)
+    return len(antigas)
+
+
+# ---------- EXECUÇÃO ----------
+def bater():
+    # Thread única por processo: renova batida_em das tarefas ativas deste processo em cada banco usado
+    while True:
+        time.sleep(INTERVALO_BATIDA)
+        for caminho in list(_caminhos_batida):
+            try:
+                with conectar_historico(caminho) as conn:
+                    with conn:
+                        conn.execute(
+                            'UPDATE tarefas SET batida_em = ? WHERE dono = ? AND estado IN (?, ?)',
+                            (agora(), dono_processo(), *ESTADOS_ATIVOS)
+                        )
+            except sqlite3.Error:
+                # banco ocupado: a próxima batida chega bem antes de BATIDA_EXPIRADA
+                pass
+
+
+def iniciar_batidas(caminho):
+    with _trava:
+        if not _caminhos_batida:
+            threading.Thread(target=bater, daemon=True, name='tarefa-batida').start()
+        _caminhos_batida.add(caminho)
+
+
+def executor():
+    global _executor
+    with _trava:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAXIMO_TAREFAS_SIMULTANEAS, thread_name_prefix='tarefa')
+        return _executor
+
+
+def executar_tarefa(tarefa_id, funcao, argumentos, caminho):
+    with conectar_historico(caminho) as conn:
+        with conn:
+            conn.execute('UPDATE tarefas SET estado = ?, iniciada_em = ? WHERE id = ?', (EXECUTANDO, agora(), tarefa_id))
+    try:
+        resultado = funcao(tarefa_id, *argumentos, caminho=caminho)
+    except Exception:
+        with conectar_historico(caminho) as conn:
+            with conn:
+                conn.execute(
+                    'UPDATE tarefas SET estado = ?, erro = ?, terminada_em = ? WHERE id = ?',
+                    (FALHOU, traceback.format_exc(limit=5), agora(), tarefa_id)
+                )
+        return
+    with conectar_historico(caminho) as conn:
+        with conn:
+            concluir_tarefa(conn, tarefa_id, resultado)
+
+
+def enviar_tarefa(tipo, funcao, *argumentos, caminho=CAMINHO_HISTORICO, exclusiva=False):
+    # funcao(tarefa_id, *argumentos, caminho=...) roda numa thread do servidor e devolve o resultado (JSON).
+    # exclusiva: devolve None sem enviar nada se já houver tarefa do mesmo tipo ativa
+    tarefa_id = criar_tarefa(tipo, caminho, exclusiva)
+    if tarefa_id is None:
+        return None
+    iniciar_batidas(caminho)
+    executor().submit(executar_tarefa, tarefa_id, funcao, argumentos, caminho)
+    return tarefa_id
+
+
+def pasta_da_tarefa(tarefa_id):
+    pasta = os.path.join(PASTA_TAREFAS, str(tarefa_id))
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+# ---------- TAREFAS ----------
+def tarefa_rotacao(tarefa_id, contas_por_grupo, vendedores_por_grupo, df_historico, parametros, sementes=None,
+                   caminho=CAMINHO_HISTORICO):
+    # contas_por_grupo: {grupo: contas elegíveis}; os grupos são sorteados ao mesmo tempo (rotacionar_grupos)
+    sementes = sementes or {}
+    registro = novo_registro(f'tarefa {tarefa_id}')
+    elegiveis = sum(len(contas) for contas in contas_por_grupo.values())
+    informar_progresso(tarefa_id, 0, elegiveis, 'Sorteando vendedores', caminho)
+    with medir_etapa(registro, 'rotação', elegiveis) as medida:
+        saidas = rotacionar_grupos(
+            contas_por_grupo, vendedores_por_grupo, df_historico,
+            rngs={grupo: np.random.default_rng(sementes.get(grupo)) for grupo in contas_por_grupo}, **parametros
+        )
+        df_rotacionadas = pd.concat([rotacionadas for rotacionadas, _ in saidas.values()], ignore_index=True)
+        df_sobras = pd.concat([sobras for _, sobras in saidas.values()], ignore_index=True)
+        medida['linhas_saida'] = len(df_rotacionadas)
+    informar_progresso(
+        tarefa_id, len(df_rotacionadas),
+        mensagem=', '.join(f'{grupo}: {len(rotacionadas)} contas atribuídas' for grupo, (rotacionadas, _) in saidas.items())
+        + '; gravando o histórico',
+        caminho=caminho
+    )
+
+    pasta = pasta_da_tarefa(tarefa_id)
+    resultado = {
+        'rotacionadas': os.path.join(pasta, 'rotacionadas.parquet'),
+        'sobras': os.path.join(pasta, 'sobras.parquet'),
+        'elegiveis': elegiveis,
+        'quantidade_rotacionadas': len(df_rotacionadas),
+        'por_grupo': {grupo: len(rotacionadas) for grupo, (rotacionadas, _) in saidas.items()},
+    }
+    df_rotacionadas.to_parquet(resultado['rotacionadas'], index=False)
+    df_sobras.to_parquet(resultado['sobras'], index=False)
+
+    # Histórico + estado 'concluída' num único commit: se algo falhar (ou o processo cair) no meio,
+    # nenhuma linha desta tarefa fica em historico_rotacao/donos_cnpj
+    arquivo_historico = None
+    try:
+        with medir_etapa(registro, 'registro do histórico', len(df_rotacionadas)):
+            arquivo_historico = registrar_contas_rotacionadas(df_rotacionadas)
+            with conectar_historico(caminho) as conn:
+                with conn:
+                    inserir_rotacoes(conn, registros_rotacao(df_rotacionadas), tarefa_id)
+                    # Dada como interrompida enquanto sorteava: desfaz os INSERTs (outra rotação pode ter começado)
+                    if not concluir_tarefa(conn, tarefa_id, resultado):
+                        raise RuntimeError(f'Tarefa {tarefa_id} foi dada como interrompida; o histórico não foi gravado')
+    except BaseException:
+        if arquivo_historico:
+            os.remove(arquivo_historico)
+        shutil.rmtree(pasta, ignore_errors=True)
+        raise
+    gravar_metricas(registro)
+    return resultado
+
+
+def tarefa_relatorios(tarefa_id, df_atual, df_anterior, data_limite, data_rotacao, n_processos=None,
+                      pasta_servidor=None, vendedores_por_grupo=None, motor='pandas', caminho=CAMINHO_HISTORICO):
+    # pasta_servidor: cópia de todos os relatórios; vendedores_por_grupo: cópia de cada grupo na pasta dele
+    total = int(df_atual['Nome_Vendedor'].dropna().nunique())
+    informar_progresso(tarefa_id, 0, total, 'Montando relatórios', caminho)
+
+    def com_progresso(resultados):
+        for feitos, resultado in enumerate(resultados, start=1):
+            informar_progresso(tarefa_id, feitos, mensagem=f'{feitos} de {total} vendedores', caminho=caminho)
+            yield resultado
+
+    # Planilhas iguais às já salvas nas pastas do servidor (manifesto) são reaproveitadas, não geradas
+    pastas_reuso = [GRUPOS[grupo]['pasta'] for grupo in vendedores_por_grupo or {}]
+    if pasta_servidor:
+        pastas_reuso.append(pasta_servidor)
+    registro = novo_registro(f'tarefa {tarefa_id}')
+    with medir_etapa(registro, 'gerar_relatorios + ZIP', len(df_atual) + len(df_anterior)) as medida:
+        arquivo_zip, gerados = exportar_zip_relatorios(com_progresso(
+            iterar_relatorios(df_atual, df_anterior, data_limite, data_rotacao, n_processos, pastas_reuso, motor)
+        ))
+        medida['linhas_saida'] = sum(len(df_relatorio) for _, df_relatorio, _, _ in gerados)
+    resultado = {'zip': os.path.join(pasta_da_tarefa(tarefa_id), 'relatorios_rotacao.zip'), 'vendedores': len(gerados)}
+    with arquivo_zip, open(resultado['zip'], 'wb') as destino:
+        shutil.copyfileobj(arquivo_zip, destino)
+    if pasta_servidor:
+        arquivar_relatorios(gerados, pasta_servidor)
+    for grupo, resultados_grupo in separar_por_grupo(gerados, vendedores_por_grupo or {}).items():
+        if resultados_grupo:
+            arquivar_relatorios(resultados_grupo, GRUPOS[grupo]['pasta'])
+    gravar_metricas(registro)
+    return resultado
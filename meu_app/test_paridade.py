@@ -0,0 +1,387 @@
+import os
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from cache_snapshot import (carregar_snapshot, garantir_snapshot, invalidar_snapshot, salvar_snapshot, tipar_snapshot,
+                            valores_distintos_snapshot)
+from dados_sinteticos import (CONTAS_SQLITE, alterar_eventos_na_janela, conectar_erp_sqlite, datas_modificacao,
+                              derivar_colunas_legado, gerar_base_derivacao, gerar_base_erp, gerar_base_relatorio,
+                              gerar_cenario_rotacao, gerar_erp_sqlite, gerar_fixtures, gerar_referencia, gerar_rotacoes_mes,
+                              inserir_eventos_novos, na_pasta, rotacionar_grupo_a_grupo, simular_rotacoes_ingenuo,
+                              ultimas_rotacoes_sinteticas)
+from esquema import RAIZ_INVALIDA, compactar_contas, formatar_para_exportacao, raiz_para_chave
+from conexoes import conexao_sqlite
+from excel_io import ler_referencia, planilha_em_bytes
+from extracao import carregar_base_completa, carregar_candidatos, corte_faturamento, montar_consulta_completa
+from historico import conectar_historico, criar_tabela_historico, pagina_historico, recalcular_resumos, registrar_rotacoes
+from leitura_erp import ler_em_lotes
+from metricas import calcular_status_cliente, derivar_colunas
+from motor_duckdb import derivar_base_duckdb, montar_relatorios_duckdb
+from pipeline import GRUPOS, calcular_data_limite, carregar_vendedores_grupo, derivar_base, executar_rotacao_mensal
+from relatorios import (NOME_CONSOLIDADO, gerar_relatorios, iterar_relatorios, montar_relatorio_vendedor,
+                        planilha_consolidada, separar_por_vendedor)
+from rotacao import atribuir_otimo, rotacionar_contas_vetorizado
+from simulacao import simular_rotacoes
+from sincronizacao import carregar_dados_incremental
+
+
+# Verificações de equivalência (mesmo resultado por caminhos diferentes), rodadas pelo pytest com bases
+# pequenas. Os geradores e as implementações de referência vêm de dados_sinteticos.py; os tempos ficam em benchmarks.py.
+
+
+# ---------- MÉTRICAS ----------
+def test_metricas_vetorizadas_iguais_ao_apply():
+    df, referencia = gerar_base_derivacao(20000)
+    data_limite = datetime.today() - timedelta(days=6*30)
+    df_legado = derivar_colunas_legado(df, referencia, data_limite)
+    df_vetorizado = derivar_colunas(df, referencia, data_limite)
+    # Nome_Vendedor agora sai como categoria; os valores devem ser os mesmos do legado
+    pd.testing.assert_frame_equal(df_vetorizado.astype({'Nome_Vendedor': df_legado['Nome_Vendedor'].dtype}), df_legado)
+
+
+# ---------- ERP ----------
+@pytest.fixture
+def erp(tmp_path):
+    agora = pd.Timestamp.today().normalize()
+    caminho = str(tmp_path / 'erp.db')
+    gerar_erp_sqlite(caminho, n_contas=3000, eventos_por_conta=10, agora=agora)
+    conn = conectar_erp_sqlite(caminho)
+    yield conn, caminho, agora
+    conn.close()
+
+
+def ordenar_base(df):
+    # Coluna toda nula chega como None (object) de um lado e NaN (str) do outro: compara só os valores
+    df = tipar_snapshot(df).sort_values('Conta_ID').reset_index(drop=True).astype(object)
+    return df.where(df.notna(), None)
+
+
+def test_sincronizacao_incremental_igual_a_carga_completa(erp, tmp_path):
+    # Linhas novas, atrasadas, retroativas, editadas e excluídas dentro da janela relida
+    conn, caminho_erp, agora = erp
+    caminho_local = str(tmp_path / 'sincronizacao_erp.db')
+    carregar_dados_incremental(conn, caminho_local, agora=agora, forcar_completa=True, tabela_contas=CONTAS_SQLITE)
+    inserir_eventos_novos(caminho_erp, agora=agora)
+    carregar_dados_incremental(conn, caminho_local, agora=agora, tabela_contas=CONTAS_SQLITE)
+    alterar_eventos_na_janela(caminho_erp, agora=agora)
+
+    amanha = agora + pd.Timedelta(days=1)
+    df_incremental = carregar_dados_incremental(conn, caminho_local, agora=amanha, tabela_contas=CONTAS_SQLITE)
+    df_completo = carregar_dados_incremental(conn, caminho_local, agora=amanha, forcar_completa=True,
+                                             tabela_contas=CONTAS_SQLITE)
+    pd.testing.assert_frame_equal(
+        df_incremental.sort_values('Conta_ID').reset_index(drop=True),
+        df_completo.sort_values('Conta_ID').reset_index(drop=True)
+    )
+    df_direto = carregar_base_completa(conn, agora=amanha, tabela_contas=CONTAS_SQLITE)
+    pd.testing.assert_frame_equal(ordenar_base(df_incremental), ordenar_base(df_direto))
+
+
+def test_candidatos_no_servidor_iguais_ao_filtro_no_pandas(erp):
+    conn, _, agora = erp
+    data_limite = agora - timedelta(days=6*30)
+    df = tipar_snapshot(carregar_base_completa(conn, agora=agora, tabela_contas=CONTAS_SQLITE))
+    df = df.sort_values('Conta_ID').drop_duplicates(subset='Raiz_CNPJ')
+    grupo = df['Grupo_Econômico_ID']
+    esperado = df[
+        (calcular_status_cliente(df['Data_Ultima_Venda_Grupo_CNPJ'], data_limite) == 'Nao Compra') &
+        (df['Data_Abertura_Conta'] < data_limite) &
+        (grupo.isnull() | (grupo == ''))
+    ]
+    candidatos = carregar_candidatos(conn, data_limite, agora=agora, tabela_contas=CONTAS_SQLITE)
+    pd.testing.assert_frame_equal(ordenar_base(esperado), ordenar_base(candidatos))
+
+
+def test_leitura_em_lotes_igual_a_read_sql(erp):
+    conn, _, agora = erp
+    parametros = (corte_faturamento(agora),)
+    esperado = tipar_snapshot(pd.read_sql(montar_consulta_completa(CONTAS_SQLITE), conn, params=parametros))
+    # Lotes pequenos: várias rodadas de fetchmany e categorias montadas depois de juntar os lotes
+    pd.testing.assert_frame_equal(esperado, ler_em_lotes(conn, montar_consulta_completa(CONTAS_SQLITE), parametros, tamanho_lote=700))
+
+
+# ---------- ESQUEMA E SNAPSHOT ----------
+def test_exportacao_devolve_a_raiz_original():
+    df, _ = gerar_base_derivacao(20000)
+    df['Nome_Vendedor'] = df['Nome_Vendedor'].astype(object)
+    pd.testing.assert_series_equal(
+        formatar_para_exportacao(compactar_contas(df))['Raiz_CNPJ'].astype(object), df['Raiz_CNPJ'].astype(object)
+    )
+
+
+def test_raiz_para_chave_igual_para_o_mesmo_cnpj_em_qualquer_formato():
+    chaves = raiz_para_chave(pd.Series(['00000012345678', ' 12345678 ', 'ABC', '0ABC', 'XYZ', '', None], dtype=object))
+    assert chaves[0] == chaves[1] == raiz_para_chave(pd.Series([12345678.0]))[0] == 12345678
+    # Malformadas: chave negativa própria, igual em qualquer chamada e diferente da raiz vazia
+    assert chaves[2] == chaves[3] == raiz_para_chave(pd.Series(['ABC']))[0]
+    assert len({chaves[2], chaves[4], RAIZ_INVALIDA}) == 3 and chaves[2] < 0 and chaves[4] < 0
+    assert chaves[5] == chaves[6] == RAIZ_INVALIDA
+
+
+def test_nomes_do_snapshot_iguais_aos_da_base_inteira(tmp_path):
+    df = gerar_base_erp(20000)
+    salvar_snapshot(df, str(tmp_path))
+    esperado = sorted(carregar_snapshot(str(tmp_path))['Nome_Vendedor'].dropna().unique().tolist())
+    assert valores_distintos_snapshot(str(tmp_path), 'Nome_Vendedor') == esperado
+
+
+def test_snapshot_invalidado_e_recarregado_dentro_do_ttl(tmp_path):
+    pasta = str(tmp_path)
+    df = gerar_base_erp(1000)
+    versao = garantir_snapshot(lambda: df, pasta)['versao']
+    assert garantir_snapshot(lambda: pytest.fail('snapshot válido recarregado'), pasta)['versao'] == versao
+
+    invalidar_snapshot(pasta)
+    chamadas = []
+    manifesto = garantir_snapshot(lambda: chamadas.append(1) or df.head(10), pasta)
+    assert chamadas == [1] and manifesto['linhas'] == 10 and not manifesto.get('invalidado')
+
+
+# ---------- ATRIBUIÇÃO ÓTIMA ----------
+def emparelhamento_maximo(elegivel, limite, contas):
+    # Referência independente: cada vendedor vira 'limite' vagas e cada conta busca um caminho aumentante (Kuhn)
+    vagas = [vendedor for vendedor in range(elegivel.shape[1]) for _ in range(limite)]
+    dono_da_vaga = [-1] * len(vagas)
+
+    def encaixar(conta, vistas):
+        for vaga, vendedor in enumerate(vagas):
+            if elegivel[conta, vendedor] and vaga not in vistas:
+                vistas.add(vaga)
+                if dono_da_vaga[vaga] < 0 or encaixar(dono_da_vaga[vaga], vistas):
+                    dono_da_vaga[vaga] = conta
+                    return True
+        return False
+
+    return sum(encaixar(conta, set()) for conta in contas)
+
+
+def cenarios_atribuicao(n_cenarios=30, semente=0):
+    rng = np.random.default_rng(semente)
+    for _ in range(n_cenarios):
+        n_contas, n_vendedores = int(rng.integers(5, 40)), int(rng.integers(2, 6))
+        elegivel = rng.random((n_contas, n_vendedores)) < rng.uniform(0.1, 0.6)
+        yield elegivel, int(rng.integers(1, 6)), rng.integers(0, 1000, n_contas).astype(float)
+
+
+def test_atribuicao_otima_coloca_o_maximo_de_contas():
+    for elegivel, limite, _ in cenarios_atribuicao():
+        escolhidos = atribuir_otimo(elegivel, limite, np.random.default_rng(0))
+        colocadas = np.flatnonzero(escolhidos >= 0)
+        assert elegivel[colocadas, escolhidos[colocadas]].all()
+        assert np.bincount(escolhidos[colocadas], minlength=elegivel.shape[1]).max(initial=0) <= limite
+        assert len(colocadas) == emparelhamento_maximo(elegivel, limite, range(len(elegivel)))
+
+
+def test_atribuicao_otima_por_faturamento_tem_o_maior_peso():
+    # Referência: guloso por peso decrescente, aceitando a conta se o conjunto ainda cabe (matroide transversal)
+    for elegivel, limite, pesos in cenarios_atribuicao():
+        ordem = np.argsort(-pesos, kind='stable')
+        aceitas = []
+        for conta in ordem:
+            if emparelhamento_maximo(elegivel, limite, aceitas + [conta]) == len(aceitas) + 1:
+                aceitas.append(conta)
+        escolhidos = atribuir_otimo(elegivel, limite, np.random.default_rng(0), ordem=ordem)
+        assert pesos[escolhidos >= 0].sum() == pesos[aceitas].sum()
+
+
+def test_rotacao_otima_nao_coloca_menos_que_a_aleatoria():
+    df_contas, vendedores, df_historico = gerar_cenario_rotacao(3000, 20)
+    colocadas = {
+        modo: len(rotacionar_contas_vetorizado(df_contas, vendedores, df_historico, 120,
+                                               rng=np.random.default_rng(0), modo=modo)[0])
+        for modo in ['aleatorio', 'otimo']
+    }
+    assert colocadas['otimo'] >= colocadas['aleatorio']
+
+
+# ---------- SIMULAÇÃO ----------
+def test_simulacao_igual_com_e_sem_processos():
+    df_contas, vendedores, df_historico = gerar_cenario_rotacao(3000, 20)
+    df_contas = df_contas.assign(Classificacao_Conta=np.random.default_rng(0).choice([2, 3, 4, 6, 8], len(df_contas)))
+    sequencial = simular_rotacoes(df_contas, vendedores, df_historico, 20, limite_por_vendedor=50, n_processos=1)
+    paralelo = simular_rotacoes(df_contas, vendedores, df_historico, 20, limite_por_vendedor=50, n_processos=2)
+    pd.testing.assert_frame_equal(sequencial, paralelo)
+
+    # Mesmas notas de uma rotação completa por semente; a melhor semente repete a rodada simulada
+    ingenuo = simular_rotacoes_ingenuo(df_contas, vendedores, df_historico, range(20), 50)
+    por_semente = sequencial.set_index('semente')['colocadas'].sort_index()
+    assert (por_semente.to_numpy() == ingenuo['colocadas'].to_numpy()).all()
+    melhor = sequencial.iloc[0]
+    df_rotacionadas, _ = rotacionar_contas_vetorizado(
+        df_contas, vendedores, df_historico, 50, rng=np.random.default_rng(int(melhor['semente']))
+    )
+    assert len(df_rotacionadas) == melhor['colocadas']
+
+
+# ---------- RELATÓRIOS ----------
+def relatorios_gerados(n_linhas=3000, n_vendedores=6, n_processos=1):
+    df_atual, df_anterior, data_limite, hoje = gerar_base_relatorio(n_linhas, n_vendedores)
+    return [resultado for resultado in iterar_relatorios(df_atual, df_anterior, data_limite, hoje, n_processos=n_processos)
+            if resultado[2] is not None]
+
+
+def celulas(planilha):
+    # Valor, formato numérico e negrito de cada célula, aba por aba, mais a aba selecionada
+    livro = load_workbook(BytesIO(planilha) if isinstance(planilha, bytes) else planilha)
+    return [
+        (aba.title, aba.sheet_view.tabSelected,
+         [[(celula.value, celula.number_format, celula.font.b) for celula in linha] for linha in aba.iter_rows()])
+        for aba in livro.worksheets
+    ]
+
+
+def gravada_pelo_xlsxwriter(resultados):
+    return planilha_em_bytes([(vendedor[:31], df_relatorio) for vendedor, df_relatorio, _, _ in resultados])
+
+
+def test_relatorios_iguais_com_e_sem_processos():
+    sequenciais, paralelos = relatorios_gerados(n_processos=1), relatorios_gerados(n_processos=2)
+    assert [(vendedor, nome) for vendedor, _, nome, _ in sequenciais] == [(vendedor, nome) for vendedor, _, nome, _ in paralelos]
+    for (_, esperado, _, planilha_esperada), (_, obtido, _, planilha_obtida) in zip(sequenciais, paralelos):
+        pd.testing.assert_frame_equal(esperado, obtido)
+        assert celulas(planilha_esperada) == celulas(planilha_obtida)
+
+
+def test_planilha_consolidada_igual_a_gravada_pelo_xlsxwriter():
+    resultados = relatorios_gerados()
+    assert len(resultados) > 1
+    assert celulas(planilha_consolidada(resultados)) == celulas(gravada_pelo_xlsxwriter(resultados))
+
+
+def test_planilha_consolidada_com_estilos_diferentes_grava_de_novo():
+    resultados = relatorios_gerados()
+    vendedor, df_relatorio, nome_arquivo, _ = resultados[-1]
+    outra = BytesIO()
+    df_relatorio.to_excel(outra, index=False, engine='openpyxl')
+    resultados[-1] = (vendedor, df_relatorio, nome_arquivo, outra.getvalue())
+    assert celulas(planilha_consolidada(resultados)) == celulas(gravada_pelo_xlsxwriter(resultados))
+
+
+def planilhas_da_pasta(pasta):
+    return {nome: celulas(os.path.join(pasta, nome)) for nome in sorted(os.listdir(pasta)) if nome.endswith('.xlsx')}
+
+
+def test_relatorios_incrementais_iguais_a_geracao_do_zero(tmp_path):
+    df_atual, df_anterior, data_limite, hoje = gerar_base_relatorio(6000, 8)
+    corrigido = sorted(df_atual['Nome_Vendedor'].unique())[0]
+    df_atual_corrigido, df_anterior_corrigido = [
+        df.assign(Total_Pedidos=df['Total_Pedidos'] + (df['Nome_Vendedor'] == corrigido)) for df in [df_atual, df_anterior]
+    ]
+    pasta, pasta_do_zero = str(tmp_path / 'incremental'), str(tmp_path / 'do_zero')
+
+    gerar_relatorios(df_atual, df_anterior, data_limite, hoje, pasta, n_processos=1)
+    antes = datas_modificacao(pasta)
+    gerar_relatorios(df_atual, df_anterior, data_limite, hoje, pasta, n_processos=1)
+    assert datas_modificacao(pasta) == antes
+
+    gerar_relatorios(df_atual_corrigido, df_anterior_corrigido, data_limite, hoje, pasta, n_processos=1)
+    regravadas = {nome for nome, data in datas_modificacao(pasta).items() if antes.get(nome) != data}
+    assert regravadas == {f"relatorio_{corrigido.replace(' ', '_')}_{hoje.strftime('%Y-%m-%d')}.xlsx", NOME_CONSOLIDADO}
+
+    gerar_relatorios(df_atual_corrigido, df_anterior_corrigido, data_limite, hoje, pasta_do_zero, n_processos=1)
+    assert planilhas_da_pasta(pasta) == planilhas_da_pasta(pasta_do_zero)
+
+    # Vendedor que saiu da carteira: a planilha dele some da pasta
+    sem_corrigido = [df[df['Nome_Vendedor'] != corrigido] for df in [df_atual_corrigido, df_anterior_corrigido]]
+    gerar_relatorios(*sem_corrigido, data_limite, hoje, pasta, n_processos=1)
+    gerar_relatorios(*sem_corrigido, data_limite, hoje, str(tmp_path / 'sem_corrigido'), n_processos=1)
+    assert planilhas_da_pasta(pasta) == planilhas_da_pasta(str(tmp_path / 'sem_corrigido'))
+
+
+# ---------- MOTOR DUCKDB ----------
+def test_motor_duckdb_igual_ao_pandas():
+    df_erp = gerar_base_erp(20000)
+    referencia = gerar_referencia(df_erp)
+    df_rotacao = ultimas_rotacoes_sinteticas(df_erp)
+    vendedores = sorted(df_erp['Nome_Vendedor'].dropna().unique())[0::2]
+    data_limite = calcular_data_limite()
+    for esperado, obtido in zip(derivar_base(df_erp, referencia, df_rotacao, vendedores, data_limite),
+                                derivar_base_duckdb(df_erp, referencia, df_rotacao, vendedores, data_limite), strict=True):
+        pd.testing.assert_frame_equal(esperado, obtido)
+
+    df_atual, df_anterior, data_limite, hoje = gerar_base_relatorio(6000, 8)
+    df_atual, df_anterior = [df.assign(Data_Entrou_Carteira=pd.to_datetime(df['Data_Entrou_Carteira'])) for df in [df_atual, df_anterior]]
+    data_limite = pd.to_datetime(data_limite).normalize()
+    esperados = [
+        montar_relatorio_vendedor(atual_vend, anterior_vend, data_limite, hoje)
+        for _, atual_vend, anterior_vend in separar_por_vendedor(df_atual, df_anterior)
+    ]
+    obtidos = [df_relatorio for _, df_relatorio in montar_relatorios_duckdb(df_atual, df_anterior, data_limite, hoje)]
+    for esperado, obtido in zip(esperados, obtidos, strict=True):
+        pd.testing.assert_frame_equal(esperado, obtido)
+
+
+# ---------- DOIS GRUPOS ----------
+def test_dois_grupos_numa_passada_iguais_a_um_grupo_por_vez(tmp_path):
+    with na_pasta(str(tmp_path)):
+        caminhos = gerar_fixtures('.', 5000)
+        df_erp = pd.read_parquet(caminhos['base'])
+        referencia = ler_referencia(caminhos['referencia'])
+        vendedores_por_grupo = {grupo: carregar_vendedores_grupo(grupo) for grupo in GRUPOS}
+        data_limite = calcular_data_limite()
+
+        # Os sorteios diferem (um gerador por grupo na passada única): compara as planilhas de cada pasta
+        rotacionar_grupo_a_grupo(df_erp, referencia, vendedores_por_grupo, data_limite)
+        grupo_a_grupo = {grupo: sorted(os.listdir(GRUPOS[grupo]['pasta'])) for grupo in GRUPOS}
+        executar_rotacao_mensal(
+            df_erp, referencia, vendedores_por_grupo, list(GRUPOS), rng=np.random.default_rng(0),
+            registrar=False, data_limite=data_limite
+        )
+        assert grupo_a_grupo == {grupo: sorted(os.listdir(GRUPOS[grupo]['pasta'])) for grupo in GRUPOS}
+
+
+# ---------- CONEXÕES ----------
+def test_pragmas_diferentes_para_o_mesmo_banco_sao_recusados(tmp_path):
+    caminho = str(tmp_path / 'pool.db')
+    with conexao_sqlite(caminho, ['PRAGMA journal_mode=WAL']) as conn:
+        conn.execute('CREATE TABLE t (x)')
+    with conexao_sqlite(caminho, ['PRAGMA journal_mode=WAL']) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    with pytest.raises(ValueError, match='já é aberto com'):
+        conexao_sqlite(caminho)
+    with pytest.raises(ValueError, match='já é aberto com'):
+        conexao_sqlite(caminho, ['PRAGMA synchronous=OFF'])
+
+
+# ---------- HISTÓRICO ----------
+def test_resumos_incrementais_iguais_ao_recalculo(tmp_path):
+    rng = np.random.default_rng(0)
+    vendedores = np.asarray([f'Vendedor {i:03d}' for i in range(10)], dtype=object)
+    caminho = str(tmp_path / 'historico_rotacao.db')
+    criar_tabela_historico(caminho)
+    for mes in pd.period_range(end=pd.Timestamp.today(), periods=6, freq='M').strftime('%Y-%m'):
+        registrar_rotacoes(gerar_rotacoes_mes(rng, mes, 500, 2000, vendedores), caminho)
+
+    consulta = 'SELECT * FROM {} ORDER BY 1, 2, 3'
+    with conectar_historico(caminho) as conn:
+        tabelas = ['rotacoes_vendedor_mes', 'contas_vendedor_mes']
+        incrementais = [pd.read_sql_query(consulta.format(tabela), conn) for tabela in tabelas]
+        with conn:
+            recalcular_resumos(conn)
+        for tabela, esperado in zip(tabelas, incrementais):
+            pd.testing.assert_frame_equal(esperado, pd.read_sql_query(consulta.format(tabela), conn))
+
+
+def test_paginacao_por_chave_inclui_linhas_sem_data(tmp_path):
+    caminho = str(tmp_path / 'historico_rotacao.db')
+    criar_tabela_historico(caminho)
+    datas = [None if i % 4 == 0 else f'2024-0{1 + i % 3}-1{i % 2}' for i in range(30)]
+    registrar_rotacoes([(f'Vendedor {i % 2}', i, 'Automática', data, None) for i, data in enumerate(datas)], caminho)
+
+    with conectar_historico(caminho) as conn:
+        ordem = conn.execute('SELECT id, nome_vendedor FROM historico_rotacao ORDER BY data_rotacao DESC, id DESC').fetchall()
+    for filtros in [{}, {'vendedor': 'Vendedor 0'}]:
+        paginas, apos = [], None
+        while True:
+            pagina, apos = pagina_historico(apos, tamanho=4, caminho=caminho, **filtros)
+            paginas.append(pagina)
+            if apos is None:
+                break
+        obtido = pd.concat(paginas, ignore_index=True)
+        assert obtido['id'].tolist() == [i for i, vendedor in ordem if vendedor == filtros.get('vendedor', vendedor)]
+        assert obtido['data_rotacao'].isna().sum() > 0